@@ -1,10 +1,12 @@
 from django.contrib import admin
+from . import busqueda
 from .models import Documento, PermisoDocumento
 
 @admin.register(Documento)
 class DocumentoAdmin(admin.ModelAdmin):
     list_display = ('titulo', 'propietario', 'creado', 'actualizado')
-    search_fields = ('titulo', 'contenido', 'propietario__username')
+    # El contenido se guarda comprimido: se busca por el índice de texto completo
+    search_fields = ('titulo', 'propietario__username')
     list_filter = ('propietario', 'creado')
     readonly_fields = ('creado', 'actualizado')
     
@@ -13,6 +15,14 @@ class DocumentoAdmin(admin.ModelAdmin):
         if request.user.is_superuser:
             return qs
         return qs.filter(propietario=request.user)
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Título y contenido por el índice FTS5 en vez de recorrer la tabla
+        coincidencias = busqueda.filtrar(queryset, search_term)
+        if coincidencias is None:
+            return super().get_search_results(request, queryset, search_term)
+        por_usuario = queryset.filter(propietario__username__icontains=search_term.strip())
+        return coincidencias | por_usuario, False
 
 @admin.register(PermisoDocumento)
 class PermisoDocumentoAdmin(admin.ModelAdmin):
@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 class EditorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'editor'
\ No newline at end of file
+    name = 'editor'
+
+    def ready(self):
+        # Señales que mantienen el índice de búsqueda y el historial
+        from . import busqueda, historial  # noqa: F401
@@ -0,0 +1,183 @@
+"""
+Búsqueda de texto completo en los documentos propios y compartidos.
+
+Con SQLite el índice es la tabla virtual FTS5 ``editor_documento_fts``
+(migración 0004), con una fila por documento cuyo rowid es el id. Se
+mantiene al escribir: ``save()`` y el borrado del modelo por señales, y el
+guardado diferido de las salas con ``actualizar``. Los resultados se ordenan
+por bm25 con más peso en el título. Si la base de datos no es SQLite o se
+compiló sin FTS5, se busca con ``icontains`` en el título y la vista previa
+(el contenido se guarda comprimido).
+``manage.py indexar_documentos`` reconstruye el índice.
+"""
+import logging
+import re
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from .models import Documento, PermisoDocumento
+
+logger = logging.getLogger(__name__)
+
+TABLA = 'editor_documento_fts'
+RESULTADOS_MAX = getattr(settings, 'EDITOR_BUSQUEDA_RESULTADOS', 20)
+
+# Peso de cada columna en bm25 (titulo, contenido)
+PESOS = (10.0, 1.0)
+# Delimitadores de las coincidencias en el fragmento; no aparecen en texto
+# escrito por usuarios y sobreviven al escape HTML
+INICIO_MARCA, FIN_MARCA = '\x02', '\x03'
+PALABRAS_FRAGMENTO = 16
+PREFIJO_MIN = 3
+
+_disponible = None
+
+
+def disponible():
+    """Si existe el índice FTS5 en la base de datos"""
+    global _disponible
+    if _disponible is None:
+        _disponible = False
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [TABLA])
+                _disponible = cursor.fetchone() is not None
+    return _disponible
+
+
+def consulta_fts(texto):
+    """Convierte lo escrito por el usuario en una consulta FTS5 segura
+
+    Cada palabra se busca completa; terminada en ``*`` y con al menos
+    ``PREFIJO_MIN`` letras, también como prefijo. Un prefijo que abarca
+    muchas palabras distintas obliga a unir todas sus listas y a ordenar
+    casi todo el índice, por eso no se aplica por defecto.
+    """
+    terminos = [
+        f'"{palabra}"*' if asterisco and len(palabra) >= PREFIJO_MIN else f'"{palabra}"'
+        for palabra, asterisco in re.findall(r'(\w+)(\*?)', texto)
+    ]
+    return ' '.join(terminos)
+
+
+def indexar(doc_id, titulo, contenido):
+    """Agrega o reemplaza la fila de un documento en el índice"""
+    if not disponible():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLA} WHERE rowid = %s', [doc_id])
+        cursor.execute(
+            f'INSERT INTO {TABLA} (rowid, titulo, contenido) VALUES (%s, %s, %s)',
+            [doc_id, titulo, contenido],
+        )
+
+
+def actualizar(doc_id, **columnas):
+    """Reemplaza solo las columnas indicadas (titulo, contenido)"""
+    if not disponible() or not columnas:
+        return
+    asignaciones = ', '.join(f'{columna} = %s' for columna in columnas)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {TABLA} SET {asignaciones} WHERE rowid = %s', [*columnas.values(), doc_id]
+        )
+
+
+def quitar(doc_id):
+    if not disponible():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLA} WHERE rowid = %s', [doc_id])
+
+
+@receiver(post_save, sender=Documento)
+def _documento_guardado(sender, instance, created, update_fields=None, **kwargs):
+    columnas = {'titulo', 'contenido'} - instance.get_deferred_fields()
+    if update_fields is not None:
+        columnas &= set(update_fields)
+    try:
+        if created:
+            indexar(instance.id, instance.titulo, instance.contenido)
+        else:
+            actualizar(instance.id, **{columna: getattr(instance, columna) for columna in columnas})
+    except Exception as e:
+        logger.error(f"❌ Error al indexar documento {instance.id}: {e}", exc_info=True)
+
+
+@receiver(post_delete, sender=Documento)
+def _documento_eliminado(sender, instance, **kwargs):
+    try:
+        quitar(instance.id)
+    except Exception as e:
+        logger.error(f"❌ Error al quitar del índice el documento {instance.id}: {e}", exc_info=True)
+
+
+def _fragmento(texto):
+    """HTML del fragmento con las coincidencias en <mark>"""
+    return mark_safe(
+        escape(texto).replace(INICIO_MARCA, '<mark>').replace(FIN_MARCA, '</mark>')
+    )
+
+
+def _buscar_fts5(usuario, consulta, limite):
+    documentos = Documento._meta.db_table
+    permisos = PermisoDocumento._meta.db_table
+    usuarios = Documento._meta.get_field('propietario').related_model._meta.db_table
+    resultados = list(Documento.objects.raw(
+        f'''
+        SELECT d.id, d.titulo, d.actualizado, u.username AS propietario_nombre,
+               snippet({TABLA}, 1, %s, %s, '…', %s) AS fragmento
+        FROM {TABLA}
+        JOIN {documentos} d ON d.id = {TABLA}.rowid
+        JOIN {usuarios} u ON u.id = d.propietario_id
+        WHERE {TABLA} MATCH %s
+          AND (d.propietario_id = %s OR EXISTS (
+              SELECT 1 FROM {permisos} p WHERE p.documento_id = d.id AND p.usuario_id = %s
+          ))
+        ORDER BY bm25({TABLA}, {PESOS[0]}, {PESOS[1]})
+        LIMIT %s
+        ''',
+        [INICIO_MARCA, FIN_MARCA, PALABRAS_FRAGMENTO, consulta, usuario.id, usuario.id, limite],
+    ))
+    for doc in resultados:
+        doc.fragmento = _fragmento(doc.fragmento or '')
+    return resultados
+
+
+def _buscar_basico(usuario, texto, limite):
+    documentos = Documento.objects.filter(Q(propietario=usuario) | Q(permisos__usuario=usuario))
+    for palabra in re.findall(r'\w+', texto):
+        documentos = documentos.filter(Q(titulo__icontains=palabra) | Q(vista_previa__icontains=palabra))
+    resultados = list(
+        documentos.distinct()
+        .only('id', 'titulo', 'actualizado', 'vista_previa')
+        .annotate(propietario_nombre=F('propietario__username'))[:limite]
+    )
+    for doc in resultados:
+        doc.fragmento = doc.vista_previa
+    return resultados
+
+
+def filtrar(documentos, texto):
+    """Restringe un queryset de documentos a los que coinciden con el texto (sin orden por relevancia)"""
+    consulta = consulta_fts(texto)
+    if not consulta or not disponible():
+        return None
+    return documentos.filter(
+        id__in=RawSQL(f'SELECT rowid FROM {TABLA} WHERE {TABLA} MATCH %s', [consulta])
+    )
+
+
+def buscar(usuario, texto, limite=RESULTADOS_MAX):
+    """Documentos visibles para el usuario que coinciden con el texto, con ``propietario_nombre`` y ``fragmento``"""
+    consulta = consulta_fts(texto)
+    if not consulta:
+        return []
+    if disponible():
+        return _buscar_fts5(usuario, consulta, limite)
+    return _buscar_basico(usuario, texto, limite)
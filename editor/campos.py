@@ -0,0 +1,78 @@
+"""
+Campo de texto que se guarda comprimido si ``EDITOR_COMPRIMIR_CONTENIDO``.
+
+Activado, en la base de datos el valor es un BLOB con un byte de cabecera,
+igual que las tramas binarias de ``protocolo``: 0 = UTF-8 sin comprimir,
+1 = zlib. Los textos de menos de ``EDITOR_CONTENIDO_UMBRAL`` bytes, o los que
+no se reducen, quedan sin comprimir. Quien use el modelo siempre ve ``str``;
+por eso así no admite búsquedas ``contains``.
+
+Desactivado (por defecto) es un ``TextField`` normal: la columna se crea de
+texto y admite ``icontains`` y demás búsquedas. Lo ya comprimido se sigue
+leyendo. El tipo de la columna se decide al migrar; SQLite guarda los dos
+tipos en cualquier columna, en otros motores cambiar el ajuste después
+requiere convertir la columna.
+"""
+import zlib
+from django.conf import settings
+from django.db import models
+
+SIN_COMPRIMIR = 0
+ZLIB = 1
+
+COMPRIMIR = getattr(settings, 'EDITOR_COMPRIMIR_CONTENIDO', False)
+UMBRAL = getattr(settings, 'EDITOR_CONTENIDO_UMBRAL', 512)
+NIVEL = 6
+
+
+def comprimir_texto(texto):
+    datos = texto.encode('utf-8')
+    if COMPRIMIR and len(datos) >= UMBRAL:
+        comprimido = zlib.compress(datos, NIVEL)
+        if len(comprimido) < len(datos):
+            return bytes([ZLIB]) + comprimido
+    return bytes([SIN_COMPRIMIR]) + datos
+
+
+def descomprimir_texto(valor):
+    """Texto de un valor guardado; acepta filas en texto plano anteriores al campo"""
+    if isinstance(valor, str):
+        return valor
+    valor = bytes(valor)
+    if not valor:
+        return ''
+    if valor[0] == ZLIB:
+        return zlib.decompress(valor[1:]).decode('utf-8')
+    if valor[0] == SIN_COMPRIMIR:
+        return valor[1:].decode('utf-8')
+    raise ValueError(f'Cabecera de contenido desconocida: {valor[0]}')
+
+
+class TextoComprimido(models.TextField):
+    """TextField guardado como BLOB comprimido, o como texto si la compresión está desactivada"""
+
+    def get_internal_type(self):
+        return 'BinaryField' if COMPRIMIR else 'TextField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return descomprimir_texto(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return descomprimir_texto(value)
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None or not COMPRIMIR:
+            return value
+        return comprimir_texto(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None or not COMPRIMIR:
+            return value
+        return connection.Database.Binary(value)
@@ -0,0 +1,472 @@
+"""
+Channel layer entre procesos de la misma máquina, sin Redis.
+
+Un broker pequeño (``manage.py broker_canales`` o ``manage.py servir``)
+escucha en un socket Unix y mantiene los grupos, las colas de los canales
+normales y las reservas. Cada proceso de Daphne se conecta con
+``UnixSocketChannelLayer``: los mensajes para sus canales específicos
+(``prefijo!...``) se le empujan y se reparten localmente, así que un
+``group_send`` cruza el socket una sola vez por proceso y no por miembro.
+
+Las tramas son ``longitud (4 bytes) + msgpack``; el cuerpo de cada mensaje
+viaja ya empaquetado y el broker lo reenvía sin decodificarlo.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import random
+import string
+import time
+from collections import deque
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+RUTA_SOCKET = '/tmp/editor-canales.sock'
+
+# Tramas mayores se consideran un error de protocolo
+MAX_TRAMA = 64 * 1024 * 1024
+
+# Bytes pendientes de escribir a un proceso lento antes de descartar mensajes
+MAX_BUFFER_CONEXION = 32 * 1024 * 1024
+
+
+def _empaquetar(obj):
+    datos = msgpack.packb(obj, use_bin_type=True)
+    return len(datos).to_bytes(4, 'big') + datos
+
+
+async def _leer_trama(reader):
+    largo = int.from_bytes(await reader.readexactly(4), 'big')
+    if largo > MAX_TRAMA:
+        raise ConnectionError(f'Trama de {largo} bytes demasiado grande')
+    return msgpack.unpackb(await reader.readexactly(largo), raw=False)
+
+
+def _prefijo(canal):
+    """Parte no local de un canal específico (hasta el ``!`` incluido)"""
+    return canal[:canal.index('!') + 1]
+
+
+class BrokerCanales:
+    """Servidor del channel layer: un solo hilo, procesa las tramas en orden"""
+
+    def __init__(self, socket_path=RUTA_SOCKET, capacity=100):
+        self.socket_path = str(socket_path)
+        self.capacity = capacity
+        self.rutas = {}      # prefijo -> writer del proceso dueño
+        self.prefijos = {}   # writer -> prefijos registrados
+        self.grupos = {}     # grupo -> {canal: expira_en}
+        self.colas = {}      # canal normal -> deque[(expira, datos)]
+        self.esperas = {}    # canal normal -> deque[(writer, id)]
+        self.reservas = {}   # clave -> (writer, canal)
+
+    async def servir(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        servidor = await asyncio.start_unix_server(self._atender, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        logger.info(f"📡 Broker de canales escuchando en {self.socket_path}")
+        async with servidor:
+            await servidor.serve_forever()
+
+    async def _atender(self, reader, writer):
+        self.prefijos[writer] = set()
+        try:
+            while True:
+                self._procesar(writer, await _leer_trama(reader))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"❌ Error en el broker de canales: {e}", exc_info=True)
+        finally:
+            self._desconectar(writer)
+            writer.close()
+
+    def _escribir(self, writer, obj):
+        if writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > MAX_BUFFER_CONEXION:
+            logger.warning("⚠️ Proceso sin leer del broker, se descartan mensajes")
+            return
+        writer.write(_empaquetar(obj))
+
+    def _procesar(self, writer, trama):
+        operacion, argumentos = trama[0], trama[1:]
+        getattr(self, f'_op_{operacion}')(writer, *argumentos)
+
+    # Operaciones
+
+    def _op_ruta(self, writer, prefijo):
+        self.rutas[prefijo] = writer
+        self.prefijos[writer].add(prefijo)
+
+    def _op_enviar(self, writer, canal, expira, datos, id_respuesta):
+        entregado = self._entregar(canal, expira, datos)
+        if id_respuesta is not None:
+            self._escribir(writer, ['respuesta', id_respuesta, entregado])
+
+    def _op_recibir(self, writer, canal, id_respuesta):
+        cola = self.colas.get(canal)
+        ahora = time.time()
+        while cola:
+            expira, datos = cola.popleft()
+            if expira >= ahora:
+                self._escribir(writer, ['mensaje', id_respuesta, canal, expira, datos])
+                return
+        self.colas.pop(canal, None)
+        self.esperas.setdefault(canal, deque()).append((writer, id_respuesta))
+
+    def _op_group_add(self, writer, grupo, canal, expira, id_respuesta):
+        self.grupos.setdefault(grupo, {})[canal] = expira
+        self._escribir(writer, ['respuesta', id_respuesta, True])
+
+    def _op_group_discard(self, writer, grupo, canal, id_respuesta):
+        miembros = self.grupos.get(grupo)
+        if miembros is not None:
+            miembros.pop(canal, None)
+            if not miembros:
+                del self.grupos[grupo]
+        self._escribir(writer, ['respuesta', id_respuesta, True])
+
+    def _op_group_send(self, writer, grupo, expira, datos):
+        miembros = self.grupos.get(grupo)
+        if not miembros:
+            return
+
+        ahora = time.time()
+        por_proceso = {}
+        for canal, vence in list(miembros.items()):
+            if vence < ahora:
+                del miembros[canal]
+            elif '!' in canal:
+                por_proceso.setdefault(_prefijo(canal), []).append(canal)
+            else:
+                self._encolar(canal, expira, datos)
+
+        # Una sola trama por proceso con la lista de sus canales
+        for prefijo, canales in por_proceso.items():
+            destino = self.rutas.get(prefijo)
+            if destino is not None:
+                self._escribir(destino, ['mensajes', canales, expira, datos])
+
+    def _op_reservar(self, writer, clave, canal, id_respuesta):
+        dueno = self.reservas.setdefault(clave, (writer, canal))
+        self._escribir(writer, ['respuesta', id_respuesta, dueno[1]])
+
+    def _op_liberar(self, writer, clave, canal):
+        if self.reservas.get(clave, (None, None))[1] == canal:
+            del self.reservas[clave]
+
+    def _op_flush(self, writer, id_respuesta):
+        self.grupos.clear()
+        self.colas.clear()
+        self.reservas.clear()
+        self._escribir(writer, ['respuesta', id_respuesta, True])
+
+    # Entrega
+
+    def _entregar(self, canal, expira, datos):
+        if '!' in canal:
+            destino = self.rutas.get(_prefijo(canal))
+            if destino is None:
+                return True
+            self._escribir(destino, ['mensajes', [canal], expira, datos])
+            return True
+        return self._encolar(canal, expira, datos)
+
+    def _encolar(self, canal, expira, datos):
+        esperas = self.esperas.get(canal)
+        while esperas:
+            writer, id_respuesta = esperas.popleft()
+            if not writer.is_closing():
+                if not esperas:
+                    del self.esperas[canal]
+                self._escribir(writer, ['mensaje', id_respuesta, canal, expira, datos])
+                return True
+        self.esperas.pop(canal, None)
+
+        cola = self.colas.setdefault(canal, deque())
+        if len(cola) >= self.capacity:
+            return False
+        cola.append((expira, datos))
+        return True
+
+    def _desconectar(self, writer):
+        """Limpia rutas, grupos y reservas de un proceso que se fue"""
+        prefijos = self.prefijos.pop(writer, set())
+        for prefijo in prefijos:
+            if self.rutas.get(prefijo) is writer:
+                del self.rutas[prefijo]
+        for grupo, miembros in list(self.grupos.items()):
+            for canal in [c for c in miembros if '!' in c and _prefijo(c) in prefijos]:
+                del miembros[canal]
+            if not miembros:
+                del self.grupos[grupo]
+        for clave, (dueno, _) in list(self.reservas.items()):
+            if dueno is writer:
+                del self.reservas[clave]
+
+
+class _Conexion:
+    """Conexión de un event loop con el broker"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.colas = {}       # canal -> asyncio.Queue[(expira, datos)]
+        self.respuestas = {}  # id -> Future
+        self.prefijos = set()
+        # Lo que el broker sabe de este proceso, para volver a registrarlo si
+        # la conexión se pierde: grupos de canales locales y reservas propias
+        self.grupos = set()   # (grupo, canal)
+        self.reservas = {}    # clave -> canal
+        self.ids = itertools.count()
+        self.lector = None
+
+    def heredar(self, anterior):
+        """Continúa una conexión perdida: las colas siguen siendo las que esperan los consumers"""
+        self.colas = anterior.colas
+        self.prefijos = anterior.prefijos
+        self.grupos = anterior.grupos
+        self.reservas = anterior.reservas
+
+    def escribir(self, obj):
+        self.writer.write(_empaquetar(obj))
+
+    async def pedir(self, *trama):
+        """Envía una petición y espera la respuesta del broker"""
+        id_respuesta = next(self.ids)
+        futuro = asyncio.get_running_loop().create_future()
+        self.respuestas[id_respuesta] = futuro
+        self.escribir([*trama, id_respuesta])
+        try:
+            return await futuro
+        finally:
+            self.respuestas.pop(id_respuesta, None)
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """Channel layer cliente del ``BrokerCanales`` por socket Unix"""
+
+    extensions = ['groups', 'flush', 'reservas']
+
+    def __init__(
+        self,
+        socket_path=RUTA_SOCKET,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        **kwargs
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.socket_path = str(socket_path)
+        self.group_expiry = group_expiry
+        self.cliente = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        self._conexiones = {}  # event loop -> _Conexion
+        self._perdidas = {}    # event loop -> _Conexion cerrada por el broker, hasta reconectar
+
+    # Conexión
+
+    async def _conexion(self):
+        loop = asyncio.get_running_loop()
+        conexion = self._conexiones.get(loop)
+        if conexion is not None:
+            return conexion
+
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        conexion = self._conexiones.get(loop)
+        if conexion is not None:
+            writer.close()
+            return conexion
+
+        conexion = _Conexion(reader, writer)
+        anterior = self._perdidas.pop(loop, None)
+        if anterior is not None:
+            conexion.heredar(anterior)
+        conexion.lector = loop.create_task(self._leer(loop, conexion))
+        self._conexiones[loop] = conexion
+        if anterior is not None:
+            await self._restaurar(conexion)
+        return conexion
+
+    async def _restaurar(self, conexion):
+        """El broker olvidó las rutas, grupos y reservas del proceso: se registran de nuevo"""
+        for prefijo in conexion.prefijos:
+            conexion.escribir(['ruta', prefijo])
+        for grupo, canal in list(conexion.grupos):
+            await conexion.pedir('group_add', grupo, canal, time.time() + self.group_expiry)
+        for clave, canal in list(conexion.reservas.items()):
+            dueno = await conexion.pedir('reservar', clave, canal)
+            if dueno != canal:
+                # Otro proceso la tomó mientras tanto
+                del conexion.reservas[clave]
+                logger.warning(f"⚠️ Reserva {clave} perdida al reconectar con el broker: ahora es de {dueno}")
+        logger.info(
+            f"🔌 Reconectado al broker de canales: {len(conexion.prefijos)} rutas, "
+            f"{len(conexion.grupos)} grupos y {len(conexion.reservas)} reservas restaurados"
+        )
+
+    async def _leer(self, loop, conexion):
+        try:
+            while True:
+                trama = await _leer_trama(conexion.reader)
+                tipo = trama[0]
+                if tipo == 'mensajes':
+                    _, canales, expira, datos = trama
+                    for canal in canales:
+                        self._depositar(conexion, canal, expira, datos)
+                elif tipo == 'mensaje':
+                    _, id_respuesta, canal, expira, datos = trama
+                    futuro = conexion.respuestas.get(id_respuesta)
+                    if futuro is not None and not futuro.done():
+                        futuro.set_result((expira, datos))
+                    else:
+                        # El receptor ya no espera: se guarda para el siguiente
+                        self._depositar(conexion, canal, expira, datos)
+                elif tipo == 'respuesta':
+                    futuro = conexion.respuestas.get(trama[1])
+                    if futuro is not None and not futuro.done():
+                        futuro.set_result(trama[2])
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.warning(f"⚠️ Conexión con el broker de canales perdida: {e}")
+        finally:
+            if self._conexiones.get(loop) is conexion:
+                del self._conexiones[loop]
+                self._perdidas[loop] = conexion
+            for futuro in conexion.respuestas.values():
+                if not futuro.done():
+                    futuro.set_exception(ConnectionError('Broker de canales desconectado'))
+            conexion.writer.close()
+
+    def _depositar(self, conexion, canal, expira, datos):
+        cola = conexion.colas.setdefault(canal, asyncio.Queue())
+        if cola.qsize() >= self.get_capacity(canal):
+            logger.debug(f"Canal {canal} lleno, mensaje descartado")
+            return
+        cola.put_nowait((expira, datos))
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+
+        conexion = await self._conexion()
+        expira = time.time() + self.expiry
+        datos = msgpack.packb(message, use_bin_type=True)
+
+        if '!' in channel:
+            if _prefijo(channel) in conexion.prefijos:
+                # Canal de este mismo proceso: no hace falta pasar por el broker
+                cola = conexion.colas.setdefault(channel, asyncio.Queue())
+                if cola.qsize() >= self.get_capacity(channel):
+                    raise ChannelFull(channel)
+                cola.put_nowait((expira, datos))
+            else:
+                conexion.escribir(['enviar', channel, expira, datos, None])
+                await conexion.writer.drain()
+            return
+
+        if not await conexion.pedir('enviar', channel, expira, datos):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        conexion = await self._conexion()
+
+        while True:
+            cola = conexion.colas.get(channel)
+            if '!' in channel or (cola is not None and not cola.empty()):
+                cola = conexion.colas.setdefault(channel, asyncio.Queue())
+                try:
+                    expira, datos = await cola.get()
+                finally:
+                    if cola.empty() and conexion.colas.get(channel) is cola:
+                        del conexion.colas[channel]
+            else:
+                expira, datos = await conexion.pedir('recibir', channel)
+
+            if expira >= time.time():
+                return msgpack.unpackb(datos, raw=False)
+
+    def mensajes_en_cola(self):
+        """Mensajes recibidos del broker que aún nadie leyó en este proceso"""
+        return sum(
+            cola.qsize()
+            for conexion in self._conexiones.values()
+            for cola in conexion.colas.values()
+        )
+
+    async def new_channel(self, prefix="specific."):
+        conexion = await self._conexion()
+        prefijo = f"{prefix}{self.cliente}!"
+        if prefijo not in conexion.prefijos:
+            conexion.prefijos.add(prefijo)
+            conexion.escribir(['ruta', prefijo])
+        return prefijo + ''.join(random.choice(string.ascii_letters) for _ in range(12))
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        conexion = await self._conexion()
+        if '!' in channel and _prefijo(channel) in conexion.prefijos:
+            conexion.grupos.add((group, channel))
+        await conexion.pedir('group_add', group, channel, time.time() + self.group_expiry)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), "Invalid channel name"
+        assert self.valid_group_name(group), "Invalid group name"
+        conexion = await self._conexion()
+        conexion.grupos.discard((group, channel))
+        await conexion.pedir('group_discard', group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        conexion = await self._conexion()
+        datos = msgpack.packb(message, use_bin_type=True)
+        conexion.escribir(['group_send', group, time.time() + self.expiry, datos])
+        await conexion.writer.drain()
+
+    # Reservas extension
+
+    async def reservar(self, clave, canal):
+        """Reserva ``clave`` para ``canal`` si está libre; devuelve el canal dueño"""
+        conexion = await self._conexion()
+        dueno = await conexion.pedir('reservar', clave, canal)
+        if dueno == canal:
+            conexion.reservas[clave] = canal
+        return dueno
+
+    async def liberar(self, clave, canal):
+        """Libera la reserva de ``clave`` si pertenece a ``canal``"""
+        conexion = await self._conexion()
+        if conexion.reservas.get(clave) == canal:
+            del conexion.reservas[clave]
+        conexion.escribir(['liberar', clave, canal])
+        await conexion.writer.drain()
+
+    # Flush extension
+
+    async def flush(self):
+        conexion = await self._conexion()
+        conexion.colas.clear()
+        conexion.grupos.clear()
+        conexion.reservas.clear()
+        await conexion.pedir('flush')
+
+    async def close(self):
+        for conexion in list(self._conexiones.values()):
+            conexion.lector.cancel()
+            conexion.writer.close()
+        self._conexiones.clear()
@@ -1,8 +1,18 @@
+import asyncio
 import json
 import logging
+import time
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from . import limites, metricas, salas, tickets
+from .flujo import ControlFlujo, contadores
 from .models import Documento
+from .notificaciones import nombre_grupo, nombre_grupo_lectores
+from .operaciones import OperacionInvalida, RevisionDesconocida
+from .permisos import acceso_desde_permiso, anotar_permiso
+from .persistencia import guardado_diferido
+from .protocolo import SUBPROTOCOLO_BINARIO, TramaDemasiadoGrande, codificar, decodificar_binario
 
 # Configurar logger
 logger = logging.getLogger(__name__)
@@ -11,7 +21,56 @@ class DocumentoConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         # Obtener el ID del documento desde la URL
         self.doc_id = self.scope['url_route']['kwargs']['doc_id']
-        self.room_group_name = f'documento_{self.doc_id}'
+        self.room_group_name = nombre_grupo(self.doc_id)
+        self.sala = None
+        self.aceptado = False
+        self.admitido = False
+        self.puede_ver = False
+        self.puede_editar = False
+        self.eliminado = False
+        self.renovacion = None
+        
+        # Los clientes nuevos piden el protocolo de operaciones con ?protocolo=ops
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.protocolo_ops = query.get('protocolo', [''])[0] == 'ops'
+        
+        # Tramas binarias (msgpack) si el cliente negocia el subprotocolo
+        self.binario = SUBPROTOCOLO_BINARIO in self.scope.get('subprotocols', [])
+        if self.binario:
+            self.protocolo_ops = True
+        
+        # Al reconectar el cliente indica su última revisión y época para
+        # recibir solo las operaciones que le faltan
+        self.reanudar_desde = None
+        self.revision_cliente = -1
+        if self.protocolo_ops and 'revision' in query:
+            try:
+                self.reanudar_desde = (int(query['revision'][0]), query.get('epoca', [''])[0])
+            except ValueError:
+                pass
+        
+        # Tramas sin confirmar por el cliente; con la ventana llena las
+        # operaciones se omiten hasta ``revision_omitida``
+        self.flujo = ControlFlujo()
+        self.revision_omitida = None
+        
+        # Envío en curso del estado completo en fragmentos (documentos grandes)
+        self.transmision = None
+        self.hay_espacio = asyncio.Event()
+        
+        # Con el proceso lleno se rechaza antes de tocar la base de datos; el
+        # cliente reintenta al cerrarse el socket
+        self.admitido = limites.admitir_socket()
+        if not self.admitido:
+            logger.warning(f"🚦 Conexión al documento {self.doc_id} rechazada: {limites.SOCKETS_MAX} sockets abiertos")
+            await self.accept(subprotocol=SUBPROTOCOLO_BINARIO if self.binario else None)
+            await self.enviar({
+                'tipo': 'error',
+                'codigo': 'sockets',
+                'mensaje': 'El servidor está ocupado, se reintentará la conexión'
+            })
+            await self.close(code=1013)
+            return
         
         # Verificar que el usuario esté autenticado
         user = self.scope.get('user')
@@ -20,29 +79,50 @@ class DocumentoConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
-        # Verificar permisos de visualización
-        puede_ver = await self.verificar_permisos_visualizacion()
-        if not puede_ver:
+        # Resolver los permisos una sola vez; las vistas avisan si cambian.
+        # Si la sala ya está en memoria se usan los del usuario o los del
+        # ticket; si no, la consulta también comprueba que el documento existe
+        generacion = salas.generacion_permisos(self.doc_id)
+        permisos = salas.permisos_en_cache(self.doc_id, user.id)
+        if permisos is None and salas.abierta(self.doc_id):
+            permisos = tickets.permisos(self.scope.get('ticket'), self.doc_id)
+        if permisos is None:
+            permisos = await self.verificar_permisos()
+        self.puede_ver, self.puede_editar = permisos
+        if not self.puede_ver:
             logger.warning(f"❌ Usuario {user.username} sin permisos para ver documento {self.doc_id}")
             await self.close()
             return
         
-        # Unirse al grupo del documento
+        # Unirse al grupo del documento: los lectores van aparte y reciben
+        # el estado completo a ritmo limitado en lugar de cada operación
+        self.room_group_name = self.grupo_segun_permisos()
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
         
-        await self.accept()
+        await self.accept(subprotocol=SUBPROTOCOLO_BINARIO if self.binario else None)
+        self.aceptado = True
+        metricas.sockets_abiertos.inc()
+        
+        # Abrir la sala del documento (una vez por proceso); si el dueño es
+        # otro worker el contenido inicial llega en documento_snapshot
+        self.sala = await salas.abrir(self.doc_id, self.channel_name)
         
         # Enviar el contenido actual del documento al conectarse
-        contenido = await self.get_documento_contenido()
-        await self.send(text_data=json.dumps({
-            'tipo': 'inicial',
-            'contenido': contenido
-        }))
+        if self.sala is not None:
+            salas.recordar_permisos(self.sala, user.id, permisos, generacion)
+            await self.enviar_inicial()
         
-        logger.info(f"✅ Usuario {user.username} conectado al documento {self.doc_id}")
+        # Ticket para reconectar sin sesión (solo lo entiende el cliente de operaciones)
+        if self.protocolo_ops:
+            await self.enviar_ticket()
+        
+        logger.info(
+            "✅ Usuario %s conectado al documento %s", user.username, self.doc_id,
+            extra={'doc_id': self.doc_id, 'usuario': user.username, 'evento': 'conexion'},
+        )
     
     async def disconnect(self, close_code):
         # Obtener usuario para el log
@@ -54,9 +134,35 @@ class DocumentoConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
-        logger.info(f"❌ Usuario {username} desconectado del documento {self.doc_id}")
+        
+        if self.aceptado:
+            metricas.sockets_abiertos.dec()
+        if self.admitido:
+            limites.liberar_socket()
+            self.admitido = False
+        self.cancelar_transmision()
+        if self.renovacion is not None:
+            self.renovacion.cancel()
+            self.renovacion = None
+        
+        # Guardar y liberar la sala con la última conexión
+        if self.sala is not None:
+            await salas.cerrar(self.sala)
+        elif self.puede_ver:
+            await salas.cancelar_apertura(self.doc_id)
+        logger.info(
+            "❌ Usuario %s desconectado del documento %s", username, self.doc_id,
+            extra={'doc_id': self.doc_id, 'usuario': username, 'evento': 'desconexion'},
+        )
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        inicio = time.perf_counter()
+        # En bytes, como el límite: el texto se mide codificado en UTF-8
+        tamano = len(text_data.encode('utf-8') if bytes_data is None else bytes_data)
+        metricas.bytes_recibidos.inc(tamano)
+        # Tramas que llegan tras eliminarse el documento: no hay dónde guardarlas
+        if self.eliminado or (self.sala is not None and self.sala.eliminada):
+            return
         try:
             user = self.scope.get('user')
             
@@ -65,154 +171,385 @@ class DocumentoConsumer(AsyncWebsocketConsumer):
                 logger.warning(f"⚠️ Intento de edición sin autenticación en documento {self.doc_id}")
                 return
             
+            if tamano > limites.MENSAJE_MAX_BYTES:
+                await self.rechazar_trama(tamano)
+                return
+            
             # Recibir mensaje del WebSocket
-            data = json.loads(text_data)
-            contenido = data.get('contenido', '')
+            if bytes_data is not None:
+                data = decodificar_binario(bytes_data, limites.MENSAJE_MAX_BYTES)
+            else:
+                data = json.loads(text_data)
+            if not isinstance(data, dict):
+                raise ValueError('El mensaje no es un objeto')
             
-            # Verificar permisos de edición
-            puede_editar = await self.verificar_permisos_edicion()
+            # Confirmación de tramas procesadas (también de lectores)
+            if data.get('tipo') == 'recibido':
+                await self.confirmar_recibido(data.get('tramas'))
+                return
             
-            if not puede_editar:
+            # Verificar permisos de edición (resueltos en connect)
+            if not self.puede_editar:
                 logger.warning(f"⚠️ Usuario {user.username} sin permisos de edición en documento {self.doc_id}")
-                await self.send(text_data=json.dumps({
+                await self.enviar({
                     'tipo': 'error',
                     'mensaje': 'No tienes permisos para editar este documento'
-                }))
+                })
                 return
             
-            logger.info(f"📝 Usuario {user.username} guardando contenido en documento {self.doc_id}...")
+            # Aún esperando el estado del documento
+            if self.sala is None:
+                return
             
-            # Guardar en la base de datos
-            guardado = await self.save_documento_contenido(contenido)
+            # Sin fichas la edición se descarta; el cliente la reenvía pasada la espera
+            espera = limites.admitir_edicion(user.id, self.doc_id, tamano)
+            if espera:
+                logger.debug(
+                    "   🚦 Edición de %s en documento %s limitada %.2fs", user.username, self.doc_id, espera,
+                    extra={'doc_id': self.doc_id, 'usuario': user.username, 'evento': 'limite'},
+                )
+                await self.enviar({
+                    'tipo': 'error',
+                    'codigo': 'limite',
+                    'mensaje': 'Demasiadas ediciones, espera un momento',
+                    'reintentar': round(espera, 3)
+                })
+                return
             
-            if guardado:
-                logger.info(f"✅ Contenido guardado exitosamente ({len(contenido)} caracteres)")
-            else:
-                logger.warning(f"⚠️ No se pudo guardar el contenido")
+            try:
+                if data.get('tipo') == 'op':
+                    # Operación de inserción/borrado sobre una revisión conocida
+                    await salas.editar(
+                        self.sala,
+                        self.channel_name,
+                        revision=data.get('revision'),
+                        ops=data.get('ops'),
+                    )
+                else:
+                    # Contenido completo (clientes antiguos); si es el mismo que ya
+                    # tiene la sala no se guarda ni se difunde
+                    contenido = data.get('contenido', '')
+                    if contenido == self.sala.estado.contenido:
+                        contadores['ediciones_sin_cambios'] += 1
+                        return
+                    await salas.editar(self.sala, self.channel_name, contenido=contenido)
+            except (OperacionInvalida, RevisionDesconocida, TypeError) as e:
+                logger.warning(f"⚠️ Operación rechazada en documento {self.doc_id}: {e}")
+                await self.documento_rechazado({})
+                return
+            metricas.latencia_difusion.observar(time.perf_counter() - inicio)
             
-            # Enviar el mensaje a todos los miembros del grupo
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'documento_update',
-                    'contenido': contenido
-                }
+            # Uno por edición: el filtro de muestreo los limita por segundo
+            logger.info(
+                "📝 Usuario %s editó el documento %s", user.username, self.doc_id,
+                extra={'doc_id': self.doc_id, 'usuario': user.username, 'evento': 'edicion'},
             )
-        except json.JSONDecodeError as e:
-            logger.error(f"❌ Error al decodificar JSON: {e}")
+        except TramaDemasiadoGrande:
+            await self.rechazar_trama(tamano)
+        except ValueError as e:
+            # Incluye json.JSONDecodeError y las tramas binarias inválidas
+            logger.error(f"❌ Error al decodificar el mensaje: {e}")
         except Exception as e:
             logger.error(f"❌ Error en receive: {e}", exc_info=True)
     
+    async def rechazar_trama(self, tamano):
+        """Cierra el socket que envió una trama mayor que ``EDITOR_MENSAJE_MAX_BYTES``"""
+        limites.rechazos['tamano'] += 1
+        logger.warning(f"🚦 Trama de {tamano} bytes en documento {self.doc_id} supera el máximo, se desconecta")
+        await self.enviar({
+            'tipo': 'error',
+            'codigo': 'tamano',
+            'mensaje': 'El mensaje es demasiado grande'
+        })
+        await self.close(code=1009)
+    
     async def documento_update(self, event):
         # Recibir mensaje del grupo y enviarlo al WebSocket
-        contenido = event['contenido']
+        if self.sala is None:
+            return
+        
+        # En otro worker la réplica avanza con la operación difundida
+        if not salas.avanzar(self.sala, event):
+            logger.warning(f"⚠️ Réplica del documento {self.doc_id} desincronizada, se pide el estado")
+            await salas.resincronizar(self.sala, self.channel_name)
+            return
+        
+        # Operaciones ya incluidas en el estado inicial enviado al cliente
+        if event['revision'] <= self.revision_cliente:
+            return
         
-        await self.send(text_data=json.dumps({
-            'tipo': 'update',
-            'contenido': contenido
-        }))
+        if event['origen'] == self.channel_name:
+            # El autor ya tiene la edición en pantalla: solo se confirma la revisión
+            if self.revision_omitida is not None:
+                await self.ponerse_al_dia()
+            self.revision_cliente = event['revision']
+            if self.protocolo_ops:
+                ack = {'tipo': 'ack', 'revision': event['revision']}
+                if 'epoca' in event:
+                    ack['epoca'] = event['epoca']
+                await self.enviar(ack)
+            return
+        
+        if self.revision_omitida is not None or self.transmision is not None or self.flujo.saturado():
+            # El cliente no da abasto (o aún recibe el estado en fragmentos): la
+            # operación se agrupa en la próxima puesta al día
+            if self.revision_omitida is None and self.flujo.estancado():
+                contadores['clientes_desconectados'] += 1
+                logger.warning(f"🐢 Cliente del documento {self.doc_id} sin leer hace más de {self.flujo.espera_max}s, se desconecta")
+                await self.close(code=4008)
+            self.revision_omitida = event['revision']
+            contadores['operaciones_omitidas'] += 1
+            return
+        self.revision_cliente = event['revision']
+        
+        if self.binario:
+            await self.send(bytes_data=event['binario'])
+        elif self.protocolo_ops:
+            await self.send(text_data=event['texto'])
+        else:
+            # Clientes antiguos: el contenido completo más reciente, serializado una vez por sala
+            await self.send(text_data=self.sala.trama_contenido('update'))
     
-    @database_sync_to_async
-    def get_documento_contenido(self):
-        try:
-            doc = Documento.objects.get(id=self.doc_id)
-            logger.info(f"📄 Contenido cargado del documento {self.doc_id}: {len(doc.contenido)} caracteres")
-            return doc.contenido
-        except Documento.DoesNotExist:
-            logger.warning(f"⚠️ Documento {self.doc_id} no existe")
-            return ""
-        except Exception as e:
-            logger.error(f"❌ Error al cargar documento: {e}", exc_info=True)
-            return ""
+    async def permisos_actualizados(self, event):
+        # Una vista cambió permisos de este documento: volver a resolver los propios
+        salas.olvidar_permisos(self.doc_id, event['usuarios'])
+        user = self.scope.get('user')
+        if user.id not in event['usuarios']:
+            return
+        
+        puede_ver, self.puede_editar = await self.verificar_permisos()
+        if not puede_ver:
+            logger.info(f"🔒 Acceso revocado a {user.username} en documento {self.doc_id}")
+            await self.enviar({
+                'tipo': 'error',
+                'mensaje': 'Ya no tienes acceso a este documento'
+            })
+            await self.close()
+            return
+        
+        await self.enviar({
+            'tipo': 'permisos',
+            'puede_editar': self.puede_editar
+        })
+        if self.protocolo_ops:
+            await self.enviar_ticket()
+        
+        # Pasar de lector a editor (o al revés) cambia de grupo; el estado
+        # completo deja al cliente en la revisión actual
+        grupo = self.grupo_segun_permisos()
+        if grupo != self.room_group_name:
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+            self.room_group_name = grupo
+            await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+            if self.sala is not None:
+                await self.enviar_inicial()
     
-    @database_sync_to_async
-    def save_documento_contenido(self, contenido):
+    async def documento_lectura(self, event):
+        # Estado periódico para los lectores: solo importa el más reciente
+        if self.sala is None:
+            return
+        if not self.sala.es_local:
+            salas.recibir_snapshot(self.doc_id, event)
+        
+        revision = self.sala.estado.revision
+        if revision <= self.revision_cliente:
+            return
+        if self.revision_omitida is not None or self.transmision is not None or self.flujo.saturado():
+            self.revision_omitida = revision
+            contadores['operaciones_omitidas'] += 1
+            return
+        
+        if self.protocolo_ops and self.sala.fragmentado():
+            await self.enviar_inicial()
+            return
+        self.revision_cliente = revision
+        trama = self.sala.trama_contenido('inicial' if self.protocolo_ops else 'update', self.binario)
+        if self.binario:
+            await self.send(bytes_data=trama)
+        else:
+            await self.send(text_data=trama)
+    
+    async def documento_eliminado(self, event):
+        # El documento fue eliminado: descartar cambios pendientes y cerrar
+        self.eliminado = True
+        guardado_diferido.descartar(self.doc_id)
+        salas.marcar_eliminada(self.doc_id)
+        await self.enviar({
+            'tipo': 'error',
+            'mensaje': 'El documento fue eliminado'
+        })
+        await self.close()
+    
+    async def documento_snapshot(self, event):
+        # Estado enviado por el worker dueño del documento
+        primera = self.sala is None
+        self.sala = salas.recibir_snapshot(self.doc_id, event)
+        if primera:
+            self.sala.conectados += 1
+        await self.enviar_inicial()
+    
+    async def documento_rechazado(self, event):
+        # El dueño no pudo aplicar la edición: el cliente vuelve a partir del estado actual
+        await self.enviar({
+            'tipo': 'error',
+            'mensaje': 'No se pudo aplicar la edición, se recarga el documento'
+        })
+        await self.enviar_inicial()
+    
+    async def enviar_inicial(self):
+        """Envía el estado actual: solo lo que falta si el cliente reanuda, o el contenido completo"""
+        estado = self.sala.estado
+        self.cancelar_transmision()
+        self.revision_cliente = estado.revision
+        self.revision_omitida = None
+        
+        operaciones = None
+        if self.reanudar_desde is not None:
+            operaciones = estado.ops_desde(*self.reanudar_desde)
+            self.reanudar_desde = None
+        
+        if operaciones is not None:
+            logger.debug("   ⏩ Reanudando documento %s con %d operaciones", self.doc_id, len(operaciones))
+            await self.enviar({
+                'tipo': 'reanudar',
+                'revision': estado.revision,
+                'epoca': estado.epoca,
+                'operaciones': operaciones
+            })
+            return
+        
+        if self.protocolo_ops and self.sala.fragmentado():
+            self.transmision = asyncio.ensure_future(
+                self.transmitir_fragmentos(self.sala.tramas_fragmentos(self.binario))
+            )
+            return
+        
+        trama = self.sala.trama_contenido('inicial', self.binario)
+        if self.binario:
+            await self.send(bytes_data=trama)
+        else:
+            await self.send(text_data=trama)
+    
+    async def transmitir_fragmentos(self, tramas):
+        """Envía el estado fragmentado sin superar la ventana de flujo; luego, lo omitido mientras tanto"""
+        # Las tramas ya serializadas son de la sala: la conexión solo retiene
+        # lo que el cliente no confirmó. El cliente confirma cada fragmento
+        self.flujo.activo = True
         try:
-            doc = Documento.objects.get(id=self.doc_id)
-            doc.contenido = contenido
-            doc.save()
-            logger.info(f"💾 Documento {self.doc_id} guardado: {len(contenido)} caracteres")
-            return True
-        except Documento.DoesNotExist:
-            logger.warning(f"⚠️ No se puede guardar: Documento {self.doc_id} no existe")
-            return False
+            for trama in tramas:
+                while self.flujo.saturado():
+                    self.hay_espacio.clear()
+                    try:
+                        await asyncio.wait_for(self.hay_espacio.wait(), self.flujo.espera_max)
+                    except asyncio.TimeoutError:
+                        contadores['clientes_desconectados'] += 1
+                        logger.warning(f"🐢 Cliente del documento {self.doc_id} no confirmó los fragmentos en {self.flujo.espera_max}s, se desconecta")
+                        await self.close(code=4008)
+                        return
+                if self.binario:
+                    await self.send(bytes_data=trama)
+                else:
+                    await self.send(text_data=trama)
+            logger.debug("   📦 Estado del documento %s enviado en %d fragmentos", self.doc_id, len(tramas) - 2)
         except Exception as e:
-            logger.error(f"❌ Error al guardar: {e}", exc_info=True)
-            return False
+            logger.error(f"❌ Error al enviar fragmentos del documento {self.doc_id}: {e}", exc_info=True)
+            return
+        finally:
+            if self.transmision is asyncio.current_task():
+                self.transmision = None
+        
+        if self.revision_omitida is not None:
+            await self.ponerse_al_dia()
+    
+    async def enviar_ticket(self):
+        """Envía un ticket nuevo y programa el siguiente a media vigencia"""
+        if self.renovacion is not None:
+            self.renovacion.cancel()
+        ticket = tickets.emitir(self.scope['user'], self.doc_id, self.puede_editar)
+        await self.enviar({'tipo': 'ticket', 'ticket': ticket})
+        self.renovacion = asyncio.get_running_loop().call_later(
+            tickets.SEGUNDOS / 2, lambda: asyncio.ensure_future(self.enviar_ticket())
+        )
+    
+    def cancelar_transmision(self):
+        if self.transmision is not None:
+            if self.transmision is not asyncio.current_task():
+                self.transmision.cancel()
+            self.transmision = None
+    
+    async def confirmar_recibido(self, tramas):
+        """El cliente procesó ``tramas`` en total; con espacio en la ventana se pone al día"""
+        if not isinstance(tramas, int):
+            return
+        self.flujo.confirmar(tramas)
+        self.hay_espacio.set()
+        if self.revision_omitida is not None and self.transmision is None and not self.flujo.saturado():
+            await self.ponerse_al_dia()
+    
+    async def ponerse_al_dia(self):
+        """Envía en una sola trama las operaciones omitidas mientras la ventana estaba llena"""
+        estado = self.sala.estado
+        hasta, self.revision_omitida = self.revision_omitida, None
+        contadores['puestas_al_dia'] += 1
+        
+        # Los lectores no tienen cambios propios: basta el estado completo
+        operaciones = None
+        if self.puede_editar:
+            operaciones = estado.ops_entre(self.revision_cliente, hasta)
+        if operaciones is None:
+            await self.enviar_inicial()
+            return
+        self.revision_cliente = hasta
+        await self.enviar({
+            'tipo': 'reanudar',
+            'revision': hasta,
+            'epoca': estado.epoca,
+            'operaciones': operaciones
+        })
+    
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        # Toda trama cuenta para la ventana de control de flujo
+        trama = text_data.encode() if text_data is not None else bytes_data
+        if trama is not None:
+            self.flujo.enviada(len(trama))
+            metricas.bytes_enviados.inc(len(trama))
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
     
+    def grupo_segun_permisos(self):
+        if self.puede_editar:
+            return nombre_grupo(self.doc_id)
+        return nombre_grupo_lectores(self.doc_id)
+    
+    async def enviar(self, mensaje):
+        """Envía un mensaje en el formato negociado por el cliente"""
+        await self.send(**codificar(mensaje, self.binario))
+    
+    @metricas.cronometrar_bd('verificar_permisos')
     @database_sync_to_async
-    def verificar_permisos_edicion(self):
-        """Verifica si el usuario tiene permisos de edición"""
+    def verificar_permisos(self):
+        """Devuelve (puede_ver, puede_editar) del usuario sobre el documento"""
         try:
-            from .models import PermisoDocumento
             user = self.scope.get('user')
             
             if not user or not user.is_authenticated:
                 logger.debug(f"   ⚠️ Usuario no autenticado")
-                return False
-            
-            doc = Documento.objects.get(id=self.doc_id)
+                return False, False
             
-            # El propietario siempre puede editar
-            if doc.propietario == user:
-                logger.debug(f"   ✅ {user.username} es propietario, puede editar")
-                return True
+            # Propietario y permiso compartido en una sola consulta
+            fila = anotar_permiso(Documento.objects.filter(id=self.doc_id), user.id).values_list(
+                'propietario_id', 'permiso_edicion'
+            ).first()
+            if fila is None:
+                logger.error(f"   ❌ Documento {self.doc_id} no existe")
+                return False, False
             
-            # Verificar permisos compartidos
-            tiene_permiso = PermisoDocumento.objects.filter(
-                documento=doc,
-                usuario=user,
-                puede_editar=True
-            ).exists()
-            
-            if tiene_permiso:
-                logger.debug(f"   ✅ {user.username} tiene permiso de edición compartido")
-            else:
-                logger.debug(f"   ⚠️ {user.username} NO tiene permiso de edición")
-            
-            return tiene_permiso
+            puede_ver, puede_editar = acceso_desde_permiso(*fila, user.id)
+            logger.debug(
+                "   🔑 %s en documento %s: ver=%s, editar=%s", user.username, self.doc_id, puede_ver, puede_editar,
+                extra={'doc_id': self.doc_id, 'usuario': user.username},
+            )
+            return puede_ver, puede_editar
             
-        except Documento.DoesNotExist:
-            logger.error(f"   ❌ Documento {self.doc_id} no existe")
-            return False
         except Exception as e:
             logger.error(f"   ❌ Error verificando permisos: {e}", exc_info=True)
-            return False
-    
-    @database_sync_to_async
-    def verificar_permisos_visualizacion(self):
-        """Verifica si el usuario puede ver el documento"""
-        try:
-            from .models import PermisoDocumento
-            user = self.scope.get('user')
-            
-            if not user or not user.is_authenticated:
-                logger.debug(f"   ⚠️ Usuario no autenticado para visualización")
-                return False
-            
-            doc = Documento.objects.get(id=self.doc_id)
-            
-            # El propietario siempre puede ver
-            if doc.propietario == user:
-                logger.debug(f"   ✅ {user.username} es propietario, puede ver")
-                return True
-            
-            # Verificar si tiene algún permiso compartido
-            tiene_permiso = PermisoDocumento.objects.filter(
-                documento=doc,
-                usuario=user
-            ).exists()
-            
-            if tiene_permiso:
-                logger.debug(f"   ✅ {user.username} tiene permiso de visualización")
-            else:
-                logger.debug(f"   ⚠️ {user.username} NO tiene permiso de visualización")
-            
-            return tiene_permiso
-            
-        except Documento.DoesNotExist:
-            logger.error(f"   ❌ Documento {self.doc_id} no existe para verificar visualización")
-            return False
-        except Exception as e:
-            logger.error(f"   ❌ Error verificando permisos de visualización: {e}", exc_info=True)
-            return False
\ No newline at end of file
+            return False, False
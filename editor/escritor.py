@@ -0,0 +1,116 @@
+"""
+Escritor único de la base de datos.
+
+SQLite admite un solo escritor a la vez: varias escrituras concurrentes
+desde el pool de hilos se turnan en el cerrojo del archivo y cada una paga
+su propio commit. Las escrituras de los documentos (guardado diferido,
+historial, índice de búsqueda, restauraciones) se encolan aquí y las
+ejecuta un hilo dedicado en lotes de hasta ``EDITOR_ESCRITOR_LOTE``: una
+transacción y un commit por lote, con cada escritura en su savepoint para
+que un error no arrastre a las demás. Las lecturas siguen en las conexiones
+de cada hilo y, con WAL, no esperan al escritor.
+
+El escritor es de cada proceso, no del despliegue: con ``servir --workers N``
+hay N escritores, y las vistas HTTP (compartir, crear, eliminar) escriben
+con el ORM sin pasar por él. Entre todos ellos se turnan en el cerrojo de
+SQLite (``BEGIN IMMEDIATE`` y ``timeout`` del motor), así que es correcto
+pero la agrupación solo ahorra commits dentro de cada proceso.
+"""
+import asyncio
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+LOTE = getattr(settings, 'EDITOR_ESCRITOR_LOTE', 64)
+
+
+class Escritor:
+    """Cola de escrituras atendida por un solo hilo"""
+
+    def __init__(self, lote):
+        self.lote = lote
+        self.cola = queue.SimpleQueue()
+        self.hilo = None
+        self.cerrojo = threading.Lock()
+        self.lotes = 0          # Transacciones confirmadas
+        self.escrituras = 0     # Escrituras ejecutadas en ellas
+        self.errores = 0
+
+    def _iniciar(self):
+        with self.cerrojo:
+            if self.hilo is None or not self.hilo.is_alive():
+                self.hilo = threading.Thread(target=self._atender, name='editor-escritor', daemon=True)
+                self.hilo.start()
+
+    def enviar(self, funcion, *args, **kwargs):
+        """Encola ``funcion(*args, **kwargs)``; devuelve un ``concurrent.futures.Future`` con su resultado"""
+        futuro = Future()
+        if threading.current_thread() is self.hilo:
+            # Llamada desde una escritura encolada: ya está dentro del lote
+            try:
+                futuro.set_result(funcion(*args, **kwargs))
+            except Exception as e:
+                futuro.set_exception(e)
+            return futuro
+        self._iniciar()
+        self.cola.put((futuro, funcion, args, kwargs))
+        return futuro
+
+    def ejecutar(self, funcion, *args, **kwargs):
+        """Escritura síncrona: espera a que su lote se confirme"""
+        return self.enviar(funcion, *args, **kwargs).result()
+
+    async def aejecutar(self, funcion, *args, **kwargs):
+        """Escritura desde código asíncrono, sin ocupar el pool de hilos mientras espera"""
+        return await asyncio.wrap_future(self.enviar(funcion, *args, **kwargs))
+
+    def pendientes(self):
+        return self.cola.qsize()
+
+    def _atender(self):
+        while True:
+            lote = [self.cola.get()]
+            while len(lote) < self.lote:
+                try:
+                    lote.append(self.cola.get_nowait())
+                except queue.Empty:
+                    break
+            self._ejecutar_lote(lote)
+
+    def _ejecutar_lote(self, lote):
+        # Los resultados se entregan después del commit: quien espera ve sus datos confirmados
+        resultados = []
+        close_old_connections()
+        try:
+            with transaction.atomic():
+                for futuro, funcion, args, kwargs in lote:
+                    if not futuro.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with transaction.atomic():
+                            resultados.append((futuro, funcion(*args, **kwargs), None))
+                    except Exception as e:
+                        resultados.append((futuro, None, e))
+        except Exception as e:
+            # Falló el commit: ninguna escritura del lote quedó guardada
+            logger.error(f"❌ Error al confirmar un lote de {len(lote)} escrituras: {e}", exc_info=True)
+            resultados = [(futuro, None, error or e) for futuro, _, error in resultados]
+            close_old_connections()
+        else:
+            self.lotes += 1
+
+        for futuro, resultado, error in resultados:
+            if error is None:
+                self.escrituras += 1
+                futuro.set_result(resultado)
+            else:
+                self.errores += 1
+                futuro.set_exception(error)
+
+
+escritor = Escritor(LOTE)
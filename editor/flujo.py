@@ -0,0 +1,58 @@
+"""
+Control de flujo de salida por conexión.
+
+Daphne no aplica contrapresión: cada ``send`` se acumula en el buffer del
+socket aunque el navegador no lea. Los clientes del protocolo de operaciones
+confirman periódicamente cuántas tramas procesaron; mientras lo enviado sin
+confirmar supera ``EDITOR_VENTANA_BYTES`` las operaciones se omiten y el
+cliente se pone al día después con una sola trama. Si la trama más antigua
+sin confirmar supera ``EDITOR_ESPERA_MAX`` segundos, se desconecta.
+"""
+import time
+from collections import Counter, deque
+from django.conf import settings
+
+VENTANA_BYTES = getattr(settings, 'EDITOR_VENTANA_BYTES', 512 * 1024)
+ESPERA_MAX = getattr(settings, 'EDITOR_ESPERA_MAX', 30)
+
+# Totales del proceso: tramas enviadas, operaciones omitidas (agrupadas en
+# una puesta al día), puestas al día y clientes desconectados por lentos
+contadores = Counter()
+
+
+class ControlFlujo:
+    """Tramas enviadas a un cliente y aún no confirmadas"""
+
+    def __init__(self, max_bytes=VENTANA_BYTES, espera_max=ESPERA_MAX):
+        self.max_bytes = max_bytes
+        self.espera_max = espera_max
+        # Se activa con la primera confirmación: los clientes antiguos nunca
+        # confirman y no acumulan nada aquí
+        self.activo = False
+        self.enviadas = 0
+        self.sin_confirmar = deque()  # (número, bytes, instante) por trama
+        self.bytes = 0
+
+    def enviada(self, tamano):
+        self.enviadas += 1
+        contadores['tramas_enviadas'] += 1
+        if self.activo:
+            self.sin_confirmar.append((self.enviadas, tamano, time.monotonic()))
+            self.bytes += tamano
+
+    def confirmar(self, tramas):
+        """Registra el total acumulado de tramas procesadas por el cliente"""
+        self.activo = True
+        while self.sin_confirmar and self.sin_confirmar[0][0] <= tramas:
+            _, tamano, _ = self.sin_confirmar.popleft()
+            self.bytes -= tamano
+
+    def saturado(self):
+        return self.activo and self.bytes >= self.max_bytes
+
+    def estancado(self):
+        """El cliente lleva demasiado tiempo sin procesar lo enviado"""
+        return (
+            self.saturado()
+            and time.monotonic() - self.sin_confirmar[0][2] > self.espera_max
+        )
@@ -0,0 +1,90 @@
+"""
+Historial de versiones de los documentos.
+
+Cada guardado del guardado diferido agrega una ``VersionDocumento`` después
+de escribir el documento, fuera del camino de las ediciones. La primera de
+cada cadena y luego una de cada ``EDITOR_VERSIONES_DISTANCIA`` guardan el
+contenido completo; el resto solo las operaciones desde la versión
+anterior, así el historial crece con lo editado y no con el tamaño del
+documento. Reconstruir una versión lee la instantánea anterior y aplica
+como mucho ``EDITOR_VERSIONES_DISTANCIA - 1`` diferencias.
+"""
+import json
+import logging
+from django.conf import settings
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .escritor import escritor
+from .models import Documento, VersionDocumento, resumen_contenido
+from .operaciones import aplicar
+
+logger = logging.getLogger(__name__)
+
+DISTANCIA = getattr(settings, 'EDITOR_VERSIONES_DISTANCIA', 50)
+
+
+def registrar(doc_id, contenido, revision, epoca, anterior=None, ops=None):
+    """
+    Agrega la versión guardada ``revision``.
+
+    ``anterior`` es la revisión de la versión previa y ``ops`` las
+    operaciones que llevan de ella a ``contenido``; si faltan o la última
+    versión registrada no es esa, se guarda una instantánea.
+    """
+    ultima = VersionDocumento.objects.filter(documento_id=doc_id).only('revision', 'distancia').first()
+    _, tamano = resumen_contenido(contenido)
+    version = VersionDocumento(documento_id=doc_id, revision=revision, epoca=epoca, tamano=tamano)
+    if (
+        ops is not None
+        and ultima is not None
+        and ultima.revision == anterior
+        and ultima.distancia + 1 < DISTANCIA
+    ):
+        version.diferencia = json.dumps(ops, ensure_ascii=False, separators=(',', ':'))
+        version.distancia = ultima.distancia + 1
+    else:
+        version.instantanea = contenido
+    version.save()
+    return version
+
+
+async def aregistrar(doc_id, contenido, revision, epoca, anterior=None, ops=None):
+    """``registrar`` desde el guardado diferido; los errores se registran y no se propagan"""
+    try:
+        await escritor.aejecutar(registrar, doc_id, contenido, revision, epoca, anterior, ops)
+    except Exception as e:
+        logger.error(f"❌ Error al registrar la versión {revision} del documento {doc_id}: {e}", exc_info=True)
+
+
+@receiver(post_save, sender=Documento)
+def _documento_creado(sender, instance, created, **kwargs):
+    # El contenido con que se creó es la primera versión
+    if created:
+        registrar(instance.id, instance.contenido, instance.revision, instance.epoca)
+
+
+def operaciones_guardado(estado, anterior, revision):
+    """Operaciones entre dos guardados según el historial en memoria; None si ya no están o ocupan más que el contenido"""
+    operaciones = estado.ops_entre(anterior, revision)
+    if operaciones is None:
+        return None
+    return [op for ops in operaciones for op in ops]
+
+
+def contenido_version(version):
+    """Contenido del documento en una versión: su instantánea más las diferencias posteriores"""
+    if version.instantanea is not None:
+        return version.instantanea
+    cadena = list(
+        VersionDocumento.objects.filter(
+            documento_id=version.documento_id,
+            id__lte=version.id,
+        ).only('instantanea', 'diferencia')[:version.distancia + 1]
+    )
+    base = cadena[-1]
+    if len(cadena) != version.distancia + 1 or base.instantanea is None:
+        raise ValueError(f'Cadena de versiones incompleta para la versión {version.id}')
+    contenido = base.instantanea
+    for intermedia in reversed(cadena[:-1]):
+        contenido = aplicar(contenido, json.loads(intermedia.diferencia))
+    return contenido
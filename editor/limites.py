@@ -0,0 +1,110 @@
+"""
+Límites de uso de los sockets de documentos.
+
+Las ediciones consumen fichas de dos cubetas (token bucket): una por usuario
+y otra por documento, que se rellenan a ``EDITOR_LIMITE_*_RITMO`` fichas por
+segundo hasta ``EDITOR_LIMITE_*_RAFAGA``. Cada mensaje cuesta una ficha más
+una por cada ``BYTES_POR_FICHA`` bytes, así enviar el contenido completo en
+bucle se agota antes que las operaciones pequeñas. Una edición sin fichas se
+descarta y el cliente recibe un error ``limite`` con los segundos que debe
+esperar. Además se rechazan las tramas de más de ``EDITOR_MENSAJE_MAX_BYTES``
+y los sockets que superan ``EDITOR_SOCKETS_MAX`` en el proceso. Como el resto
+del estado de las salas, los límites son de cada proceso.
+"""
+import time
+from collections import Counter
+from django.conf import settings
+
+RITMO_USUARIO = getattr(settings, 'EDITOR_LIMITE_USUARIO_RITMO', 20)
+RAFAGA_USUARIO = getattr(settings, 'EDITOR_LIMITE_USUARIO_RAFAGA', 40)
+RITMO_DOCUMENTO = getattr(settings, 'EDITOR_LIMITE_DOCUMENTO_RITMO', 100)
+RAFAGA_DOCUMENTO = getattr(settings, 'EDITOR_LIMITE_DOCUMENTO_RAFAGA', 200)
+MENSAJE_MAX_BYTES = getattr(settings, 'EDITOR_MENSAJE_MAX_BYTES', 4 * 1024 * 1024)
+SOCKETS_MAX = getattr(settings, 'EDITOR_SOCKETS_MAX', 2000)
+
+BYTES_POR_FICHA = 16 * 1024
+
+# Rechazos del proceso por motivo: usuario, documento, tamano, sockets
+rechazos = Counter()
+
+
+class Limitador:
+    """Cubetas de fichas por clave; las llenas se olvidan al crecer el diccionario"""
+
+    def __init__(self, ritmo, rafaga):
+        self.ritmo = ritmo
+        self.rafaga = rafaga
+        self.cubetas = {}  # clave -> [fichas, instante de la última recarga]
+        self.purgar_desde = 1024
+
+    def _fichas(self, cubeta, ahora):
+        return min(self.rafaga, cubeta[0] + (ahora - cubeta[1]) * self.ritmo)
+
+    def espera(self, clave, costo, ahora):
+        """Segundos hasta tener ``costo`` fichas (0 si ya las hay)"""
+        cubeta = self.cubetas.get(clave)
+        if cubeta is None:
+            return 0.0
+        faltan = min(costo, self.rafaga) - self._fichas(cubeta, ahora)
+        return max(0.0, faltan / self.ritmo)
+
+    def consumir(self, clave, costo, ahora):
+        cubeta = self.cubetas.get(clave)
+        if cubeta is None:
+            if len(self.cubetas) >= self.purgar_desde:
+                self._purgar(ahora)
+            cubeta = self.cubetas[clave] = [self.rafaga, ahora]
+        # Un mensaje más caro que la ráfaga entera deja la cubeta en negativo
+        # en lugar de no pasar nunca
+        cubeta[0] = self._fichas(cubeta, ahora) - costo
+        cubeta[1] = ahora
+
+    def _purgar(self, ahora):
+        self.cubetas = {
+            clave: cubeta for clave, cubeta in self.cubetas.items()
+            if self._fichas(cubeta, ahora) < self.rafaga
+        }
+        self.purgar_desde = max(1024, 2 * len(self.cubetas))
+
+
+por_usuario = Limitador(RITMO_USUARIO, RAFAGA_USUARIO)
+por_documento = Limitador(RITMO_DOCUMENTO, RAFAGA_DOCUMENTO)
+
+# Sockets admitidos en este proceso (aceptados o conectándose)
+conexiones = 0
+
+
+def costo(tamano):
+    return 1 + tamano // BYTES_POR_FICHA
+
+
+def admitir_edicion(usuario_id, doc_id, tamano):
+    """Consume las fichas de una edición; devuelve 0 o los segundos a esperar si se rechaza"""
+    ahora = time.monotonic()
+    fichas = costo(tamano)
+    for motivo, limitador, clave in (
+        ('usuario', por_usuario, usuario_id),
+        ('documento', por_documento, doc_id),
+    ):
+        espera = limitador.espera(clave, fichas, ahora)
+        if espera > 0:
+            rechazos[motivo] += 1
+            return espera
+    por_usuario.consumir(usuario_id, fichas, ahora)
+    por_documento.consumir(doc_id, fichas, ahora)
+    return 0.0
+
+
+def admitir_socket():
+    """Reserva un lugar para un socket nuevo; False si el proceso está lleno"""
+    global conexiones
+    if SOCKETS_MAX and conexiones >= SOCKETS_MAX:
+        rechazos['sockets'] += 1
+        return False
+    conexiones += 1
+    return True
+
+
+def liberar_socket():
+    global conexiones
+    conexiones -= 1
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from channels.layers import InMemoryChannelLayer
+from editor.capa_canales import UnixSocketChannelLayer
+from editor.management.estadistica import percentil
+
+
+class Command(BaseCommand):
+    help = 'Compara la latencia de difusión a un grupo entre la capa en memoria y el broker local'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--miembros', type=int, default=50, help='Canales en el grupo')
+        parser.add_argument('--mensajes', type=int, default=500, help='Difusiones a medir')
+        parser.add_argument('--tamano', type=int, default=200, help='Bytes de contenido por mensaje')
+
+    def handle(self, *args, **options):
+        resultados = [('memoria', asyncio.run(self._medir(InMemoryChannelLayer(capacity=10000), options)))]
+
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'canales.sock')
+            broker = subprocess.Popen(
+                [sys.executable, sys.argv[0], 'broker_canales', '--socket', ruta],
+                stdout=subprocess.DEVNULL,
+            )
+            try:
+                while not os.path.exists(ruta):
+                    time.sleep(0.05)
+                capa = UnixSocketChannelLayer(socket_path=ruta, capacity=10000)
+                resultados.append(('broker unix', asyncio.run(self._medir(capa, options))))
+            finally:
+                broker.terminate()
+                broker.wait()
+
+        self.stdout.write(
+            f"Difusión a {options['miembros']} miembros, {options['mensajes']} mensajes "
+            f"de {options['tamano']} bytes (latencia hasta el último miembro)"
+        )
+        self.stdout.write(f"{'capa':<12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'msg/s':>10}")
+        for nombre, (latencias, por_segundo) in resultados:
+            self.stdout.write(
+                f"{nombre:<12} "
+                f"{percentil(latencias, 50) * 1000:>8.3f} "
+                f"{percentil(latencias, 95) * 1000:>8.3f} "
+                f"{percentil(latencias, 99) * 1000:>8.3f} "
+                f"{por_segundo:>10.0f}"
+            )
+
+    async def _medir(self, capa, options):
+        canales = [await capa.new_channel() for _ in range(options['miembros'])]
+        for canal in canales:
+            await capa.group_add('bench', canal)
+
+        mensaje = {'type': 'documento_update', 'contenido': 'x' * options['tamano']}
+        latencias = []
+        inicio_total = time.perf_counter()
+        for _ in range(options['mensajes']):
+            inicio = time.perf_counter()
+            await capa.group_send('bench', mensaje)
+            await asyncio.gather(*(capa.receive(canal) for canal in canales))
+            latencias.append(time.perf_counter() - inicio)
+        total = time.perf_counter() - inicio_total
+
+        await capa.flush()
+        await capa.close()
+        return latencias, options['mensajes'] * options['miembros'] / total
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import logging
+import resource
+import time
+from collections import defaultdict
+from importlib import import_module
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from editor.management.estadistica import percentil
+from editor.models import Documento, PermisoDocumento
+from editor.persistencia import guardado_diferido
+from editor.protocolo import SUBPROTOCOLO_BINARIO, codificar, decodificar_binario
+
+
+def _percentiles(valores):
+    if not valores:
+        return None
+    return {f'p{p}': round(percentil(valores, p) * 1000, 2) for p in (50, 95, 99)}
+
+
+def _rss_mb():
+    """(actual, pico) de la memoria residente en MB, los dos de /proc/self/status"""
+    try:
+        with open('/proc/self/status') as status:
+            campos = dict(linea.split(':', 1) for linea in status if ':' in linea)
+        # Los dos en kB
+        return int(campos['VmRSS'].split()[0]) / 1024, int(campos['VmHWM'].split()[0]) / 1024
+    except (OSError, KeyError):
+        # Sin /proc solo se conoce el pico (ru_maxrss en kB en Linux)
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return pico, pico
+
+
+class Cliente:
+    """Socket simulado de un editor o un lector en una sala"""
+
+    def __init__(self, comunicador, sala, editor, binario):
+        self.comunicador = comunicador
+        self.sala = sala
+        self.editor = editor
+        self.binario = binario
+        self.revision = 0
+        self.tramas = 0
+        self.confirmado_en = 0.0
+        # Edición en vuelo (instante de envío) y caracteres aún sin enviar
+        self.enviada_en = None
+        self.pendiente = 0
+
+    async def enviar(self, mensaje):
+        await self.comunicador.send_to(**codificar(mensaje, self.binario))
+
+    async def recibir(self, timeout):
+        salida = await self.comunicador.receive_output(timeout)
+        if salida.get('bytes') is not None:
+            return decodificar_binario(salida['bytes'])
+        return json.loads(salida['text'])
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera carga sobre ws/documento/<id>/ con editores y lectores simulados '
+        'contra proyecto.asgi.application en este proceso y escribe los resultados en JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--salas', type=int, default=10, help='Documentos abiertos')
+        parser.add_argument('--editores', type=int, default=2, help='Editores por sala')
+        parser.add_argument('--lectores', type=int, default=20, help='Lectores (solo lectura) por sala')
+        parser.add_argument('--ritmo', type=float, default=5.0, help='Pulsaciones por segundo de cada editor')
+        parser.add_argument('--duracion', type=float, default=10.0, help='Segundos de escritura')
+        parser.add_argument('--binario', action='store_true', help='Negociar el subprotocolo msgpack')
+        parser.add_argument('--etiqueta', default='', help='Nombre de la corrida en el JSON')
+        parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, la salida estándar)')
+
+    def handle(self, *args, **options):
+        # Los logs por conexión distorsionan la medida
+        logging.disable(logging.INFO)
+        from proyecto.asgi import application
+
+        usuarios, documentos, sesiones = self._preparar(options)
+        try:
+            resultados = asyncio.run(self._ejecutar(application, documentos, sesiones, options))
+        finally:
+            motor = import_module(settings.SESSION_ENGINE)
+            for clave in set(sesiones.values()):
+                motor.SessionStore(clave).delete()
+            User.objects.filter(id__in=[usuario.id for usuario in usuarios]).delete()
+            logging.disable(logging.NOTSET)
+
+        informe = json.dumps({
+            'etiqueta': options['etiqueta'],
+            'fecha': timezone.now().isoformat(),
+            'configuracion': {
+                clave: options[clave]
+                for clave in ('salas', 'editores', 'lectores', 'ritmo', 'duracion', 'binario')
+            },
+            'resultados': resultados,
+        }, indent=2)
+        if options['salida']:
+            with open(options['salida'], 'w') as archivo:
+                archivo.write(informe + '\n')
+            self.stdout.write(f"📊 Resultados escritos en {options['salida']}")
+        else:
+            self.stdout.write(informe)
+
+    def _preparar(self, options):
+        """Crea el propietario, los usuarios, los documentos, los permisos y una sesión por usuario"""
+        prefijo = f'carga_{time.time_ns()}'
+        propietario = User.objects.create(username=f'{prefijo}_propietario')
+        editores = User.objects.bulk_create(
+            User(username=f'{prefijo}_editor_{i}') for i in range(options['editores'])
+        )
+        lectores = User.objects.bulk_create(
+            User(username=f'{prefijo}_lector_{i}') for i in range(options['lectores'])
+        )
+        documentos = Documento.objects.bulk_create(
+            Documento(titulo=f'Carga {i}', contenido='', propietario=propietario)
+            for i in range(options['salas'])
+        )
+        PermisoDocumento.objects.bulk_create(
+            PermisoDocumento(
+                documento=documento,
+                usuario=usuario,
+                puede_editar=usuario in editores,
+                compartido_por=propietario,
+            )
+            for documento in documentos
+            for usuario in editores + lectores
+        )
+
+        motor = import_module(settings.SESSION_ENGINE)
+        sesiones = {}
+        for usuario in editores + lectores:
+            sesion = motor.SessionStore()
+            sesion[SESSION_KEY] = str(usuario.pk)
+            sesion[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+            sesion[HASH_SESSION_KEY] = usuario.get_session_auth_hash()
+            sesion.save()
+            sesiones[usuario.id] = sesion.session_key
+
+        usuarios = [propietario, *editores, *lectores]
+        asignados = [(usuario, True) for usuario in editores] + [(usuario, False) for usuario in lectores]
+        return usuarios, [(documento.id, asignados) for documento in documentos], sesiones
+
+    async def _ejecutar(self, application, documentos, sesiones, options):
+        binario = options['binario']
+        # Instante de envío de la edición que produjo cada revisión, por sala
+        envios = defaultdict(dict)
+        # (sala, revisión, instante) recibidas por editores y por lectores
+        recibidas_editores = []
+        recibidas_lectores = []
+
+        async def conectar(doc_id, usuario, editor):
+            comunicador = WebsocketCommunicator(
+                application,
+                f'/ws/documento/{doc_id}/?protocolo=ops',
+                headers=[
+                    (b'host', b'localhost'),
+                    (b'origin', b'http://localhost'),
+                    (b'cookie', f'{settings.SESSION_COOKIE_NAME}={sesiones[usuario.id]}'.encode()),
+                ],
+                subprotocols=[SUBPROTOCOLO_BINARIO] if binario else None,
+            )
+            inicio = time.perf_counter()
+            conectado, _ = await comunicador.connect(timeout=120)
+            if not conectado:
+                raise RuntimeError(f'Conexión rechazada al documento {doc_id}')
+            cliente = Cliente(comunicador, doc_id, editor, binario)
+            inicial = await cliente.recibir(timeout=120)
+            cliente.revision = inicial['revision']
+            cliente.tramas = 1
+            return cliente, time.perf_counter() - inicio
+
+        inicio_conexion = time.perf_counter()
+        conexiones = await asyncio.gather(*(
+            conectar(doc_id, usuario, editor)
+            for doc_id, asignados in documentos
+            for usuario, editor in asignados
+        ))
+        tiempo_conexion = time.perf_counter() - inicio_conexion
+        clientes = [cliente for cliente, _ in conexiones]
+
+        async def enviar_edicion(cliente):
+            cliente.enviada_en = time.perf_counter()
+            texto, cliente.pendiente = 'x' * cliente.pendiente, 0
+            await cliente.enviar({
+                'tipo': 'op',
+                'revision': cliente.revision,
+                'ops': [{'pos': 0, 'insertar': texto}],
+            })
+
+        async def leer(cliente):
+            # Mismo comportamiento que la página: una edición en vuelo y confirmaciones periódicas
+            while True:
+                mensaje = await cliente.recibir(timeout=3600)
+                ahora = time.perf_counter()
+                cliente.tramas += 1
+                tipo = mensaje['tipo']
+                if tipo == 'ack':
+                    cliente.revision = mensaje['revision']
+                    envios[cliente.sala][mensaje['revision']] = cliente.enviada_en
+                    cliente.enviada_en = None
+                    if cliente.pendiente:
+                        await enviar_edicion(cliente)
+                elif tipo == 'op':
+                    cliente.revision = mensaje['revision']
+                    recibidas_editores.append((cliente.sala, mensaje['revision'], ahora))
+                elif tipo in ('inicial', 'reanudar'):
+                    anterior, cliente.revision = cliente.revision, mensaje['revision']
+                    recibidas_lectores.extend(
+                        (cliente.sala, revision, ahora)
+                        for revision in range(anterior + 1, cliente.revision + 1)
+                    )
+                if ahora - cliente.confirmado_en > 0.5:
+                    cliente.confirmado_en = ahora
+                    await cliente.enviar({'tipo': 'recibido', 'tramas': cliente.tramas})
+
+        async def escribir(cliente, fin):
+            intervalo = 1 / options['ritmo']
+            while time.perf_counter() < fin:
+                await asyncio.sleep(intervalo)
+                cliente.pendiente += 1
+                if cliente.enviada_en is None:
+                    await enviar_edicion(cliente)
+
+        lecturas = [asyncio.ensure_future(leer(cliente)) for cliente in clientes]
+        escrituras_antes = guardado_diferido.escrituras
+        inicio = time.perf_counter()
+        fin = inicio + options['duracion']
+        await asyncio.gather(*(escribir(cliente, fin) for cliente in clientes if cliente.editor))
+        # Margen para los últimos acks y el último estado de los lectores
+        await asyncio.sleep(getattr(settings, 'EDITOR_INTERVALO_LECTORES', 1.0) + 1)
+        transcurrido = time.perf_counter() - inicio
+        escrituras = guardado_diferido.escrituras - escrituras_antes
+        rss, rss_pico = _rss_mb()
+
+        for lectura in lecturas:
+            lectura.cancel()
+        await asyncio.gather(*lecturas, return_exceptions=True)
+        for lectura in lecturas:
+            if not lectura.cancelled() and lectura.exception() is not None:
+                raise lectura.exception()
+        await asyncio.gather(*(cliente.comunicador.disconnect() for cliente in clientes))
+
+        def latencias(recibidas):
+            return [
+                ahora - envios[sala][revision]
+                for sala, revision, ahora in recibidas
+                if revision in envios[sala]
+            ]
+
+        tramas = sum(cliente.tramas for cliente in clientes)
+        return {
+            'sockets': len(clientes),
+            'conexion_ms': _percentiles([latencia for _, latencia in conexiones]),
+            'conexion_total_s': round(tiempo_conexion, 3),
+            'ediciones': sum(len(revisiones) for revisiones in envios.values()),
+            'entrega_editores_ms': _percentiles(latencias(recibidas_editores)),
+            'entrega_lectores_ms': _percentiles(latencias(recibidas_lectores)),
+            'mensajes_por_segundo': round(tramas / transcurrido, 1),
+            'escrituras_bd_por_segundo': round(escrituras / transcurrido, 2),
+            'rss_mb': round(rss, 1),
+            'rss_pico_mb': round(rss_pico, 1),
+        }
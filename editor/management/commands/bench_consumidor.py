@@ -0,0 +1,120 @@
+import asyncio
+import json
+import logging
+import time
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.urls import re_path
+from editor.consumers import DocumentoConsumer
+from editor.management.estadistica import percentil
+from editor.models import Documento, PermisoDocumento
+from editor.routing import websocket_urlpatterns
+
+
+class ConsumidorORMAsincrono(DocumentoConsumer):
+    """Consumer con la verificación de permisos en el ORM asíncrono, sin ``close_old_connections``"""
+
+    async def verificar_permisos(self):
+        user = self.scope.get('user')
+        propietario_id = await Documento.objects.filter(id=self.doc_id).values_list(
+            'propietario_id', flat=True
+        ).afirst()
+        if propietario_id is None:
+            return False, False
+        if propietario_id == user.id:
+            return True, True
+        puede_editar = await PermisoDocumento.objects.filter(
+            documento_id=self.doc_id,
+            usuario_id=user.id
+        ).values_list('puede_editar', flat=True).afirst()
+        if puede_editar is None:
+            return False, False
+        return True, puede_editar
+
+
+class Command(BaseCommand):
+    help = 'Mide la latencia de conexión y de edición del consumer con muchos sockets concurrentes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=1000, help='Conexiones concurrentes')
+        parser.add_argument('--documentos', type=int, default=50, help='Documentos entre los que se reparten')
+
+    def handle(self, *args, **options):
+        # Los logs por conexión distorsionan la medida
+        logging.disable(logging.INFO)
+        propietario, invitado, documentos = self._preparar(options['documentos'])
+        try:
+            aplicaciones = [
+                ('pool de hilos', URLRouter(websocket_urlpatterns)),
+                ('ORM asíncrono', URLRouter([
+                    re_path(r'ws/documento/(?P<doc_id>\d+)/$', ConsumidorORMAsincrono.as_asgi()),
+                ])),
+            ]
+            resultados = [
+                (nombre, asyncio.run(self._medir(aplicacion, propietario, invitado, documentos, options['sockets'])))
+                for nombre, aplicacion in aplicaciones
+            ]
+        finally:
+            User.objects.filter(id__in=[propietario.id, invitado.id]).delete()
+            logging.disable(logging.NOTSET)
+
+        self.stdout.write(f"{options['sockets']} sockets en {options['documentos']} documentos")
+        self.stdout.write(
+            f"{'ruta':<14} {'conexión p50':>13} {'p99':>8} {'edición p50':>12} {'p99':>8}  (ms)"
+        )
+        for nombre, (conexiones, ediciones) in resultados:
+            self.stdout.write(
+                f"{nombre:<14} "
+                f"{percentil(conexiones, 50) * 1000:>13.1f} "
+                f"{percentil(conexiones, 99) * 1000:>8.1f} "
+                f"{percentil(ediciones, 50) * 1000:>12.1f} "
+                f"{percentil(ediciones, 99) * 1000:>8.1f}"
+            )
+
+    def _preparar(self, cantidad):
+        propietario = User.objects.create(username=f'bench_propietario_{time.time_ns()}')
+        invitado = User.objects.create(username=f'bench_invitado_{time.time_ns()}')
+        documentos = []
+        for i in range(cantidad):
+            documento = Documento.objects.create(titulo=f'bench {i}', contenido='', propietario=propietario)
+            PermisoDocumento.objects.create(
+                documento=documento, usuario=invitado, puede_editar=True, compartido_por=propietario
+            )
+            documentos.append(documento.id)
+        return propietario, invitado, documentos
+
+    async def _medir(self, aplicacion, propietario, invitado, documentos, sockets):
+        async def conectar(i):
+            # La mitad entra como propietario y la otra con permiso compartido
+            comunicador = WebsocketCommunicator(
+                aplicacion, f'/ws/documento/{documentos[i % len(documentos)]}/?protocolo=ops'
+            )
+            comunicador.scope['user'] = propietario if i % 2 else invitado
+            inicio = time.perf_counter()
+            conectado, _ = await comunicador.connect(timeout=60)
+            assert conectado
+            inicial = json.loads(await comunicador.receive_from(timeout=60))
+            return comunicador, inicial['revision'], time.perf_counter() - inicio
+
+        conectados = await asyncio.gather(*(conectar(i) for i in range(sockets)))
+
+        async def editar(comunicador, revision):
+            inicio = time.perf_counter()
+            await comunicador.send_to(text_data=json.dumps({
+                'tipo': 'op',
+                'revision': revision,
+                'ops': [{'pos': 0, 'insertar': 'x'}],
+            }))
+            # Las operaciones de los demás llegan antes o después del ack
+            while json.loads(await comunicador.receive_from(timeout=60))['tipo'] != 'ack':
+                pass
+            return time.perf_counter() - inicio
+
+        ediciones = await asyncio.gather(*(editar(c, revision) for c, revision, _ in conectados))
+
+        # Dejar que cada consumer vacíe su cola antes de cerrar
+        await asyncio.sleep(0.5)
+        await asyncio.gather(*(c.disconnect() for c, _, _ in conectados))
+        return [latencia for _, _, latencia in conectados], ediciones
@@ -0,0 +1,136 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection, connections, transaction
+from editor import historial
+from editor.escritor import escritor
+from editor.management.estadistica import percentil
+from editor.models import Documento
+from editor.persistencia import escribir_contenido
+
+
+def _guardar(doc_id, contenido, revision):
+    # Lo mismo que un guardado diferido: documento, índice y versión
+    escribir_contenido(doc_id, contenido, revision, 'bench')
+    historial.registrar(doc_id, contenido, revision, 'bench')
+
+
+def _guardar_directo(doc_id, contenido, revision):
+    # Como database_sync_to_async: la conexión del hilo se reutiliza según CONN_MAX_AGE
+    close_old_connections()
+    try:
+        with transaction.atomic():
+            _guardar(doc_id, contenido, revision)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Escrituras concurrentes a ritmo fijo contra la base de datos configurada: errores de cerrojo y latencia'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segundos', type=float, default=10, help='Duración de cada prueba')
+        parser.add_argument('--ritmo', type=int, default=200, help='Guardados de documentos por segundo')
+        parser.add_argument('--documentos', type=int, default=50)
+        parser.add_argument('--hilos', type=int, default=8, help='Hilos del pool en el modo directo')
+        parser.add_argument('--lectores', type=int, default=4, help='Hilos leyendo mientras tanto')
+        parser.add_argument('--lecturas', type=int, default=200, help='Lecturas por segundo entre todos los lectores')
+        parser.add_argument('--modo', choices=('cola', 'directo', 'ambos'), default='ambos')
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            modo_diario = cursor.fetchone()[0]
+        self.stdout.write(f"Motor {connection.settings_dict['ENGINE']}, journal_mode={modo_diario}")
+
+        propietario = User.objects.create(username=f'bench_escrituras_{time.time_ns()}')
+        documentos = [
+            Documento.objects.create(titulo=f'bench {i}', contenido='', propietario=propietario).id
+            for i in range(options['documentos'])
+        ]
+        modos = ('cola', 'directo') if options['modo'] == 'ambos' else (options['modo'],)
+        try:
+            resultados = [(modo, self._medir(modo, documentos, options)) for modo in modos]
+        finally:
+            propietario.delete()
+
+        self.stdout.write(
+            f"{options['ritmo']} guardados/s durante {options['segundos']}s en {options['documentos']} documentos, "
+            f"{options['lecturas']} lecturas/s en {options['lectores']} hilos"
+        )
+        self.stdout.write(
+            f"{'modo':<8} {'guardados':>10} {'cerrojo':>8} {'otros':>6} {'p50':>8} {'p99':>8} {'lecturas':>9}  (ms)"
+        )
+        for modo, (latencias, bloqueos, otros, lecturas) in resultados:
+            self.stdout.write(
+                f"{modo:<8} {len(latencias):>10} {bloqueos:>8} {otros:>6} "
+                f"{percentil(latencias, 50) * 1000:>8.1f} {percentil(latencias, 99) * 1000:>8.1f} {lecturas:>9}"
+            )
+
+    def _medir(self, modo, documentos, options):
+        latencias = []
+        errores = {'cerrojo': 0, 'otros': 0}
+        cerrojo = threading.Lock()
+        fin = threading.Event()
+        lecturas = [0]
+
+        def terminado(inicio):
+            def registrar(futuro):
+                error = futuro.exception()
+                with cerrojo:
+                    if error is None:
+                        latencias.append(time.perf_counter() - inicio)
+                    elif 'locked' in str(error):
+                        errores['cerrojo'] += 1
+                    else:
+                        errores['otros'] += 1
+            return registrar
+
+        def leer():
+            # Lecturas del dashboard mientras se escribe
+            pausa = options['lectores'] / options['lecturas']
+            try:
+                while not fin.wait(pausa):
+                    list(Documento.objects.filter(id__in=documentos).only('id', 'titulo', 'actualizado')[:24])
+                    with cerrojo:
+                        lecturas[0] += 1
+            finally:
+                connection.close()
+
+        lectores = [threading.Thread(target=leer) for _ in range(options['lectores'])]
+        for lector in lectores:
+            lector.start()
+
+        pool = ThreadPoolExecutor(options['hilos'])
+        intervalo = 1 / options['ritmo']
+        total = int(options['segundos'] * options['ritmo'])
+        revisiones = dict.fromkeys(documentos, 0)
+        inicio_prueba = time.perf_counter()
+        futuros = []
+        for i in range(total):
+            # Ritmo fijo: si se va atrasado no se espera
+            espera = inicio_prueba + i * intervalo - time.perf_counter()
+            if espera > 0:
+                time.sleep(espera)
+            doc_id = random.choice(documentos)
+            revisiones[doc_id] += 1
+            contenido = f'revisión {revisiones[doc_id]} ' * random.randint(1, 200)
+            inicio = time.perf_counter()
+            if modo == 'cola':
+                futuro = escritor.enviar(_guardar, doc_id, contenido, revisiones[doc_id])
+            else:
+                futuro = pool.submit(_guardar_directo, doc_id, contenido, revisiones[doc_id])
+            futuro.add_done_callback(terminado(inicio))
+            futuros.append(futuro)
+
+        for futuro in futuros:
+            futuro.exception()
+        pool.shutdown()
+        fin.set()
+        for lector in lectores:
+            lector.join()
+        connections.close_all()
+        return latencias, errores['cerrojo'], errores['otros'], lecturas[0]
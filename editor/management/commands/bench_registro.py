@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from editor import limites
+from editor.management.estadistica import percentil
+from editor.models import Documento
+from editor.registro import FormatoJSON, ManejadorEnCola, Muestreo
+from editor.routing import websocket_urlpatterns
+
+# Cada cuánto mide el retraso del event loop
+TIC = 0.001
+
+
+class Command(BaseCommand):
+    help = 'Retraso del event loop y latencia de edición con el logging apagado, síncrono y en cola'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segundos', type=float, default=5, help='Duración de cada prueba')
+        parser.add_argument('--ritmo', type=int, default=1000, help='Ediciones por segundo entre todos los sockets')
+        parser.add_argument('--sockets', type=int, default=50, help='Un documento por socket')
+        parser.add_argument('--destino', help='Archivo donde se escriben los logs (por defecto uno temporal)')
+        parser.add_argument(
+            '--modo', choices=('apagado', 'sincrono', 'cola', 'todos'), default='todos',
+        )
+
+    def handle(self, *args, **options):
+        destino = options['destino'] or os.path.join(tempfile.gettempdir(), 'bench_registro.log')
+        # Sin los límites de ediciones por usuario y documento
+        limites.por_usuario = limites.Limitador(10 ** 9, 10 ** 9)
+        limites.por_documento = limites.Limitador(10 ** 9, 10 ** 9)
+
+        propietario = User.objects.create(username=f'bench_registro_{time.time_ns()}')
+        documentos = [
+            Documento.objects.create(titulo=f'bench {i}', contenido='', propietario=propietario).id
+            for i in range(options['sockets'])
+        ]
+        raiz = logging.getLogger()
+        originales = raiz.handlers[:], raiz.level
+        modos = ('apagado', 'sincrono', 'cola') if options['modo'] == 'todos' else (options['modo'],)
+        try:
+            with open(destino, 'w', encoding='utf-8') as archivo:
+                # Un solo event loop: las salas y sus cerrojos siguen abiertos entre pruebas
+                resultados = asyncio.run(self._medir_modos(modos, archivo, propietario, documentos, options))
+        finally:
+            raiz.handlers[:], raiz.level = originales
+            logging.disable(logging.NOTSET)
+            propietario.delete()
+
+        self.stdout.write(
+            f"{options['ritmo']} ediciones/s durante {options['segundos']}s en {options['sockets']} sockets, "
+            f"logs en {destino}"
+        )
+        self.stdout.write(
+            f"{'modo':<9} {'ediciones':>10} {'bucle p50':>10} {'p99':>8} {'máx':>8} "
+            f"{'edición p50':>12} {'p99':>8}  (ms)"
+        )
+        for modo, (retrasos, ediciones) in resultados:
+            self.stdout.write(
+                f"{modo:<9} {len(ediciones):>10} "
+                f"{percentil(retrasos, 50) * 1000:>10.2f} {percentil(retrasos, 99) * 1000:>8.2f} "
+                f"{max(retrasos, default=0) * 1000:>8.2f} "
+                f"{percentil(ediciones, 50) * 1000:>12.2f} {percentil(ediciones, 99) * 1000:>8.2f}"
+            )
+
+    async def _medir_modos(self, modos, archivo, propietario, documentos, options):
+        resultados = []
+        for modo in modos:
+            manejador = self._configurar(modo, archivo)
+            try:
+                resultados.append((modo, await self._medir(propietario, documentos, options)))
+            finally:
+                if manejador is not None:
+                    logging.getLogger().removeHandler(manejador)
+                    manejador.close()
+        return resultados
+
+    def _configurar(self, modo, archivo):
+        """Deja en la raíz solo el manejador del modo; devuelve el manejador añadido"""
+        raiz = logging.getLogger()
+        raiz.handlers[:] = []
+        raiz.setLevel(logging.INFO)
+        logging.disable(logging.NOTSET)
+        if modo == 'apagado':
+            logging.disable(logging.CRITICAL)
+            return None
+        if modo == 'sincrono':
+            # Como la configuración anterior: se formatea y escribe en el event loop
+            manejador = logging.StreamHandler(archivo)
+            manejador.setFormatter(logging.Formatter('{levelname} {asctime} {module} {message}', style='{'))
+        else:
+            manejador = ManejadorEnCola(archivo)
+            manejador.setFormatter(FormatoJSON())
+            manejador.addFilter(Muestreo())
+        raiz.addHandler(manejador)
+        return manejador
+
+    async def _medir(self, propietario, documentos, options):
+        aplicacion = URLRouter(websocket_urlpatterns)
+        retrasos = []
+        ediciones = []
+
+        async def conectar(doc_id):
+            comunicador = WebsocketCommunicator(aplicacion, f'/ws/documento/{doc_id}/?protocolo=ops')
+            comunicador.scope['user'] = propietario
+            conectado, _ = await comunicador.connect(timeout=60)
+            assert conectado
+            inicial = json.loads(await comunicador.receive_from(timeout=60))
+            return comunicador, inicial['revision']
+
+        conectados = await asyncio.gather(*(conectar(doc_id) for doc_id in documentos))
+        fin = time.perf_counter() + options['segundos']
+
+        async def medir_bucle():
+            # Lo que tarda en volver un sleep de TIC por encima de TIC
+            while time.perf_counter() < fin:
+                inicio = time.perf_counter()
+                await asyncio.sleep(TIC)
+                retrasos.append(time.perf_counter() - inicio - TIC)
+
+        async def editar(comunicador, revision, desfase):
+            # Cada socket edita a ritmo fijo y espera el ack antes de la siguiente
+            intervalo = len(conectados) / options['ritmo']
+            siguiente = time.perf_counter() + desfase * intervalo
+            while True:
+                espera = siguiente - time.perf_counter()
+                if espera > 0:
+                    await asyncio.sleep(espera)
+                if time.perf_counter() >= fin:
+                    return
+                siguiente += intervalo
+                inicio = time.perf_counter()
+                await comunicador.send_to(text_data=json.dumps({
+                    'tipo': 'op',
+                    'revision': revision,
+                    'ops': [{'pos': 0, 'insertar': 'x'}],
+                }))
+                while True:
+                    mensaje = json.loads(await comunicador.receive_from(timeout=60))
+                    if mensaje['tipo'] == 'ack':
+                        revision = mensaje['revision']
+                        break
+                ediciones.append(time.perf_counter() - inicio)
+
+        await asyncio.gather(
+            medir_bucle(),
+            *(
+                editar(comunicador, revision, i / len(conectados))
+                for i, (comunicador, revision) in enumerate(conectados)
+            ),
+        )
+        await asyncio.gather(*(comunicador.disconnect() for comunicador, _ in conectados))
+        return retrasos, ediciones
@@ -0,0 +1,29 @@
+import asyncio
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from editor.capa_canales import BrokerCanales
+
+
+class Command(BaseCommand):
+    help = 'Inicia el broker del channel layer local (socket Unix) para varios workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket',
+            default=settings.EDITOR_BROKER_SOCKET,
+            help='Ruta del socket Unix del broker',
+        )
+        parser.add_argument(
+            '--capacidad',
+            type=int,
+            default=100,
+            help='Mensajes máximos en cola por canal normal',
+        )
+
+    def handle(self, *args, **options):
+        broker = BrokerCanales(options['socket'], capacity=options['capacidad'])
+        self.stdout.write(f"📡 Broker de canales en {options['socket']}")
+        try:
+            asyncio.run(broker.servir())
+        except KeyboardInterrupt:
+            pass
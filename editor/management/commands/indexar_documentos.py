@@ -0,0 +1,44 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from editor import busqueda
+from editor.models import Documento
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de búsqueda FTS5 a partir de la tabla de documentos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=500, help='Documentos por transacción')
+
+    def handle(self, *args, **options):
+        if not busqueda.disponible():
+            raise CommandError(
+                f'No existe la tabla {busqueda.TABLA}: se necesita SQLite con FTS5 y la migración 0004'
+            )
+
+        inicio = time.perf_counter()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {busqueda.TABLA}')
+
+        total = 0
+        documentos = Documento.objects.only('id', 'titulo', 'contenido').order_by('id')
+        ultimo_id = 0
+        while True:
+            lote = list(documentos.filter(id__gt=ultimo_id)[:options['lote']])
+            if not lote:
+                break
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {busqueda.TABLA} (rowid, titulo, contenido) VALUES (%s, %s, %s)',
+                    [(doc.id, doc.titulo, doc.contenido) for doc in lote],
+                )
+            total += len(lote)
+            ultimo_id = lote[-1].id
+            self.stdout.write(f'   {total} documentos indexados')
+
+        with connection.cursor() as cursor:
+            # Fusiona los segmentos del índice para que las consultas lean menos
+            cursor.execute(f"INSERT INTO {busqueda.TABLA} ({busqueda.TABLA}) VALUES ('optimize')")
+
+        self.stdout.write(f'✅ Índice reconstruido: {total} documentos en {time.perf_counter() - inicio:.1f} s')
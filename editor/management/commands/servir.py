@@ -0,0 +1,86 @@
+import asyncio
+import os
+import signal
+import socket
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from editor.capa_canales import BrokerCanales
+
+
+class Command(BaseCommand):
+    help = 'Inicia Daphne con uno o varios workers en el mismo puerto y el broker de canales local'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=int(os.environ.get('DAPHNE_WORKERS', os.cpu_count() or 1)),
+            help='Número de procesos de Daphne (por defecto, uno por núcleo)',
+        )
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--puerto', type=int, default=8000)
+        parser.add_argument('--socket', default=settings.EDITOR_BROKER_SOCKET)
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        aplicacion = 'proyecto.asgi:application'
+
+        if workers == 1:
+            # Un solo proceso: Daphne directo con la capa en memoria
+            self.stdout.write(f"🌐 Iniciando Daphne en {options['host']}:{options['puerto']}")
+            os.execvp('daphne', ['daphne', '-b', options['host'], '-p', str(options['puerto']), aplicacion])
+
+        # Todos los workers aceptan conexiones del mismo socket heredado
+        servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        servidor.bind((options['host'], options['puerto']))
+        servidor.listen(1024)
+        servidor.set_inheritable(True)
+
+        entorno = dict(
+            os.environ,
+            EDITOR_WORKERS=str(workers),
+            EDITOR_BROKER_SOCKET=options['socket'],
+        )
+        self.stdout.write(
+            f"🌐 Iniciando {workers} workers de Daphne en {options['host']}:{options['puerto']}"
+        )
+        codigo = asyncio.run(self._supervisar(servidor, workers, aplicacion, entorno, options['socket']))
+        raise SystemExit(codigo)
+
+    async def _supervisar(self, servidor, workers, aplicacion, entorno, ruta_socket):
+        """Corre el broker y los workers; si uno termina, se detienen todos"""
+        broker = BrokerCanales(ruta_socket)
+        tarea_broker = asyncio.ensure_future(broker.servir())
+        while not os.path.exists(ruta_socket):
+            await asyncio.sleep(0.05)
+
+        procesos = [
+            await asyncio.create_subprocess_exec(
+                'daphne', '--fd', str(servidor.fileno()), aplicacion,
+                pass_fds=[servidor.fileno()],
+                env=entorno,
+            )
+            for _ in range(workers)
+        ]
+
+        loop = asyncio.get_running_loop()
+        detener = asyncio.Event()
+        for senal in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(senal, detener.set)
+
+        esperas = [asyncio.ensure_future(proceso.wait()) for proceso in procesos]
+        parada = asyncio.ensure_future(detener.wait())
+        await asyncio.wait([*esperas, parada], return_when=asyncio.FIRST_COMPLETED)
+
+        caidos = [proceso for proceso in procesos if proceso.returncode is not None]
+        if caidos:
+            self.stderr.write(f"❌ Un worker terminó con código {caidos[0].returncode}, deteniendo el resto")
+
+        for proceso in procesos:
+            if proceso.returncode is None:
+                proceso.terminate()
+        await asyncio.gather(*esperas)
+        parada.cancel()
+        tarea_broker.cancel()
+        return caidos[0].returncode if caidos else 0
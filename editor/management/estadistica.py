@@ -0,0 +1,9 @@
+"""Utilidades comunes de los comandos de medición"""
+
+
+def percentil(valores, p):
+    """Valor en el percentil ``p`` (0-100) de ``valores``; 0.0 si no hay valores"""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
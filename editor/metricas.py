@@ -0,0 +1,292 @@
+"""
+Métricas del servidor de colaboración en formato de texto de Prometheus.
+
+Los valores son de este proceso; con varios workers cada uno expone los
+suyos. La ruta ``EDITOR_METRICAS_RUTA`` se atiende antes de Django (ver
+``con_metricas`` en ``proyecto/asgi.py``) para que consultarla bajo carga
+no pase por el middleware, y exige ``Authorization: Bearer <token>`` con
+``EDITOR_METRICAS_TOKEN``. Sin token la ruta no se monta. Las consultas con
+un host fuera de ``ALLOWED_HOSTS`` o por HTTP cuando se redirige a HTTPS se
+dejan a Django, que las rechaza o redirige como a cualquier otra.
+"""
+import functools
+import hmac
+import logging
+import time
+from bisect import bisect_left
+from django.conf import settings
+from django.http.request import split_domain_port, validate_host
+
+logger = logging.getLogger(__name__)
+
+RUTA = getattr(settings, 'EDITOR_METRICAS_RUTA', '/metrics')
+TOKEN = getattr(settings, 'EDITOR_METRICAS_TOKEN', '')
+
+LIMITES_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+LIMITES_SOCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _etiquetas(nombre, valor):
+    return f'{{{nombre}="{valor}"}}' if nombre else ''
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiqueta=None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiqueta = etiqueta
+        self.valores = {}
+
+    def inc(self, cantidad=1, valor=''):
+        self.valores[valor] = self.valores.get(valor, 0) + cantidad
+
+    def exponer(self, tipo='counter'):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} {tipo}']
+        for valor, total in sorted(self.valores.items()):
+            lineas.append(f'{self.nombre}{_etiquetas(self.etiqueta, valor)} {total}')
+        return lineas
+
+
+class Medidor(Contador):
+    def dec(self, cantidad=1, valor=''):
+        self.inc(-cantidad, valor)
+
+    def exponer(self):
+        return super().exponer('gauge')
+
+
+class Histograma:
+    def __init__(self, nombre, ayuda, limites=LIMITES_LATENCIA, etiqueta=None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.limites = limites
+        self.etiqueta = etiqueta
+        self.series = {}  # valor de la etiqueta -> [conteo por límite..., +Inf], suma
+
+    def observar(self, medida, valor=''):
+        serie = self.series.get(valor)
+        if serie is None:
+            serie = self.series[valor] = [[0] * (len(self.limites) + 1), 0.0]
+        serie[0][bisect_left(self.limites, medida)] += 1
+        serie[1] += medida
+
+    def exponer(self):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} histogram']
+        for valor, (conteos, suma) in sorted(self.series.items()):
+            prefijo = f'{self.etiqueta}="{valor}",' if self.etiqueta else ''
+            acumulado = 0
+            for limite, conteo in zip((*self.limites, '+Inf'), conteos):
+                acumulado += conteo
+                lineas.append(f'{self.nombre}_bucket{{{prefijo}le="{limite}"}} {acumulado}')
+            lineas.append(f'{self.nombre}_sum{_etiquetas(self.etiqueta, valor)} {suma}')
+            lineas.append(f'{self.nombre}_count{_etiquetas(self.etiqueta, valor)} {acumulado}')
+        return lineas
+
+
+sockets_abiertos = Medidor('editor_sockets_abiertos', 'Sockets de documentos abiertos')
+bytes_recibidos = Contador(
+    'editor_bytes_recibidos_total', 'Bytes de las tramas recibidas (UTF-8 en las de texto)'
+)
+bytes_enviados = Contador(
+    'editor_bytes_enviados_total', 'Bytes de las tramas enviadas (UTF-8 en las de texto)'
+)
+latencia_difusion = Histograma(
+    'editor_latencia_difusion_segundos', 'Desde que llega una edición hasta que se difunde al grupo'
+)
+tiempo_bd = Histograma(
+    'editor_bd_segundos', 'Duración de las consultas a la base de datos', etiqueta='operacion'
+)
+
+_registro = [sockets_abiertos, bytes_recibidos, bytes_enviados, latencia_difusion, tiempo_bd]
+
+
+def cronometrar_bd(operacion):
+    """Registra en ``editor_bd_segundos`` la duración de una corrutina"""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        async def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return await funcion(*args, **kwargs)
+            finally:
+                tiempo_bd.observar(time.perf_counter() - inicio, operacion)
+        return envoltura
+    return decorador
+
+
+def _profundidad_capa():
+    """Mensajes esperando en las colas del channel layer de este proceso"""
+    from channels.layers import get_channel_layer
+    capa = get_channel_layer()
+    if hasattr(capa, 'mensajes_en_cola'):
+        return capa.mensajes_en_cola()
+    # InMemoryChannelLayer
+    return sum(cola.qsize() for cola in getattr(capa, 'channels', {}).values())
+
+
+def exponer():
+    """Texto con todas las métricas del proceso"""
+    from . import limites, registro, tickets
+    from .escritor import escritor
+    from .flujo import contadores
+    from .persistencia import guardado_diferido
+    from .salas import MEMORIA_SALAS, salas_abiertas, salas_inactivas
+
+    lineas = []
+    for metrica in _registro:
+        lineas.extend(metrica.exponer())
+
+    salas = Medidor('editor_salas_activas', 'Documentos abiertos en este proceso')
+    salas.inc(len(salas_abiertas))
+    lineas.extend(salas.exponer())
+
+    inactivas = Medidor('editor_salas_inactivas', 'Salas sin conexiones conservadas en memoria')
+    inactivas.inc(len(salas_inactivas))
+    lineas.extend(inactivas.exponer())
+
+    memoria = Medidor('editor_salas_bytes', 'Bytes aproximados de las salas del proceso', etiqueta='tipo')
+    memoria.inc(sum(sala.tamano() for sala in salas_abiertas.values()), 'ocupados')
+    memoria.inc(MEMORIA_SALAS, 'limite')
+    lineas.extend(memoria.exponer())
+
+    # Distribución de sockets por sala en el momento de la consulta
+    por_sala = Histograma('editor_sockets_por_sala', 'Sockets conectados a cada sala abierta', LIMITES_SOCKETS)
+    for sala in salas_abiertas.values():
+        por_sala.observar(sala.conectados)
+    lineas.extend(por_sala.exponer())
+
+    cola = Medidor('editor_capa_canales_cola', 'Mensajes pendientes en el channel layer')
+    cola.inc(_profundidad_capa())
+    lineas.extend(cola.exponer())
+
+    flujo = Contador('editor_flujo_total', 'Eventos del control de flujo por conexión', etiqueta='evento')
+    for evento, total in contadores.items():
+        flujo.inc(total, evento)
+    lineas.extend(flujo.exponer())
+
+    admitidos = Medidor('editor_sockets_admitidos', 'Sockets admitidos por el límite del proceso')
+    admitidos.inc(limites.conexiones)
+    lineas.extend(admitidos.exponer())
+
+    rechazos = Contador('editor_rechazos_total', 'Mensajes y conexiones rechazados por los límites', etiqueta='motivo')
+    for motivo, total in limites.rechazos.items():
+        rechazos.inc(total, motivo)
+    lineas.extend(rechazos.exponer())
+
+    autenticaciones = Contador('editor_autenticaciones_total', 'Sockets autenticados por ticket o por sesión', etiqueta='metodo')
+    for metodo, total in tickets.autenticaciones.items():
+        autenticaciones.inc(total, metodo)
+    lineas.extend(autenticaciones.exponer())
+
+    cubetas = Medidor('editor_cubetas_limite', 'Cubetas de fichas en memoria', etiqueta='tipo')
+    cubetas.inc(len(limites.por_usuario.cubetas), 'usuario')
+    cubetas.inc(len(limites.por_documento.cubetas), 'documento')
+    lineas.extend(cubetas.exponer())
+
+    configurados = Medidor('editor_limite', 'Límites configurados', etiqueta='limite')
+    for nombre, valor in (
+        ('usuario_ritmo', limites.RITMO_USUARIO),
+        ('usuario_rafaga', limites.RAFAGA_USUARIO),
+        ('documento_ritmo', limites.RITMO_DOCUMENTO),
+        ('documento_rafaga', limites.RAFAGA_DOCUMENTO),
+        ('mensaje_max_bytes', limites.MENSAJE_MAX_BYTES),
+        ('sockets_max', limites.SOCKETS_MAX),
+    ):
+        configurados.inc(valor, nombre)
+    lineas.extend(configurados.exponer())
+
+    cola_escritor = Medidor('editor_escritor_cola', 'Escrituras esperando al escritor único')
+    cola_escritor.inc(escritor.pendientes())
+    lineas.extend(cola_escritor.exponer())
+
+    lotes = Contador('editor_escritor_lotes_total', 'Transacciones confirmadas por el escritor único')
+    lotes.inc(escritor.lotes)
+    lineas.extend(lotes.exponer())
+
+    escrituras = Contador('editor_escritor_escrituras_total', 'Escrituras del escritor único por resultado', etiqueta='resultado')
+    escrituras.inc(escritor.escrituras, 'ok')
+    escrituras.inc(escritor.errores, 'error')
+    lineas.extend(escrituras.exponer())
+
+    guardados = Contador('editor_guardados_total', 'Guardados de documentos en la base de datos')
+    guardados.inc(guardado_diferido.escrituras)
+    lineas.extend(guardados.exponer())
+
+    sin_cambios = Contador('editor_guardados_sin_cambios_total', 'Guardados que solo escribieron la revisión: el contenido no cambió')
+    sin_cambios.inc(guardado_diferido.sin_cambios)
+    lineas.extend(sin_cambios.exponer())
+
+    descartados = Contador('editor_registros_descartados_total', 'Logs descartados por cola llena o por muestreo', etiqueta='motivo')
+    for motivo, total in registro.descartados.items():
+        descartados.inc(total, motivo)
+    lineas.extend(descartados.exponer())
+
+    cola_registro = Medidor('editor_registro_cola', 'Logs encolados pendientes de escribir')
+    cola_registro.inc(sum(
+        manejador.pendientes() for manejador in logging.getLogger().handlers
+        if isinstance(manejador, registro.ManejadorEnCola)
+    ))
+    lineas.extend(cola_registro.exponer())
+
+    sin_guardar = Medidor('editor_documentos_sin_guardar', 'Documentos con cambios pendientes de guardar')
+    sin_guardar.inc(len(guardado_diferido.sucios))
+    lineas.extend(sin_guardar.exponer())
+
+    return '\n'.join(lineas) + '\n'
+
+
+def _para_django(scope):
+    """True si la consulta debe pasar por Django: host no permitido o HTTP con redirección a HTTPS"""
+    cabeceras = dict(scope.get('headers', []))
+    host = cabeceras.get(b'host', b'').decode('latin-1')
+    permitidos = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not permitidos:
+        permitidos = ['.localhost', '127.0.0.1', '[::1]']
+    dominio, _ = split_domain_port(host)
+    if not dominio or not validate_host(dominio, permitidos):
+        return True
+    if getattr(settings, 'SECURE_SSL_REDIRECT', False) and scope.get('scheme') != 'https':
+        cabecera_proxy = getattr(settings, 'SECURE_PROXY_SSL_HEADER', None)
+        if cabecera_proxy is None:
+            return True
+        nombre, valor = cabecera_proxy
+        # 'HTTP_X_FORWARDED_PROTO' -> b'x-forwarded-proto'
+        nombre = nombre.removeprefix('HTTP_').replace('_', '-').lower().encode('latin-1')
+        return cabeceras.get(nombre, b'').decode('latin-1').split(',')[0].strip() != valor
+    return False
+
+
+def _autorizado(scope):
+    if not TOKEN:
+        return False
+    for nombre, valor in scope.get('headers', []):
+        if nombre == b'authorization':
+            return hmac.compare_digest(valor, f'Bearer {TOKEN}'.encode())
+    return False
+
+
+async def _responder(scope, send):
+    if not _autorizado(scope):
+        estado, cuerpo = 401, b'No autorizado\n'
+    else:
+        estado, cuerpo = 200, exponer().encode()
+    await send({
+        'type': 'http.response.start',
+        'status': estado,
+        'headers': [(b'content-type', b'text/plain; version=0.0.4; charset=utf-8')],
+    })
+    await send({'type': 'http.response.body', 'body': cuerpo})
+
+
+def con_metricas(aplicacion):
+    """Aplicación ASGI que atiende la ruta de métricas y delega el resto"""
+    if not TOKEN:
+        logger.info("📊 Sin EDITOR_METRICAS_TOKEN: %s no se sirve", RUTA)
+        return aplicacion
+
+    async def atender(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == RUTA and not _para_django(scope):
+            await _responder(scope, send)
+            return
+        await aplicacion(scope, receive, send)
+    return atender
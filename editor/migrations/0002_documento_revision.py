@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('editor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documento',
+            name='epoca',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='documento',
+            name='revision',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
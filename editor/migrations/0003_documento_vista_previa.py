@@ -0,0 +1,48 @@
+# Generated by Django 5.0 on 2026-10-18 10:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def resumen_contenido(contenido):
+    # Copia de editor.models.resumen_contenido tal como era al crear la migración
+    vista_previa = ' '.join(contenido[:160 * 2].split())[:160]
+    return vista_previa, len(contenido.encode('utf-8'))
+
+
+def calcular_resumenes(apps, schema_editor):
+    Documento = apps.get_model('editor', 'Documento')
+    lote = []
+    for doc in Documento.objects.only('id', 'contenido').iterator(chunk_size=200):
+        doc.vista_previa, doc.tamano = resumen_contenido(doc.contenido)
+        lote.append(doc)
+        if len(lote) == 200:
+            Documento.objects.bulk_update(lote, ['vista_previa', 'tamano'])
+            lote = []
+    Documento.objects.bulk_update(lote, ['vista_previa', 'tamano'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('editor', '0002_documento_revision'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documento',
+            name='tamano',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='documento',
+            name='vista_previa',
+            field=models.CharField(blank=True, default='', max_length=160),
+        ),
+        migrations.AddIndex(
+            model_name='documento',
+            index=models.Index(fields=['propietario', '-actualizado', '-id'], name='documento_propietario_idx'),
+        ),
+        migrations.RunPython(calcular_resumenes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, OperationalError
+
+
+def crear_indice(apps, schema_editor):
+    # Solo SQLite; sin FTS5 la búsqueda recurre a icontains
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS editor_documento_fts USING fts5("
+            "titulo, contenido, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+    except OperationalError:
+        return
+    schema_editor.execute(
+        "INSERT INTO editor_documento_fts (rowid, titulo, contenido) "
+        "SELECT id, titulo, contenido FROM editor_documento"
+    )
+
+
+def borrar_indice(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS editor_documento_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('editor', '0003_documento_vista_previa'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.0 on 2026-10-18 10:36
+
+import editor.campos
+from django.db import migrations
+
+LOTE = 200
+
+
+def comprimir(apps, schema_editor):
+    # Las filas siguen en texto plano hasta que se reescriben con el campo nuevo;
+    # sin EDITOR_COMPRIMIR_CONTENIDO la columna sigue siendo de texto
+    if not editor.campos.COMPRIMIR:
+        return
+    Documento = apps.get_model('editor', 'Documento')
+    ultimo_id = 0
+    while True:
+        lote = list(Documento.objects.filter(id__gt=ultimo_id).only('id', 'contenido').order_by('id')[:LOTE])
+        if not lote:
+            break
+        Documento.objects.bulk_update(lote, ['contenido'])
+        ultimo_id = lote[-1].id
+
+
+def descomprimir(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT id, contenido FROM editor_documento')
+        filas = cursor.fetchall()
+        cursor.executemany(
+            'UPDATE editor_documento SET contenido = %s WHERE id = %s',
+            [(editor.campos.descomprimir_texto(contenido), doc_id) for doc_id, contenido in filas if contenido is not None],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('editor', '0004_documento_fts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='documento',
+            name='contenido',
+            field=editor.campos.TextoComprimido(blank=True),
+        ),
+        migrations.RunPython(comprimir, descomprimir),
+    ]
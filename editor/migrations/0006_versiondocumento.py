@@ -0,0 +1,35 @@
+# Generated by Django 5.0 on 2026-10-18 10:38
+
+import django.db.models.deletion
+import editor.campos
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('editor', '0005_contenido_comprimido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionDocumento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revision', models.PositiveBigIntegerField()),
+                ('epoca', models.CharField(blank=True, default='', max_length=16)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('instantanea', editor.campos.TextoComprimido(blank=True, null=True)),
+                ('diferencia', editor.campos.TextoComprimido(blank=True, default='')),
+                ('distancia', models.PositiveIntegerField(default=0)),
+                ('tamano', models.PositiveIntegerField(default=0)),
+                ('documento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versiones', to='editor.documento')),
+            ],
+            options={
+                'verbose_name': 'Versión de Documento',
+                'verbose_name_plural': 'Versiones de Documentos',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['documento', '-id'], name='version_documento_idx')],
+            },
+        ),
+    ]
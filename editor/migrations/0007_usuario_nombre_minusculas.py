@@ -0,0 +1,25 @@
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+# Para buscar usuarios por prefijo sin distinguir mayúsculas
+INDICE = models.Index(Lower('username'), name='editor_usuario_nombre_idx')
+
+
+def crear_indice(apps, schema_editor):
+    schema_editor.add_index(apps.get_model('auth', 'User'), INDICE)
+
+
+def borrar_indice(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model('auth', 'User'), INDICE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('editor', '0006_versiondocumento'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
@@ -1,9 +1,25 @@
 from django.db import models
 from django.contrib.auth.models import User
+from .campos import TextoComprimido
+
+LARGO_VISTA_PREVIA = 160
+
+
+def resumen_contenido(contenido):
+    """Vista previa en una línea y tamaño en bytes del contenido"""
+    vista_previa = ' '.join(contenido[:LARGO_VISTA_PREVIA * 2].split())[:LARGO_VISTA_PREVIA]
+    return vista_previa, len(contenido.encode('utf-8'))
+
 
 class Documento(models.Model):
     titulo = models.CharField(max_length=100)
-    contenido = models.TextField(blank=True)
+    contenido = TextoComprimido(blank=True)
+    # Última revisión guardada y época (cadena de operaciones) que la produjo
+    revision = models.PositiveBigIntegerField(default=0)
+    epoca = models.CharField(max_length=16, blank=True, default='')
+    # Calculados al guardar: el dashboard los muestra sin leer el contenido
+    vista_previa = models.CharField(max_length=LARGO_VISTA_PREVIA, blank=True, default='')
+    tamano = models.PositiveIntegerField(default=0)
     propietario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='documentos_propios')
     creado = models.DateTimeField(auto_now_add=True)
     actualizado = models.DateTimeField(auto_now=True)
@@ -15,29 +31,47 @@ class Documento(models.Model):
         verbose_name = "Documento"
         verbose_name_plural = "Documentos"
         ordering = ['-actualizado']
+        indexes = [
+            # Paginación por cursor del dashboard
+            models.Index(fields=['propietario', '-actualizado', '-id'], name='documento_propietario_idx'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        if 'contenido' not in self.get_deferred_fields():
+            self.vista_previa, self.tamano = resumen_contenido(self.contenido)
+            campos = kwargs.get('update_fields')
+            if campos is not None and 'contenido' in campos:
+                kwargs['update_fields'] = {*campos, 'vista_previa', 'tamano'}
+        super().save(*args, **kwargs)
+    
+    def acceso(self, usuario):
+        """(puede_ver, puede_editar) del usuario; una consulta como mucho por usuario e instancia"""
+        accesos = self.__dict__.setdefault('_accesos', {})
+        if usuario.id not in accesos:
+            if not usuario.is_authenticated:
+                accesos[usuario.id] = (False, False)
+            elif self.propietario_id == usuario.id:
+                # El propietario siempre puede ver y editar
+                accesos[usuario.id] = (True, True)
+            else:
+                # Permiso compartido: sin fila no puede ver
+                puede_editar = PermisoDocumento.objects.filter(
+                    documento_id=self.id,
+                    usuario_id=usuario.id
+                ).values_list('puede_editar', flat=True).first()
+                accesos[usuario.id] = (puede_editar is not None, bool(puede_editar))
+        return accesos[usuario.id]
+    
+    def es_propietario(self, usuario):
+        return self.propietario_id == usuario.id
     
     def puede_editar(self, usuario):
         """Verifica si un usuario puede editar este documento"""
-        # El propietario siempre puede editar
-        if self.propietario == usuario:
-            return True
-        # Verificar si tiene permiso compartido de escritura
-        return PermisoDocumento.objects.filter(
-            documento=self,
-            usuario=usuario,
-            puede_editar=True
-        ).exists()
+        return self.acceso(usuario)[1]
     
     def puede_ver(self, usuario):
         """Verifica si un usuario puede ver este documento"""
-        # El propietario siempre puede ver
-        if self.propietario == usuario:
-            return True
-        # Verificar si tiene algún permiso compartido
-        return PermisoDocumento.objects.filter(
-            documento=self,
-            usuario=usuario
-        ).exists()
+        return self.acceso(usuario)[0]
 
 
 class PermisoDocumento(models.Model):
@@ -55,4 +89,30 @@ class PermisoDocumento(models.Model):
     
     def __str__(self):
         permiso = "Editar" if self.puede_editar else "Solo lectura"
-        return f"{self.documento.titulo} → {self.usuario.username} ({permiso})"
\ No newline at end of file
+        return f"{self.documento.titulo} → {self.usuario.username} ({permiso})"
+
+
+class VersionDocumento(models.Model):
+    documento = models.ForeignKey(Documento, on_delete=models.CASCADE, related_name='versiones')
+    revision = models.PositiveBigIntegerField()
+    epoca = models.CharField(max_length=16, blank=True, default='')
+    creado = models.DateTimeField(auto_now_add=True)
+    # Contenido completo, o None si la versión guarda solo la diferencia
+    # (operaciones en JSON) con la versión anterior del documento
+    instantanea = TextoComprimido(null=True, blank=True)
+    diferencia = TextoComprimido(blank=True, default='')
+    # Diferencias desde la última instantánea (0 en las instantáneas)
+    distancia = models.PositiveIntegerField(default=0)
+    # Bytes del contenido en esta versión
+    tamano = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Versión de Documento"
+        verbose_name_plural = "Versiones de Documentos"
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['documento', '-id'], name='version_documento_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.documento_id} r{self.revision} ({'instantánea' if self.instantanea is not None else 'diferencia'})"
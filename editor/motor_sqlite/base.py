@@ -0,0 +1,28 @@
+"""
+Motor SQLite de Django con el perfil de producción del editor.
+
+Igual que ``django.db.backends.sqlite3`` más dos cambios: al abrir cada
+conexión se aplican los PRAGMA de ``OPTIONS['pragmas']`` (WAL,
+synchronous, mmap, caché...) y las transacciones empiezan con
+``BEGIN IMMEDIATE``. Con ``BEGIN`` a secas una transacción que lee y luego
+escribe puede encontrarse el cerrojo tomado al pasar a escritura y SQLite
+responde "database is locked" sin esperar el ``timeout``; tomándolo al
+empezar, la espera sí se aplica.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        parametros = super().get_connection_params()
+        parametros.pop('pragmas', None)
+        return parametros
+
+    def get_new_connection(self, conn_params):
+        conexion = super().get_new_connection(conn_params)
+        for nombre, valor in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            conexion.execute(f'PRAGMA {nombre} = {valor}')
+        return conexion
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -0,0 +1,39 @@
+"""
+Avisos desde las vistas HTTP a los sockets abiertos de un documento.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from . import tickets
+
+
+def nombre_grupo(doc_id):
+    """Grupo del channel layer con los sockets que editan un documento"""
+    return f'documento_{doc_id}'
+
+
+def nombre_grupo_lectores(doc_id):
+    """Grupo con los sockets de solo lectura, que reciben el estado periódicamente"""
+    return f'documento_{doc_id}_lectores'
+
+
+def _enviar(doc_id, mensaje):
+    # doc_id también para las salas inactivas, que escuchan por el canal del proceso
+    mensaje['doc_id'] = doc_id
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        for grupo in (nombre_grupo(doc_id), nombre_grupo_lectores(doc_id)):
+            async_to_sync(channel_layer.group_send)(grupo, mensaje)
+
+
+def notificar_permisos(doc_id, usuarios_ids):
+    """Los permisos de estos usuarios sobre el documento cambiaron"""
+    tickets.permisos_cambiados(doc_id)
+    _enviar(doc_id, {
+        'type': 'permisos_actualizados',
+        'usuarios': list(usuarios_ids),
+    })
+
+
+def notificar_documento_eliminado(doc_id):
+    """El documento ya no existe: los sockets deben cerrarse"""
+    _enviar(doc_id, {'type': 'documento_eliminado'})
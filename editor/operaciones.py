@@ -0,0 +1,280 @@
+"""
+Transformación operacional (OT) para ediciones de texto.
+
+Una operación es una lista de componentes que se aplican en orden, cada uno
+expresado en puntos de código sobre el texto resultante del anterior:
+
+    {'pos': 10, 'insertar': 'hola'}
+    {'pos': 4, 'borrar': 3}
+"""
+import secrets
+from hashlib import blake2b
+from collections import deque
+from itertools import islice
+
+# Componentes máximos por operación (el editor envía como mucho dos)
+MAX_COMPONENTES = 256
+
+# Operaciones recordadas por documento para transformar ediciones concurrentes
+MAX_HISTORIAL = 500
+
+
+class OperacionInvalida(ValueError):
+    """La operación no es válida o no encaja en el contenido actual"""
+
+
+class RevisionDesconocida(Exception):
+    """La revisión base de la operación ya no está en el historial"""
+
+
+def normalizar(ops):
+    """Valida una operación recibida del cliente y descarta componentes vacíos"""
+    if not isinstance(ops, list) or len(ops) > MAX_COMPONENTES:
+        raise OperacionInvalida('La operación debe ser una lista de componentes')
+
+    resultado = []
+    for op in ops:
+        if not isinstance(op, dict):
+            raise OperacionInvalida('Componente de operación inválido')
+        pos = op.get('pos')
+        if not isinstance(pos, int) or isinstance(pos, bool) or pos < 0:
+            raise OperacionInvalida('Posición inválida')
+
+        if 'insertar' in op:
+            texto = op['insertar']
+            if not isinstance(texto, str):
+                raise OperacionInvalida('El texto a insertar debe ser una cadena')
+            if texto:
+                resultado.append({'pos': pos, 'insertar': texto})
+        elif 'borrar' in op:
+            cantidad = op['borrar']
+            if not isinstance(cantidad, int) or isinstance(cantidad, bool) or cantidad < 0:
+                raise OperacionInvalida('Cantidad a borrar inválida')
+            if cantidad:
+                resultado.append({'pos': pos, 'borrar': cantidad})
+        else:
+            raise OperacionInvalida('El componente debe insertar o borrar')
+
+    return resultado
+
+
+def aplicar(contenido, ops):
+    """Aplica una operación a ``contenido`` y devuelve el texto resultante"""
+    for op in ops:
+        pos = op['pos']
+        if pos > len(contenido):
+            raise OperacionInvalida(f'Posición {pos} fuera del documento')
+        if 'insertar' in op:
+            contenido = contenido[:pos] + op['insertar'] + contenido[pos:]
+        else:
+            fin = pos + op['borrar']
+            if fin > len(contenido):
+                raise OperacionInvalida(f'Borrado {pos}-{fin} fuera del documento')
+            contenido = contenido[:pos] + contenido[fin:]
+    return contenido
+
+
+def tamano(ops):
+    """Bytes aproximados que modifica una operación"""
+    return sum(
+        len(op['insertar'].encode()) if 'insertar' in op else op['borrar']
+        for op in ops
+    )
+
+
+def _transformar_componente(a, b, prioridad):
+    """Ajusta el componente ``a`` para aplicarlo después de ``b``"""
+    pa, pb = a['pos'], b['pos']
+
+    if 'insertar' in a:
+        if 'insertar' in b:
+            # Inserciones en la misma posición: decide la prioridad
+            if pa < pb or (pa == pb and prioridad):
+                return [a]
+            return [{'pos': pa + len(b['insertar']), 'insertar': a['insertar']}]
+
+        fin_b = pb + b['borrar']
+        if pa <= pb:
+            return [a]
+        if pa >= fin_b:
+            return [{'pos': pa - b['borrar'], 'insertar': a['insertar']}]
+        # La inserción cae dentro del texto borrado
+        return [{'pos': pb, 'insertar': a['insertar']}]
+
+    borrar = a['borrar']
+    if 'insertar' in b:
+        largo = len(b['insertar'])
+        if pb <= pa:
+            return [{'pos': pa + largo, 'borrar': borrar}]
+        if pb >= pa + borrar:
+            return [a]
+        # El texto insertado parte el borrado en dos y se conserva
+        antes = pb - pa
+        return [
+            {'pos': pa, 'borrar': antes},
+            {'pos': pa + largo, 'borrar': borrar - antes},
+        ]
+
+    fin_b = pb + b['borrar']
+    if pa >= fin_b:
+        return [{'pos': pa - b['borrar'], 'borrar': borrar}]
+    if pa + borrar <= pb:
+        return [a]
+    # Borrados solapados: solo queda lo que ``b`` no borró
+    solapado = min(pa + borrar, fin_b) - max(pa, pb)
+    restante = borrar - solapado
+    if not restante:
+        return []
+    return [{'pos': min(pa, pb), 'borrar': restante}]
+
+
+def transformar(ops, contra, prioridad=False):
+    """
+    Transforma dos operaciones concurrentes sobre el mismo texto.
+
+    Devuelve ``(ops', contra')`` de modo que aplicar ``contra`` y luego
+    ``ops'`` produce lo mismo que aplicar ``ops`` y luego ``contra'``.
+    Con ``prioridad`` las inserciones de ``ops`` quedan antes en empates.
+    """
+    if not ops or not contra:
+        return ops, contra
+
+    if len(ops) > 1:
+        primero, contra = transformar(ops[:1], contra, prioridad)
+        resto, contra = transformar(ops[1:], contra, prioridad)
+        return primero + resto, contra
+
+    if len(contra) > 1:
+        ops, primero = transformar(ops, contra[:1], prioridad)
+        ops, resto = transformar(ops, contra[1:], prioridad)
+        return ops, primero + resto
+
+    a, b = ops[0], contra[0]
+    return (
+        _transformar_componente(a, b, prioridad),
+        _transformar_componente(b, a, not prioridad),
+    )
+
+
+def _prefijo_comun(a, b):
+    """Longitud del prefijo común, comparando bloques en C por bisección"""
+    bajo, alto = 0, min(len(a), len(b))
+    while bajo < alto:
+        medio = (bajo + alto + 1) // 2
+        if a[bajo:medio] == b[bajo:medio]:
+            bajo = medio
+        else:
+            alto = medio - 1
+    return bajo
+
+
+def diferencia(antes, despues):
+    """Operación mínima (prefijo/sufijo común) que convierte ``antes`` en ``despues``"""
+    inicio = _prefijo_comun(antes, despues)
+    limite = min(len(antes), len(despues)) - inicio
+    fin = _prefijo_comun(antes[::-1][:limite], despues[::-1][:limite])
+
+    ops = []
+    borrado = len(antes) - inicio - fin
+    if borrado:
+        ops.append({'pos': inicio, 'borrar': borrado})
+    insertado = despues[inicio:len(despues) - fin]
+    if insertado:
+        ops.append({'pos': inicio, 'insertar': insertado})
+    return ops
+
+
+def huella(contenido):
+    """Resumen corto del contenido para saber si cambió sin guardar una copia"""
+    return blake2b(contenido.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+class EstadoDocumento:
+    """Contenido y revisión autoritativos de un documento abierto"""
+
+    def __init__(self, contenido, revision=0, epoca='', max_historial=MAX_HISTORIAL):
+        self.contenido = contenido
+        self.revision = revision
+        # Operaciones aplicadas; la última corresponde a ``self.revision``
+        self.historial = deque(maxlen=max_historial)
+        # La época identifica la cadena de revisiones: la primera edición
+        # tras cargar el documento abre una nueva, así una revisión perdida
+        # (proceso caído sin guardar) nunca se confunde con una nueva
+        self.epoca = epoca
+        self.revision_inicial = revision
+        self.epoca_inicial = epoca
+        # Cambios aún no escritos en la base de datos
+        self.revision_guardada = revision
+        self.bytes_pendientes = 0
+        # Huella del último contenido escrito en la base de datos
+        self.huella_guardada = huella(contenido)
+
+    def recibir(self, revision_base, ops):
+        """Transforma ``ops`` desde ``revision_base`` y las aplica; devuelve las ops aplicadas"""
+        pendientes = self.revision - revision_base
+        if pendientes < 0 or pendientes > len(self.historial):
+            raise RevisionDesconocida(
+                f'Revisión {revision_base} fuera del historial (actual {self.revision})'
+            )
+
+        for anteriores in islice(self.historial, len(self.historial) - pendientes, None):
+            ops, _ = transformar(ops, anteriores)
+
+        self.contenido = aplicar(self.contenido, ops)
+        self._registrar(ops)
+        return ops
+
+    def reemplazar(self, contenido):
+        """Sustituye el contenido completo (clientes antiguos); devuelve las ops equivalentes"""
+        ops = diferencia(self.contenido, contenido)
+        self.contenido = contenido
+        self._registrar(ops)
+        return ops
+
+    def _registrar(self, ops):
+        if self.revision == self.revision_inicial:
+            self.epoca = secrets.token_hex(4)
+        self.revision += 1
+        self.historial.append(ops)
+        self.bytes_pendientes += tamano(ops)
+
+    def aplicar_remota(self, ops, epoca=None):
+        """Avanza una réplica con una operación ya transformada por el dueño"""
+        self.contenido = aplicar(self.contenido, ops)
+        self.revision += 1
+        self.historial.append(ops)
+        if epoca:
+            self.epoca = epoca
+
+    def estreno_epoca(self):
+        """Indica si la última revisión abrió la época actual"""
+        return self.revision == self.revision_inicial + 1
+
+    def ops_desde(self, revision, epoca):
+        """
+        Operaciones posteriores a ``revision`` para reanudar un cliente.
+
+        Devuelve None si la revisión no pertenece a esta cadena, ya salió
+        del historial o el contenido completo ocupa menos.
+        """
+        if revision == self.revision_inicial:
+            if epoca != self.epoca_inicial:
+                return None
+        elif revision < self.revision_inicial or epoca != self.epoca:
+            return None
+        return self.ops_entre(revision, self.revision)
+
+    def ops_entre(self, desde, hasta):
+        """
+        Operaciones de las revisiones ``desde + 1`` a ``hasta``.
+
+        Devuelve None si ya salieron del historial o si el contenido
+        completo ocupa menos.
+        """
+        inicio = len(self.historial) - (self.revision - desde)
+        if inicio < 0 or desde > hasta or hasta > self.revision:
+            return None
+        operaciones = list(islice(self.historial, inicio, inicio + hasta - desde))
+        if sum(tamano(ops) for ops in operaciones) > len(self.contenido):
+            return None
+        return operaciones
@@ -0,0 +1,48 @@
+"""
+Permisos de un usuario sobre un documento, resueltos en una sola consulta.
+
+``resolver`` lee el documento (sin el contenido), su propietario y el
+permiso compartido del usuario de la petición con una subconsulta, y guarda
+el resultado en la petición: las comprobaciones siguientes de la misma
+vista (``puede_ver``, ``puede_editar``, ``es_propietario``) no vuelven a la
+base de datos. El socket usa la misma subconsulta en ``anotar_permiso``.
+"""
+from django.db.models import OuterRef, Subquery
+from django.shortcuts import get_object_or_404
+from .models import Documento, PermisoDocumento
+
+
+def anotar_permiso(documentos, usuario_id):
+    """Agrega ``permiso_edicion``: el permiso compartido del usuario (None si no tiene)"""
+    return documentos.annotate(permiso_edicion=Subquery(
+        PermisoDocumento.objects.filter(
+            documento=OuterRef('pk'),
+            usuario_id=usuario_id,
+        ).values('puede_editar')[:1]
+    ))
+
+
+def acceso_desde_permiso(propietario_id, permiso_edicion, usuario_id):
+    """(puede_ver, puede_editar) a partir del propietario y del permiso anotado"""
+    if propietario_id == usuario_id:
+        return True, True
+    return permiso_edicion is not None, bool(permiso_edicion)
+
+
+def resolver(request, doc_id):
+    """Documento con el acceso del usuario de la petición resuelto; 404 si no existe"""
+    documentos = request.__dict__.setdefault('_documentos', {})
+    if doc_id not in documentos:
+        usuario = request.user
+        doc = get_object_or_404(
+            anotar_permiso(
+                Documento.objects.defer('contenido').select_related('propietario'),
+                usuario.id,
+            ),
+            id=doc_id,
+        )
+        doc._accesos = {
+            usuario.id: acceso_desde_permiso(doc.propietario_id, doc.permiso_edicion, usuario.id),
+        }
+        documentos[doc_id] = doc
+    return documentos[doc_id]
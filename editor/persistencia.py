@@ -0,0 +1,197 @@
+"""
+Guardado diferido (write-behind) de los documentos abiertos.
+
+El ``EstadoDocumento`` en memoria es la copia autoritativa mientras haya
+conexiones; aquí se agrupan sus cambios y se escriben en la base de datos
+cada ``EDITOR_GUARDADO_INTERVALO`` segundos o al acumular
+``EDITOR_GUARDADO_MAX_BYTES``, con un guardado final al cerrar la sala y al
+terminar el proceso.
+"""
+import asyncio
+import atexit
+import logging
+from django.conf import settings
+from django.utils import timezone
+from . import busqueda, historial
+from .escritor import escritor
+from .metricas import cronometrar_bd
+from .models import Documento, resumen_contenido
+from .operaciones import huella
+
+logger = logging.getLogger(__name__)
+
+
+def _campos_guardado(contenido, revision, epoca):
+    """Solo el contenido, su revisión y la fecha: se actualiza sin cargar el documento"""
+    vista_previa, tamano = resumen_contenido(contenido)
+    return {
+        'contenido': contenido,
+        'vista_previa': vista_previa,
+        'tamano': tamano,
+        'revision': revision,
+        'epoca': epoca,
+        'actualizado': timezone.now(),
+    }
+
+
+def escribir_contenido(doc_id, contenido, revision, epoca):
+    """Escribe el contenido y lo indexa; se ejecuta en el escritor único (``escritor.ejecutar``)"""
+    actualizados = Documento.objects.filter(id=doc_id).update(**_campos_guardado(contenido, revision, epoca))
+    if actualizados:
+        busqueda.actualizar(doc_id, contenido=contenido)
+    return actualizados
+
+
+def escribir_revision(doc_id, revision, epoca):
+    """Solo revisión y época: el contenido no cambió, así no se mueve ``actualizado`` ni se reindexa"""
+    return Documento.objects.filter(id=doc_id).update(revision=revision, epoca=epoca)
+
+
+@cronometrar_bd('save_documento_contenido')
+async def save_documento_contenido(doc_id, contenido, revision, epoca):
+    """True si se guardó, False si falló (se puede reintentar) y None si el documento ya no existe"""
+    try:
+        # Documento e índice en la misma escritura del escritor único
+        actualizados = await escritor.aejecutar(escribir_contenido, doc_id, contenido, revision, epoca)
+        if not actualizados:
+            logger.warning(f"⚠️ No se puede guardar: Documento {doc_id} no existe")
+            return None
+        logger.info(
+            "💾 Documento %s guardado: %d caracteres, revisión %d", doc_id, len(contenido), revision,
+            extra={'doc_id': doc_id, 'evento': 'guardado'},
+        )
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error al guardar: {e}", exc_info=True)
+        return False
+
+
+@cronometrar_bd('save_documento_revision')
+async def save_documento_revision(doc_id, revision, epoca):
+    """Como ``save_documento_contenido``: True, False o None si el documento ya no existe"""
+    try:
+        if not await escritor.aejecutar(escribir_revision, doc_id, revision, epoca):
+            logger.warning(f"⚠️ No se puede guardar: Documento {doc_id} no existe")
+            return None
+        logger.info(
+            "💾 Documento %s sin cambios en el contenido, revisión %d", doc_id, revision,
+            extra={'doc_id': doc_id, 'evento': 'guardado'},
+        )
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error al guardar: {e}", exc_info=True)
+        return False
+
+
+class GuardadoDiferido:
+    """Agrupa las escrituras de cada documento abierto en este proceso"""
+
+    def __init__(self, intervalo, max_bytes):
+        self.intervalo = intervalo
+        self.max_bytes = max_bytes
+        self.sucios = {}          # doc_id -> EstadoDocumento con cambios sin guardar
+        self.temporizadores = {}  # doc_id -> asyncio.TimerHandle
+        self.cerrojos = {}        # doc_id -> asyncio.Lock (un guardado a la vez)
+        self.tareas = set()
+        self.escrituras = 0       # Guardados hechos en la base de datos
+        self.sin_cambios = 0      # De ellos, solo la revisión: el contenido era el ya guardado
+
+    def marcar(self, doc_id, estado):
+        """Registra un cambio y programa el guardado según intervalo o tamaño"""
+        self.sucios[doc_id] = estado
+        if estado.bytes_pendientes >= self.max_bytes:
+            self._programar(doc_id, 0)
+        elif doc_id not in self.temporizadores:
+            self._programar(doc_id, self.intervalo)
+
+    def _programar(self, doc_id, demora):
+        self._cancelar(doc_id)
+        loop = asyncio.get_running_loop()
+        self.temporizadores[doc_id] = loop.call_later(demora, self._disparar, doc_id)
+
+    def _cancelar(self, doc_id):
+        temporizador = self.temporizadores.pop(doc_id, None)
+        if temporizador is not None:
+            temporizador.cancel()
+
+    def _disparar(self, doc_id):
+        self.temporizadores.pop(doc_id, None)
+        tarea = asyncio.ensure_future(self.guardar(doc_id))
+        self.tareas.add(tarea)
+        tarea.add_done_callback(self.tareas.discard)
+
+    async def guardar(self, doc_id):
+        """Escribe ya los cambios pendientes del documento, si los hay"""
+        cerrojo = self.cerrojos.setdefault(doc_id, asyncio.Lock())
+        async with cerrojo:
+            self._cancelar(doc_id)
+            estado = self.sucios.pop(doc_id, None)
+            if estado is None:
+                return True
+
+            revision, contenido, epoca = estado.revision, estado.contenido, estado.epoca
+            anterior = estado.revision_guardada
+            ops = historial.operaciones_guardado(estado, anterior, revision)
+            bytes_pendientes, estado.bytes_pendientes = estado.bytes_pendientes, 0
+            # Ediciones que se anularon entre sí: ni contenido, ni índice, ni versión
+            huella_actual = huella(contenido)
+            sin_cambios = huella_actual == estado.huella_guardada
+            if sin_cambios:
+                guardado = await save_documento_revision(doc_id, revision, epoca)
+            else:
+                guardado = await save_documento_contenido(doc_id, contenido, revision, epoca)
+
+            if guardado and sin_cambios:
+                self.escrituras += 1
+                self.sin_cambios += 1
+            elif guardado:
+                self.escrituras += 1
+                estado.huella_guardada = huella_actual
+                estado.revision_guardada = max(estado.revision_guardada, revision)
+                # La versión se registra aún con el cerrojo: el historial sigue el orden de los guardados
+                await historial.aregistrar(doc_id, contenido, revision, epoca, anterior, ops)
+            elif guardado is None:
+                # El documento se eliminó: reintentar no sirve de nada
+                self.descartar(doc_id)
+            elif doc_id not in self.sucios:
+                # Error de la base de datos (bloqueada, por ejemplo): reintentar en el próximo intervalo
+                estado.bytes_pendientes += bytes_pendientes
+                self.marcar(doc_id, estado)
+            return guardado
+
+    def descartar(self, doc_id):
+        """Abandona los cambios pendientes de un documento eliminado"""
+        self._cancelar(doc_id)
+        self.sucios.pop(doc_id, None)
+
+    def olvidar(self, doc_id):
+        """Libera el cerrojo de un documento que ya no está abierto"""
+        if doc_id not in self.sucios:
+            self.cerrojos.pop(doc_id, None)
+
+    def guardar_todo(self):
+        """Guardado final síncrono de todo lo pendiente (salida del proceso)"""
+        for doc_id, estado in list(self.sucios.items()):
+            self._cancelar(doc_id)
+            try:
+                if huella(estado.contenido) == estado.huella_guardada:
+                    escritor.ejecutar(escribir_revision, doc_id, estado.revision, estado.epoca)
+                    continue
+                escritor.ejecutar(escribir_contenido, doc_id, estado.contenido, estado.revision, estado.epoca)
+                escritor.ejecutar(
+                    historial.registrar,
+                    doc_id, estado.contenido, estado.revision, estado.epoca, estado.revision_guardada,
+                    historial.operaciones_guardado(estado, estado.revision_guardada, estado.revision),
+                )
+                estado.revision_guardada = estado.revision
+                logger.info(f"💾 Documento {doc_id} guardado al cerrar el proceso")
+            except Exception as e:
+                logger.error(f"❌ Error al guardar documento {doc_id} al cerrar: {e}", exc_info=True)
+        self.sucios.clear()
+
+
+guardado_diferido = GuardadoDiferido(
+    intervalo=getattr(settings, 'EDITOR_GUARDADO_INTERVALO', 2.0),
+    max_bytes=getattr(settings, 'EDITOR_GUARDADO_MAX_BYTES', 64 * 1024),
+)
+atexit.register(guardado_diferido.guardar_todo)
@@ -0,0 +1,63 @@
+"""
+Codificación de las tramas del socket de documentos.
+
+Los clientes que negocian el subprotocolo ``editor.msgpack`` reciben tramas
+binarias: un byte de cabecera (0 = msgpack, 1 = msgpack comprimido con zlib)
+seguido del cuerpo. El resto sigue usando JSON en tramas de texto.
+"""
+import json
+import zlib
+import msgpack
+from django.conf import settings
+
+SUBPROTOCOLO_BINARIO = 'editor.msgpack'
+
+SIN_COMPRIMIR = b'\x00'
+ZLIB = b'\x01'
+
+# Tramas binarias a partir de este tamaño se comprimen
+UMBRAL_COMPRESION = getattr(settings, 'EDITOR_UMBRAL_COMPRESION', 1024)
+
+
+def codificar_texto(mensaje):
+    return json.dumps(mensaje)
+
+
+def codificar_binario(mensaje):
+    datos = msgpack.packb(mensaje, use_bin_type=True)
+    if len(datos) >= UMBRAL_COMPRESION:
+        return ZLIB + zlib.compress(datos, 6)
+    return SIN_COMPRIMIR + datos
+
+
+class TramaDemasiadoGrande(ValueError):
+    pass
+
+
+def decodificar_binario(datos, max_bytes=0):
+    """Decodifica una trama binaria; lanza ValueError si no es válida
+
+    Con ``max_bytes`` una trama comprimida no se descomprime más allá de ese
+    tamaño (lanza ``TramaDemasiadoGrande``).
+    """
+    if not datos:
+        raise ValueError('Trama binaria vacía')
+    cuerpo = datos[1:]
+    if datos[:1] == ZLIB:
+        descompresor = zlib.decompressobj()
+        try:
+            cuerpo = descompresor.decompress(cuerpo, max_bytes)
+        except zlib.error as e:
+            raise ValueError(f'Trama comprimida inválida: {e}')
+        if descompresor.unconsumed_tail:
+            raise TramaDemasiadoGrande(f'La trama descomprimida supera {max_bytes} bytes')
+    elif datos[:1] != SIN_COMPRIMIR:
+        raise ValueError('Cabecera de trama desconocida')
+    return msgpack.unpackb(cuerpo, raw=False)
+
+
+def codificar(mensaje, binario):
+    """Devuelve los kwargs de ``send`` para el formato del cliente"""
+    if binario:
+        return {'bytes_data': codificar_binario(mensaje)}
+    return {'text_data': codificar_texto(mensaje)}
@@ -0,0 +1,144 @@
+"""
+Registro (logging) sin bloquear el event loop.
+
+``ManejadorEnCola`` es un ``QueueHandler``: al encolar resuelve el mensaje
+con sus argumentos y el texto de la excepción, como ``QueueHandler.prepare``,
+y el formato y la escritura quedan para un hilo aparte (``QueueListener``).
+Si la cola está llena el registro se descarta y se cuenta en lugar de esperar. ``FormatoJSON`` escribe
+una línea JSON por registro con los campos que se pasan en ``extra``
+(``doc_id``, ``usuario``, ``evento``). ``Muestreo`` deja pasar como mucho
+``por_segundo`` registros de cada ``evento`` por segundo, así los mensajes
+de cada edición no crecen con el tráfico.
+
+Los módulos del editor registran con argumentos (``logger.info("... %s", x)``)
+en el camino caliente: si el nivel está desactivado no se formatea nada.
+Este módulo se carga al configurar el logging, antes que las aplicaciones:
+no importa nada de Django.
+"""
+import copy
+import json
+import logging
+import os
+import queue
+from collections import Counter
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+CAMPOS = ('doc_id', 'usuario', 'evento', 'omitidos')
+
+# Registros descartados: 'cola' por cola llena y el nombre del evento por muestreo
+descartados = Counter()
+
+_FORMATO_BASE = logging.Formatter()
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro, con los campos de ``CAMPOS`` si vienen en ``extra``"""
+
+    def format(self, record):
+        datos = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'mensaje': record.getMessage(),
+        }
+        for campo in CAMPOS:
+            valor = record.__dict__.get(campo)
+            if valor is not None:
+                datos[campo] = valor
+        if record.exc_info:
+            datos['excepcion'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Ya formateada al encolarla
+            datos['excepcion'] = record.exc_text
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class ManejadorEnCola(QueueHandler):
+    """Encola los registros ya resueltos, sin darles formato; un hilo los escribe en ``stream``"""
+
+    def __init__(self, stream=None, capacidad=10000):
+        super().__init__(queue.SimpleQueue())
+        self.capacidad = capacidad
+        self.destino = logging.StreamHandler(stream)
+        self.escucha = None
+        self._iniciar()
+        # Un proceso hijo no hereda el hilo de escritura
+        os.register_at_fork(after_in_child=self._iniciar)
+
+    def _iniciar(self):
+        self.queue = queue.SimpleQueue()
+        self.escucha = QueueListener(self.queue, self.destino)
+        self.escucha.start()
+
+    def setFormatter(self, fmt):
+        # El formato se aplica en el hilo de escritura
+        super().setFormatter(fmt)
+        self.destino.setFormatter(fmt)
+
+    def prepare(self, record):
+        """
+        Como ``QueueHandler.prepare`` pero sin aplicar el formato: una copia
+        con el mensaje ya resuelto, sin ``args`` ni ``exc_info`` y con la
+        excepción en ``exc_text``. Así lo encolado no depende de objetos que
+        cambien después ni de un traceback vivo.
+        """
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = (self.formatter or _FORMATO_BASE).formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if self.queue.qsize() >= self.capacidad:
+            descartados['cola'] += 1
+            return
+        super().emit(record)
+
+    def pendientes(self):
+        return self.queue.qsize()
+
+    def close(self):
+        # Al terminar el proceso (logging.shutdown) se escribe lo que quede
+        if self.escucha is not None:
+            self.escucha.stop()
+            self.escucha = None
+        self.destino.close()
+        super().close()
+
+
+class Muestreo(logging.Filter):
+    """
+    Limita por segundo los registros de cada ``evento``; el primero que pasa
+    después de un corte lleva en ``omitidos`` cuántos se saltaron. Los
+    registros sin ``evento`` y los de WARNING o más siempre pasan.
+    """
+
+    def __init__(self, por_segundo=10):
+        super().__init__()
+        self.por_segundo = por_segundo
+        self.ventanas = {}  # evento -> [segundo, registros que pasaron, omitidos]
+
+    def filter(self, record):
+        evento = record.__dict__.get('evento')
+        if evento is None or record.levelno >= logging.WARNING:
+            return True
+
+        segundo = int(record.created)
+        ventana = self.ventanas.get(evento)
+        if ventana is None:
+            ventana = self.ventanas[evento] = [segundo, 0, 0]
+        elif ventana[0] != segundo:
+            ventana[0], ventana[1] = segundo, 0
+
+        if ventana[1] >= self.por_segundo:
+            ventana[2] += 1
+            descartados[evento] += 1
+            return False
+        ventana[1] += 1
+        if ventana[2]:
+            record.omitidos, ventana[2] = ventana[2], 0
+        return True
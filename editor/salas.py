@@ -0,0 +1,593 @@
+"""
+Documentos abiertos en este proceso ("salas") y su coordinación entre workers.
+
+Con un solo proceso cada sala es local: aquí se aplican las operaciones y
+se programa el guardado. Con varios workers (channel layer con reservas) el
+primer proceso que abre un documento lo reserva y queda como dueño; los
+demás mantienen una réplica que avanza con las difusiones del grupo y le
+reenvían las ediciones por el canal del proceso dueño.
+
+Una sala local que se queda sin conexiones se guarda y sigue en memoria
+(``salas_inactivas``): reconectar no vuelve a la base de datos ni a
+comprobar permisos ya resueltos. Mientras está inactiva el canal del proceso
+escucha el grupo del documento para enterarse de borrados y cambios de
+permisos. Si las salas superan ``EDITOR_SALAS_MEMORIA_BYTES`` se
+desalojan las inactivas, de la usada hace más tiempo a la más reciente.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from . import tickets
+from .metricas import cronometrar_bd
+from .models import Documento
+from .notificaciones import nombre_grupo, nombre_grupo_lectores
+from .operaciones import EstadoDocumento, OperacionInvalida, RevisionDesconocida, normalizar
+from .persistencia import guardado_diferido
+from .protocolo import codificar_binario, codificar_texto
+
+logger = logging.getLogger(__name__)
+
+# Segundos mínimos entre dos envíos del estado completo a los lectores
+INTERVALO_LECTORES = getattr(settings, 'EDITOR_INTERVALO_LECTORES', 1.0)
+
+# Caracteres por trama del estado completo; los documentos más grandes se
+# envían en varias tramas ('fragmentos', 'fragmento'... y 'fin_fragmentos')
+TAMANO_FRAGMENTO = getattr(settings, 'EDITOR_TAMANO_FRAGMENTO', 64 * 1024)
+
+# Bytes que pueden ocupar las salas del proceso antes de desalojar las
+# inactivas; con 0 se liberan en cuanto se quedan sin conexiones
+MEMORIA_SALAS = getattr(settings, 'EDITOR_SALAS_MEMORIA_BYTES', 64 * 1024 * 1024)
+
+
+class Sala:
+    """Un documento abierto en este proceso"""
+
+    def __init__(self, doc_id, estado, dueno=None):
+        self.doc_id = doc_id
+        self.estado = estado
+        # Canal del proceso dueño; None si el dueño es este proceso
+        self.dueno = dueno
+        self.conectados = 0
+        # Procesos con una réplica de esta sala (solo en el dueño)
+        self.replicas = set()
+        # (tipo, binario) -> (revision, trama) con el contenido completo
+        self._tramas = {}
+        # Envío programado del estado a los lectores (solo en el dueño)
+        self.lectura_programada = None
+        self.ultima_lectura = 0.0
+        # Última revisión enviada a los lectores
+        self.revision_lectores = None
+        self.tareas = set()
+        # Permisos resueltos al conectar: usuario_id -> (puede_ver, puede_editar)
+        self.permisos = {}
+        # Sin conexiones y conservada en memoria; el documento fue eliminado
+        self.inactiva = False
+        self.eliminada = False
+
+    @property
+    def es_local(self):
+        return self.dueno is None
+
+    def trama_contenido(self, tipo, binario=False):
+        """Trama con el contenido completo ('inicial' o 'update'), serializada una vez por revisión"""
+        revision, trama = self._tramas.get((tipo, binario), (None, None))
+        if revision != self.estado.revision:
+            mensaje = {'tipo': tipo, 'contenido': self.estado.contenido}
+            if tipo == 'inicial':
+                mensaje['revision'] = self.estado.revision
+                mensaje['epoca'] = self.estado.epoca
+            trama = codificar_binario(mensaje) if binario else codificar_texto(mensaje)
+            self._tramas[(tipo, binario)] = (self.estado.revision, trama)
+        return trama
+
+    def tamano(self):
+        """Bytes aproximados en memoria: el contenido y sus tramas serializadas"""
+        total = len(self.estado.contenido)
+        for _, tramas in self._tramas.values():
+            total += sum(map(len, tramas)) if isinstance(tramas, list) else len(tramas)
+        return total
+
+    def fragmentado(self):
+        return len(self.estado.contenido) > TAMANO_FRAGMENTO
+
+    def tramas_fragmentos(self, binario=False):
+        """Estado completo en tramas de hasta TAMANO_FRAGMENTO caracteres, serializadas una vez por revisión"""
+        revision, tramas = self._tramas.get(('fragmentos', binario), (None, None))
+        if revision != self.estado.revision:
+            contenido = self.estado.contenido
+            inicios = range(0, len(contenido), TAMANO_FRAGMENTO)
+            mensajes = [{
+                'tipo': 'fragmentos',
+                'revision': self.estado.revision,
+                'epoca': self.estado.epoca,
+                'total': len(inicios),
+            }]
+            mensajes.extend(
+                {'tipo': 'fragmento', 'indice': indice, 'contenido': contenido[inicio:inicio + TAMANO_FRAGMENTO]}
+                for indice, inicio in enumerate(inicios)
+            )
+            mensajes.append({'tipo': 'fin_fragmentos', 'revision': self.estado.revision})
+            codificador = codificar_binario if binario else codificar_texto
+            tramas = [codificador(mensaje) for mensaje in mensajes]
+            self._tramas[('fragmentos', binario)] = (self.estado.revision, tramas)
+        return tramas
+
+
+# doc_id -> Sala, con y sin conexiones
+salas_abiertas = {}
+
+# doc_id -> Sala sin conexiones, de la usada hace más tiempo a la más reciente
+salas_inactivas = OrderedDict()
+
+# doc_id -> veces que se invalidaron sus permisos en caché
+_generaciones_permisos = {}
+
+# Canal de este proceso para las peticiones entre workers y su tarea de escucha
+_canal_proceso = None
+_escucha = None
+
+
+@cronometrar_bd('get_documento_contenido')
+@database_sync_to_async
+def get_documento_contenido(doc_id):
+    """Devuelve (contenido, revision, epoca) guardados del documento"""
+    try:
+        contenido, revision, epoca = Documento.objects.values_list(
+            'contenido', 'revision', 'epoca'
+        ).get(id=doc_id)
+        logger.info(
+            "📄 Contenido cargado del documento %s: %d caracteres, revisión %d", doc_id, len(contenido), revision,
+            extra={'doc_id': doc_id, 'evento': 'carga'},
+        )
+        return contenido, revision, epoca
+    except Documento.DoesNotExist:
+        logger.warning(f"⚠️ Documento {doc_id} no existe")
+        return "", 0, ""
+    except Exception as e:
+        logger.error(f"❌ Error al cargar documento: {e}", exc_info=True)
+        return "", 0, ""
+
+
+def _multiproceso(channel_layer):
+    return hasattr(channel_layer, 'reservar')
+
+
+def _clave(doc_id):
+    return f'sala.{doc_id}'
+
+
+async def _canal_del_proceso(channel_layer):
+    """Canal propio del proceso; arranca la escucha la primera vez"""
+    global _canal_proceso, _escucha
+    if _canal_proceso is None:
+        canal = await channel_layer.new_channel('salas.')
+        if _canal_proceso is None:
+            _canal_proceso = canal
+            _escucha = asyncio.ensure_future(_escuchar(channel_layer, canal))
+    return _canal_proceso
+
+
+async def _abrir_como_dueno(doc_id):
+    contenido, revision, epoca = await get_documento_contenido(doc_id)
+    sala = salas_abiertas.get(doc_id)
+    if sala is None:
+        sala = salas_abiertas[doc_id] = Sala(doc_id, EstadoDocumento(contenido, revision, epoca))
+        await _ajustar_memoria()
+    return sala
+
+
+async def abrir(doc_id, responder):
+    """
+    Devuelve la sala del documento y cuenta una conexión más.
+
+    Si el dueño es otro proceso y aún no hay réplica, pide el estado y
+    devuelve None: llegará a ``responder`` como ``documento.snapshot``.
+    """
+    sala = salas_abiertas.get(doc_id)
+    if sala is None:
+        channel_layer = get_channel_layer()
+        if not _multiproceso(channel_layer):
+            sala = await _abrir_como_dueno(doc_id)
+        else:
+            canal = await _canal_del_proceso(channel_layer)
+            dueno = await channel_layer.reservar(_clave(doc_id), canal)
+            if dueno != canal:
+                await channel_layer.send(dueno, {
+                    'type': 'sala.abrir',
+                    'doc_id': doc_id,
+                    'proceso': canal,
+                    'responder': responder,
+                })
+                return None
+            sala = await _abrir_como_dueno(doc_id)
+    elif sala.inactiva:
+        await _reactivar(sala)
+
+    sala.conectados += 1
+    return sala
+
+
+def abierta(doc_id):
+    """La sala del documento está en memoria (con o sin conexiones) y no fue eliminado"""
+    sala = salas_abiertas.get(doc_id)
+    return sala is not None and not sala.eliminada
+
+
+def permisos_en_cache(doc_id, usuario_id):
+    """(puede_ver, puede_editar) ya resueltos para el usuario en la sala, o None"""
+    sala = salas_abiertas.get(doc_id)
+    if sala is None:
+        return None
+    return sala.permisos.get(usuario_id)
+
+
+def generacion_permisos(doc_id):
+    return _generaciones_permisos.get(doc_id, 0)
+
+
+def recordar_permisos(sala, usuario_id, permisos, generacion):
+    """Guarda los permisos resueltos si no se invalidaron desde ``generacion``"""
+    if generacion == generacion_permisos(sala.doc_id):
+        sala.permisos[usuario_id] = permisos
+
+
+def olvidar_permisos(doc_id, usuarios_ids):
+    """Los permisos de estos usuarios cambiaron: se resolverán de nuevo al conectar"""
+    _generaciones_permisos[doc_id] = generacion_permisos(doc_id) + 1
+    tickets.permisos_cambiados(doc_id)
+    sala = salas_abiertas.get(doc_id)
+    if sala is not None:
+        for usuario_id in usuarios_ids:
+            sala.permisos.pop(usuario_id, None)
+
+
+def marcar_eliminada(doc_id):
+    """El documento se eliminó: su sala no se conserva al quedarse sin conexiones"""
+    _generaciones_permisos.pop(doc_id, None)
+    sala = salas_abiertas.get(doc_id)
+    if sala is not None:
+        sala.eliminada = True
+        sala.permisos.clear()
+
+
+def _estado_de_snapshot(event):
+    estado = EstadoDocumento(event['contenido'], event['revision'], event['epoca'])
+    estado.revision_inicial, estado.epoca_inicial = event['inicial']
+    return estado
+
+
+def recibir_snapshot(doc_id, event):
+    """Crea o pone al día la réplica con el estado enviado por el dueño"""
+    sala = salas_abiertas.get(doc_id)
+    if sala is None:
+        sala = salas_abiertas[doc_id] = Sala(doc_id, _estado_de_snapshot(event), dueno=event['dueno'])
+    elif not sala.es_local and event['revision'] > sala.estado.revision:
+        sala.estado = _estado_de_snapshot(event)
+        sala.dueno = event['dueno']
+    return sala
+
+
+async def resincronizar(sala, responder):
+    """Pide de nuevo el estado al dueño cuando la réplica perdió operaciones"""
+    channel_layer = get_channel_layer()
+    await channel_layer.send(sala.dueno, {
+        'type': 'sala.abrir',
+        'doc_id': sala.doc_id,
+        'proceso': await _canal_del_proceso(channel_layer),
+        'responder': responder,
+    })
+
+
+async def cerrar(sala):
+    """Descuenta una conexión y libera la sala si ya nadie la usa"""
+    sala.conectados -= 1
+    await _liberar_si_vacia(sala)
+
+
+async def cancelar_apertura(doc_id):
+    """La conexión se fue antes de recibir el estado: avisar al dueño"""
+    channel_layer = get_channel_layer()
+    if doc_id in salas_abiertas or not _multiproceso(channel_layer):
+        return
+    canal = await _canal_del_proceso(channel_layer)
+    dueno = await channel_layer.reservar(_clave(doc_id), canal)
+    if dueno == canal:
+        await channel_layer.liberar(_clave(doc_id), canal)
+    else:
+        await channel_layer.send(dueno, {'type': 'sala.cerrar', 'doc_id': doc_id, 'proceso': canal})
+
+
+def _en_uso(sala):
+    return sala.conectados > 0 or sala.replicas or salas_abiertas.get(sala.doc_id) is not sala
+
+
+async def _liberar_si_vacia(sala):
+    if _en_uso(sala):
+        return
+    channel_layer = get_channel_layer()
+
+    if not sala.es_local:
+        del salas_abiertas[sala.doc_id]
+        await channel_layer.send(sala.dueno, {
+            'type': 'sala.cerrar',
+            'doc_id': sala.doc_id,
+            'proceso': _canal_proceso,
+        })
+        return
+
+    await guardado_diferido.guardar(sala.doc_id)
+    # Alguien pudo conectarse mientras se guardaba
+    if _en_uso(sala):
+        return
+    if sala.eliminada or MEMORIA_SALAS <= 0:
+        await _desalojar(sala)
+        return
+    await _conservar(sala)
+
+
+async def _conservar(sala):
+    """Deja la sala sin conexiones en memoria, escuchando los avisos de su documento"""
+    sala.inactiva = True
+    salas_inactivas[sala.doc_id] = sala
+    salas_inactivas.move_to_end(sala.doc_id)
+    channel_layer = get_channel_layer()
+    await channel_layer.group_add(nombre_grupo(sala.doc_id), await _canal_del_proceso(channel_layer))
+    await _ajustar_memoria()
+
+
+async def _reactivar(sala):
+    sala.inactiva = False
+    salas_inactivas.pop(sala.doc_id, None)
+    await get_channel_layer().group_discard(nombre_grupo(sala.doc_id), _canal_proceso)
+
+
+async def _ajustar_memoria():
+    """Desaloja salas inactivas mientras el total supere MEMORIA_SALAS"""
+    total = sum(sala.tamano() for sala in salas_abiertas.values())
+    while total > MEMORIA_SALAS and salas_inactivas:
+        _, sala = salas_inactivas.popitem(last=False)
+        total -= sala.tamano()
+        await _desalojar(sala)
+
+
+async def _desalojar(sala):
+    """Guarda lo pendiente y saca la sala del proceso"""
+    salas_inactivas.pop(sala.doc_id, None)
+    await guardado_diferido.guardar(sala.doc_id)
+    # Alguien pudo conectarse mientras se guardaba
+    if sala.conectados > 0 or sala.replicas or salas_abiertas.get(sala.doc_id) is not sala:
+        return
+    del salas_abiertas[sala.doc_id]
+    if sala.lectura_programada is not None:
+        sala.lectura_programada.cancel()
+    guardado_diferido.olvidar(sala.doc_id)
+    channel_layer = get_channel_layer()
+    if sala.inactiva:
+        sala.inactiva = False
+        await channel_layer.group_discard(nombre_grupo(sala.doc_id), _canal_proceso)
+    if _multiproceso(channel_layer):
+        await channel_layer.liberar(_clave(sala.doc_id), _canal_proceso)
+    logger.debug("   🧹 Sala del documento %s liberada", sala.doc_id, extra={'doc_id': sala.doc_id})
+
+
+async def editar(sala, origen, revision=None, ops=None, contenido=None):
+    """
+    Aplica una edición (operación o contenido completo) y la difunde.
+
+    En el dueño los errores se lanzan aquí mismo; desde una réplica se
+    reenvía la edición y un rechazo llega a ``origen`` como
+    ``documento.rechazado``.
+    """
+    channel_layer = get_channel_layer()
+    if not sala.es_local:
+        await channel_layer.send(sala.dueno, {
+            'type': 'sala.editar',
+            'doc_id': sala.doc_id,
+            'revision': revision,
+            'ops': ops,
+            'contenido': contenido,
+            'origen': origen,
+        })
+        return
+
+    estado = sala.estado
+    if ops is not None:
+        ops = estado.recibir(revision, normalizar(ops))
+    else:
+        ops = estado.reemplazar(contenido)
+
+    # El guardado en la base de datos se agrupa y se hace en diferido
+    guardado_diferido.marcar(sala.doc_id, estado)
+
+    # La trama se serializa una sola vez aquí (en ambos formatos) y cada
+    # miembro la reenvía tal cual
+    mensaje = {'tipo': 'op', 'revision': estado.revision, 'ops': ops}
+    evento = {
+        'type': 'documento_update',
+        'revision': estado.revision,
+        'ops': ops,
+        'origen': origen,
+    }
+    # Los clientes guardan la época para reanudar; solo viaja cuando cambia
+    if estado.estreno_epoca():
+        mensaje['epoca'] = evento['epoca'] = estado.epoca
+    evento['texto'] = codificar_texto(mensaje)
+    evento['binario'] = codificar_binario(mensaje)
+    await channel_layer.group_send(nombre_grupo(sala.doc_id), evento)
+    _programar_lectura(sala)
+
+
+async def restaurar(doc_id, contenido):
+    """
+    Sustituye el contenido por una versión restaurada.
+
+    Pasa siempre por la sala del dueño, abriéndola si hace falta: una sala
+    cargada con el contenido anterior no puede pisar después la
+    restauración con su guardado. Devuelve (revision, epoca) si la aplicó
+    este proceso, o None si la reenvió al proceso dueño.
+    """
+    doc_id = str(doc_id)
+    sala = salas_abiertas.get(doc_id)
+    if sala is None:
+        channel_layer = get_channel_layer()
+        if _multiproceso(channel_layer):
+            canal = await _canal_del_proceso(channel_layer)
+            dueno = await channel_layer.reservar(_clave(doc_id), canal)
+            if dueno != canal:
+                await channel_layer.send(dueno, {'type': 'sala.restaurar', 'doc_id': doc_id, 'contenido': contenido})
+                return None
+        # Abierta solo para restaurar: al cerrarla se guarda en el acto
+        sala = await _abrir_como_dueno(doc_id)
+        sala.conectados += 1
+        try:
+            return await _aplicar_restauracion(sala, contenido)
+        finally:
+            await cerrar(sala)
+    if sala.eliminada:
+        return None
+    if not sala.es_local:
+        await get_channel_layer().send(sala.dueno, {'type': 'sala.restaurar', 'doc_id': doc_id, 'contenido': contenido})
+        return None
+    return await _aplicar_restauracion(sala, contenido)
+
+
+async def _aplicar_restauracion(sala, contenido):
+    # Sin origen: todos los clientes, también quien restauró, reciben la operación
+    await editar(sala, None, contenido=contenido)
+    logger.info(f"⏪ Documento {sala.doc_id} restaurado a una versión anterior")
+    return sala.estado.revision, sala.estado.epoca
+
+
+def _programar_lectura(sala):
+    """Programa el envío del estado a los lectores, como mucho uno por intervalo"""
+    if sala.lectura_programada is not None or sala.estado.revision == sala.revision_lectores:
+        return
+    loop = asyncio.get_running_loop()
+    demora = max(0.0, sala.ultima_lectura + INTERVALO_LECTORES - loop.time())
+    sala.lectura_programada = loop.call_later(demora, _disparar_lectura, sala)
+
+
+def _disparar_lectura(sala):
+    sala.lectura_programada = None
+    sala.ultima_lectura = asyncio.get_running_loop().time()
+    tarea = asyncio.ensure_future(_difundir_lectura(sala))
+    sala.tareas.add(tarea)
+    tarea.add_done_callback(sala.tareas.discard)
+
+
+async def _difundir_lectura(sala):
+    # Sin revisión nueva desde el último envío los lectores ya tienen este estado
+    estado = sala.estado
+    if estado.revision == sala.revision_lectores:
+        return
+    sala.revision_lectores = estado.revision
+    # Con varios workers el evento lleva el estado para poner al día las réplicas
+    await get_channel_layer().group_send(nombre_grupo_lectores(sala.doc_id), {
+        'type': 'documento_lectura',
+        'dueno': _canal_proceso,
+        'contenido': estado.contenido,
+        'revision': estado.revision,
+        'epoca': estado.epoca,
+        'inicial': [estado.revision_inicial, estado.epoca_inicial],
+    })
+
+
+def avanzar(sala, event):
+    """
+    Aplica en una réplica la operación difundida por el dueño.
+
+    Devuelve False si la réplica se saltó alguna revisión.
+    """
+    estado = sala.estado
+    if sala.es_local or event['revision'] <= estado.revision:
+        return True
+    if event['revision'] != estado.revision + 1:
+        return False
+    estado.aplicar_remota(event['ops'], event.get('epoca'))
+    return True
+
+
+# Peticiones entre workers
+
+async def _escuchar(channel_layer, canal):
+    while True:
+        mensaje = await channel_layer.receive(canal)
+        try:
+            await _atender(channel_layer, canal, mensaje)
+        except Exception as e:
+            logger.error(f"❌ Error atendiendo {mensaje.get('type')}: {e}", exc_info=True)
+
+
+async def _atender(channel_layer, canal, mensaje):
+    if not mensaje['type'].startswith('sala.'):
+        await _atender_aviso(mensaje)
+        return
+
+    doc_id = mensaje['doc_id']
+    sala = salas_abiertas.get(doc_id)
+
+    if mensaje['type'] == 'sala.abrir':
+        if sala is None:
+            dueno = await channel_layer.reservar(_clave(doc_id), canal)
+            if dueno != canal:
+                await channel_layer.send(dueno, mensaje)
+                return
+            sala = await _abrir_como_dueno(doc_id)
+        elif not sala.es_local:
+            await channel_layer.send(sala.dueno, mensaje)
+            return
+        elif sala.inactiva:
+            await _reactivar(sala)
+        sala.replicas.add(mensaje['proceso'])
+        await channel_layer.send(mensaje['responder'], {
+            'type': 'documento.snapshot',
+            'dueno': canal,
+            'contenido': sala.estado.contenido,
+            'revision': sala.estado.revision,
+            'epoca': sala.estado.epoca,
+            'inicial': [sala.estado.revision_inicial, sala.estado.epoca_inicial],
+        })
+
+    elif mensaje['type'] == 'sala.cerrar':
+        if sala is not None and sala.es_local:
+            sala.replicas.discard(mensaje['proceso'])
+            await _liberar_si_vacia(sala)
+
+    elif mensaje['type'] == 'sala.restaurar':
+        # Si la sala se liberó mientras llegaba, se vuelve a reservar y abrir
+        await restaurar(doc_id, mensaje['contenido'])
+
+    elif mensaje['type'] == 'sala.editar':
+        try:
+            if sala is None or not sala.es_local:
+                raise RevisionDesconocida(f'Este proceso no es dueño del documento {doc_id}')
+            await editar(
+                sala,
+                mensaje['origen'],
+                revision=mensaje['revision'],
+                ops=mensaje['ops'],
+                contenido=mensaje['contenido'],
+            )
+        except (OperacionInvalida, RevisionDesconocida, TypeError) as e:
+            logger.warning(f"⚠️ Operación rechazada en documento {doc_id}: {e}")
+            await channel_layer.send(mensaje['origen'], {'type': 'documento.rechazado'})
+
+
+async def _atender_aviso(mensaje):
+    """Avisos de las vistas a una sala inactiva (llegan por el grupo del documento)"""
+    # Las vistas envían el id como entero; las salas usan el de la URL
+    doc_id = str(mensaje.get('doc_id'))
+    sala = salas_abiertas.get(doc_id)
+    if sala is None or not sala.inactiva:
+        # Las operaciones difundidas y los avisos que ya recibe una conexión se ignoran
+        return
+
+    if mensaje['type'] == 'documento_eliminado':
+        guardado_diferido.descartar(doc_id)
+        marcar_eliminada(doc_id)
+        await _desalojar(sala)
+    elif mensaje['type'] == 'permisos_actualizados':
+        olvidar_permisos(doc_id, mensaje['usuarios'])
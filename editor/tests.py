@@ -0,0 +1,840 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import asynccontextmanager, contextmanager
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core import signing
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from . import busqueda, campos, consumers, historial, limites, metricas, persistencia, registro, salas, tickets, views
+from .capa_canales import BrokerCanales, UnixSocketChannelLayer
+from .escritor import Escritor, escritor
+from .flujo import ControlFlujo
+from .models import Documento, PermisoDocumento, VersionDocumento
+from .notificaciones import nombre_grupo, nombre_grupo_lectores
+from .operaciones import EstadoDocumento, RevisionDesconocida, aplicar, huella, transformar
+from .persistencia import GuardadoDiferido
+from .protocolo import codificar_binario, decodificar_binario
+from .routing import websocket_urlpatterns
+
+
+@contextmanager
+def escrituras_en_linea():
+    """
+    El hilo del escritor no ve la transacción de la prueba: las escrituras
+    se hacen en el hilo de la prueba, y sin cerrar su conexión (como el
+    cliente de pruebas de Django con ``close_old_connections``).
+    """
+    async def aejecutar(funcion, *args, **kwargs):
+        return await sync_to_async(funcion)(*args, **kwargs)
+
+    with mock.patch.object(escritor, 'aejecutar', aejecutar), \
+            mock.patch.object(escritor, 'ejecutar', lambda funcion, *args, **kwargs: funcion(*args, **kwargs)), \
+            mock.patch('channels.db.close_old_connections'):
+        yield
+
+
+def _componente_al_azar(contenido, azar):
+    pos = azar.randint(0, len(contenido))
+    if pos < len(contenido) and azar.random() < 0.5:
+        return {'pos': pos, 'borrar': azar.randint(1, len(contenido) - pos)}
+    return {'pos': pos, 'insertar': azar.choice(['a', 'bc', 'xyz'])}
+
+
+def _operacion_al_azar(contenido, azar):
+    """Uno o dos componentes, cada uno sobre el texto que deja el anterior"""
+    ops = []
+    for _ in range(azar.randint(1, 2)):
+        ops.append(_componente_al_azar(contenido, azar))
+        contenido = aplicar(contenido, ops[-1:])
+    return ops
+
+
+class OperacionesTest(SimpleTestCase):
+
+    def test_transformar_converge(self):
+        azar = random.Random(7)
+        for _ in range(2000):
+            contenido = ''.join(azar.choice('abcdef') for _ in range(azar.randint(0, 8)))
+            a, b = _operacion_al_azar(contenido, azar), _operacion_al_azar(contenido, azar)
+            a2, b2 = transformar(a, b, prioridad=True)
+            self.assertEqual(aplicar(aplicar(contenido, b), a2), aplicar(aplicar(contenido, a), b2), (contenido, a, b))
+
+    def test_recibir_transforma_contra_lo_aplicado(self):
+        estado = EstadoDocumento('hola', revision=3)
+        estado.recibir(3, [{'pos': 0, 'insertar': '¡'}])
+        # Escrita sobre la revisión 3: no sabe del '¡'
+        estado.recibir(3, [{'pos': 4, 'insertar': '!'}])
+        self.assertEqual(estado.contenido, '¡hola!')
+        self.assertEqual(estado.revision, 5)
+
+    def test_revision_fuera_del_historial(self):
+        estado = EstadoDocumento('hola', revision=3)
+        with self.assertRaises(RevisionDesconocida):
+            estado.recibir(4, [{'pos': 0, 'insertar': 'x'}])
+
+    def test_reanudar_desde_la_revision_del_cliente(self):
+        estado = EstadoDocumento('hola mundo', revision=2, epoca='e0')
+        estado.recibir(2, [{'pos': 0, 'insertar': 'a'}])
+        estado.recibir(3, [{'pos': 0, 'insertar': 'b'}])
+        # Desde la revisión cargada y desde una intermedia de la época nueva
+        self.assertEqual(estado.ops_desde(2, 'e0'), [[{'pos': 0, 'insertar': 'a'}], [{'pos': 0, 'insertar': 'b'}]])
+        self.assertEqual(estado.ops_desde(3, estado.epoca), [[{'pos': 0, 'insertar': 'b'}]])
+        # Otra época: la revisión no es de esta cadena
+        self.assertIsNone(estado.ops_desde(3, 'otra'))
+
+
+class GuardadoDiferidoTest(SimpleTestCase):
+
+    def setUp(self):
+        self.guardado = GuardadoDiferido(intervalo=60, max_bytes=1024)
+        self.estado = EstadoDocumento('hola', revision=1)
+        self.estado.recibir(1, [{'pos': 4, 'insertar': '!'}])
+
+    async def _guardar(self, resultado):
+        guardar = mock.AsyncMock(return_value=resultado)
+        self.registrar = mock.AsyncMock()
+        with mock.patch.object(persistencia, 'save_documento_contenido', guardar), \
+                mock.patch.object(historial, 'aregistrar', self.registrar):
+            self.guardado.marcar('1', self.estado)
+            self.guardado.marcar('1', self.estado)
+            await self.guardado.guardar('1')
+        return guardar
+
+    async def test_agrupa_los_cambios_en_una_escritura(self):
+        guardar = await self._guardar(True)
+        guardar.assert_awaited_once_with('1', 'hola!', 2, self.estado.epoca)
+        # Una versión por guardado, con las operaciones desde el anterior
+        self.registrar.assert_awaited_once_with(
+            '1', 'hola!', 2, self.estado.epoca, 1, [{'pos': 4, 'insertar': '!'}],
+        )
+        self.assertNotIn('1', self.guardado.sucios)
+        self.assertEqual(self.estado.revision_guardada, 2)
+
+    async def test_error_de_la_base_de_datos_se_reintenta(self):
+        await self._guardar(False)
+        self.assertIs(self.guardado.sucios['1'], self.estado)
+        self.assertIn('1', self.guardado.temporizadores)
+        self.assertEqual(self.estado.bytes_pendientes, 1)
+        self.guardado.descartar('1')
+
+    async def test_documento_eliminado_se_descarta(self):
+        await self._guardar(None)
+        self.registrar.assert_not_awaited()
+        self.assertNotIn('1', self.guardado.sucios)
+        self.assertNotIn('1', self.guardado.temporizadores)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class SocketsTest(TestCase):
+    """Sockets de documentos con el channel layer en memoria"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.propietario = User.objects.create_user('propietario', password='x')
+        cls.invitado = User.objects.create_user('invitado', password='x')
+        cls.doc = Documento.objects.create(titulo='Doc', contenido='hola', propietario=cls.propietario)
+        PermisoDocumento.objects.create(
+            documento=cls.doc, usuario=cls.invitado, puede_editar=True, compartido_por=cls.propietario,
+        )
+
+    def setUp(self):
+        self.enterContext(escrituras_en_linea())
+        # Al desconectar la última conexión la sala se guarda y se libera
+        self.enterContext(mock.patch.object(salas, 'MEMORIA_SALAS', 0))
+
+    async def conectar(self, usuario):
+        comunicador = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/documento/{self.doc.id}/?protocolo=ops'
+        )
+        comunicador.scope['user'] = usuario
+        conectado, _ = await comunicador.connect()
+        self.assertTrue(conectado)
+        inicial = await self.recibir(comunicador, 'inicial')
+        # Tras el estado, el ticket para reconectar
+        await self.recibir(comunicador, 'ticket')
+        return comunicador, inicial
+
+    async def recibir(self, comunicador, tipo):
+        """Siguiente mensaje de ``tipo``, saltando los demás"""
+        while True:
+            mensaje = json.loads(await comunicador.receive_from())
+            if mensaje['tipo'] == tipo:
+                return mensaje
+
+    async def editar(self, comunicador, revision, texto='x'):
+        await comunicador.send_to(text_data=json.dumps({
+            'tipo': 'op', 'revision': revision, 'ops': [{'pos': 0, 'insertar': texto}],
+        }))
+
+    async def test_edicion_tras_eliminar_no_se_guarda(self):
+        comunicador, inicial = await self.conectar(self.propietario)
+        await get_channel_layer().group_send(nombre_grupo(self.doc.id), {'type': 'documento_eliminado'})
+        self.assertEqual((await self.recibir(comunicador, 'error'))['mensaje'], 'El documento fue eliminado')
+        self.assertEqual((await comunicador.receive_output())['type'], 'websocket.close')
+        # Una edición que ya estaba en camino: ni se aplica ni se confirma
+        await self.editar(comunicador, inicial['revision'])
+        self.assertTrue(await comunicador.receive_nothing())
+        self.assertNotIn(str(self.doc.id), persistencia.guardado_diferido.sucios)
+        self.assertEqual(salas.salas_abiertas[str(self.doc.id)].estado.contenido, 'hola')
+        await comunicador.disconnect()
+
+    async def test_difusion_una_serializacion_y_sin_eco(self):
+        autor, inicial = await self.conectar(self.propietario)
+        otros = [(await self.conectar(self.invitado))[0] for _ in range(2)]
+        with mock.patch.object(salas, 'codificar_texto', wraps=salas.codificar_texto) as codificar:
+            await self.editar(autor, inicial['revision'])
+            ack = await self.recibir(autor, 'ack')
+            ops = [await self.recibir(otro, 'op') for otro in otros]
+        # Una sola serialización para todos los miembros
+        self.assertEqual(codificar.call_count, 1)
+        self.assertEqual(ack['revision'], inicial['revision'] + 1)
+        self.assertEqual([op['ops'] for op in ops], [[{'pos': 0, 'insertar': 'x'}]] * 2)
+        # El autor solo recibe la confirmación
+        self.assertTrue(await autor.receive_nothing())
+        for comunicador in [autor, *otros]:
+            await comunicador.disconnect()
+
+    async def test_restaurar_con_la_sala_abierta(self):
+        comunicador, inicial = await self.conectar(self.invitado)
+        revision, epoca = await salas.restaurar(self.doc.id, 'versión vieja')
+        # Una edición más de la sala, que reciben todos sus clientes
+        self.assertEqual(revision, inicial['revision'] + 1)
+        self.assertEqual((await self.recibir(comunicador, 'op'))['revision'], revision)
+        self.assertEqual(salas.salas_abiertas[str(self.doc.id)].estado.contenido, 'versión vieja')
+        await comunicador.disconnect()
+
+    async def test_trama_grande_medida_en_bytes(self):
+        comunicador, inicial = await self.conectar(self.propietario)
+        # 6 caracteres, 12 bytes en UTF-8
+        with mock.patch.object(limites, 'MENSAJE_MAX_BYTES', 10):
+            await comunicador.send_to(text_data='ññññññ')
+            self.assertEqual((await self.recibir(comunicador, 'error'))['codigo'], 'tamano')
+            self.assertEqual((await comunicador.receive_output())['code'], 1009)
+        await comunicador.disconnect()
+
+    async def test_reconectar_a_una_sala_inactiva_no_consulta(self):
+        with mock.patch.object(salas, 'MEMORIA_SALAS', 1024 * 1024):
+            comunicador, _ = await self.conectar(self.invitado)
+            await comunicador.disconnect()
+            self.assertIn(str(self.doc.id), salas.salas_inactivas)
+            with mock.patch.object(salas, 'get_documento_contenido') as cargar, \
+                    mock.patch.object(consumers.DocumentoConsumer, 'verificar_permisos') as verificar:
+                comunicador, inicial = await self.conectar(self.invitado)
+            cargar.assert_not_called()
+            verificar.assert_not_called()
+            self.assertEqual(inicial['contenido'], 'hola')
+            await comunicador.disconnect()
+        await salas._ajustar_memoria()
+        self.assertNotIn(str(self.doc.id), salas.salas_abiertas)
+
+    async def test_contenido_igual_no_se_difunde(self):
+        autor, inicial = await self.conectar(self.propietario)
+        otro, _ = await self.conectar(self.invitado)
+        await autor.send_to(text_data=json.dumps({'contenido': 'hola'}))
+        self.assertTrue(await otro.receive_nothing())
+        sala = salas.salas_abiertas[str(self.doc.id)]
+        self.assertEqual(sala.estado.revision, inicial['revision'])
+        self.assertNotIn(str(self.doc.id), persistencia.guardado_diferido.sucios)
+        for comunicador in (autor, otro):
+            await comunicador.disconnect()
+
+    async def test_ticket_con_la_sala_abierta(self):
+        propietario, _ = await self.conectar(self.propietario)
+        ticket = tickets.emitir(self.invitado, self.doc.id, True)
+        comunicador = WebsocketCommunicator(
+            tickets.MiddlewareTicket(URLRouter(websocket_urlpatterns)),
+            f'/ws/documento/{self.doc.id}/?protocolo=ops&ticket={ticket}',
+        )
+        # Ni sesión ni consulta de permisos: usuario y permisos salen del ticket
+        with mock.patch.object(consumers.DocumentoConsumer, 'verificar_permisos') as verificar:
+            conectado, _ = await comunicador.connect()
+            self.assertTrue(conectado)
+            await self.recibir(comunicador, 'inicial')
+            nuevo = await self.recibir(comunicador, 'ticket')
+        verificar.assert_not_called()
+        self.assertEqual(tickets.verificar(nuevo['ticket'])['u'], self.invitado.id)
+        for socket in (comunicador, propietario):
+            await socket.disconnect()
+
+    async def test_estado_grande_en_fragmentos(self):
+        comunicador = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/documento/{self.doc.id}/?protocolo=ops'
+        )
+        comunicador.scope['user'] = self.propietario
+        with mock.patch.object(salas, 'TAMANO_FRAGMENTO', 3):
+            conectado, _ = await comunicador.connect()
+            self.assertTrue(conectado)
+            inicio = await self.recibir(comunicador, 'fragmentos')
+            fragmentos = []
+            while len(fragmentos) < inicio['total'] + 1:
+                mensaje = json.loads(await comunicador.receive_from())
+                if mensaje['tipo'] != 'ticket':
+                    fragmentos.append(mensaje)
+        self.assertEqual(inicio['total'], 2)
+        self.assertEqual(''.join(mensaje['contenido'] for mensaje in fragmentos[:-1]), 'hola')
+        self.assertEqual(fragmentos[-1], {'tipo': 'fin_fragmentos', 'revision': inicio['revision']})
+        await comunicador.disconnect()
+
+    def test_lecturas_cierran_conexiones_viejas(self):
+        consumidor = consumers.DocumentoConsumer()
+        consumidor.doc_id = str(self.doc.id)
+        ajeno = User.objects.create_user('ajeno', password='x')
+        with mock.patch('channels.db.close_old_connections') as cerrar:
+            for usuario, esperado in [(self.propietario, (True, True)), (self.invitado, (True, True)), (ajeno, (False, False))]:
+                consumidor.scope = {'user': usuario}
+                self.assertEqual(async_to_sync(consumidor.verificar_permisos)(), esperado)
+            self.assertEqual(async_to_sync(salas.get_documento_contenido)(self.doc.id), ('hola', 0, ''))
+        # database_sync_to_async, antes y después de cada lectura
+        self.assertEqual(cerrar.call_count, 8)
+
+
+@asynccontextmanager
+async def capas_con_broker(procesos=2):
+    """Un broker en un socket temporal y una capa por proceso simulado"""
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, 'broker.sock')
+        servidor = asyncio.ensure_future(BrokerCanales(ruta).servir())
+        while not os.path.exists(ruta):
+            await asyncio.sleep(0.01)
+        capas = [UnixSocketChannelLayer(ruta) for _ in range(procesos)]
+        try:
+            async with asyncio.timeout(5):
+                yield capas
+        finally:
+            for capa in capas:
+                await capa.close()
+            # Que el broker vea los cierres antes de cancelarlo
+            await asyncio.sleep(0.05)
+            servidor.cancel()
+
+
+class BrokerCanalesTest(SimpleTestCase):
+
+    async def test_reservar_y_liberar(self):
+        async with capas_con_broker() as (uno, dos):
+            canal_uno, canal_dos = await uno.new_channel('salas.'), await dos.new_channel('salas.')
+            self.assertEqual(await uno.reservar('sala.1', canal_uno), canal_uno)
+            # Ya reservada: se devuelve el dueño
+            self.assertEqual(await dos.reservar('sala.1', canal_dos), canal_uno)
+            # Solo el dueño la libera
+            await dos.liberar('sala.1', canal_dos)
+            self.assertEqual(await dos.reservar('sala.1', canal_dos), canal_uno)
+            await uno.liberar('sala.1', canal_uno)
+            self.assertEqual(await dos.reservar('sala.1', canal_dos), canal_dos)
+
+    async def test_group_send_llega_a_cada_miembro(self):
+        async with capas_con_broker() as (uno, dos):
+            miembros = [(uno, await uno.new_channel()), (uno, await uno.new_channel()), (dos, await dos.new_channel())]
+            for capa, canal in miembros:
+                await capa.group_add('documento_1', canal)
+            await dos.group_send('documento_1', {'type': 'documento_update', 'revision': 1})
+            for capa, canal in miembros:
+                self.assertEqual((await capa.receive(canal))['revision'], 1)
+
+            await uno.group_discard('documento_1', miembros[0][1])
+            await dos.group_send('documento_1', {'type': 'documento_update', 'revision': 2})
+            self.assertEqual((await uno.receive(miembros[1][1]))['revision'], 2)
+            self.assertEqual(uno.mensajes_en_cola(), 0)
+
+    async def test_send_entre_procesos(self):
+        async with capas_con_broker() as (uno, dos):
+            canal = await dos.new_channel()
+            await uno.send(canal, {'type': 'sala.abrir', 'doc_id': '1'})
+            self.assertEqual(await dos.receive(canal), {'type': 'sala.abrir', 'doc_id': '1'})
+
+
+class ProtocoloTest(SimpleTestCase):
+
+    def test_binario_ida_y_vuelta(self):
+        mensaje = {'tipo': 'op', 'revision': 3, 'ops': [{'pos': 0, 'insertar': 'ñ' * 2000}]}
+        trama = codificar_binario(mensaje)
+        # Comprimida: el texto repetido ocupa mucho menos
+        self.assertLess(len(trama), 1000)
+        self.assertEqual(decodificar_binario(trama), mensaje)
+
+
+class ControlFlujoTest(SimpleTestCase):
+
+    def test_satura_hasta_que_el_cliente_confirma(self):
+        flujo = ControlFlujo(max_bytes=100, espera_max=30)
+        # Sin confirmaciones (clientes antiguos) nunca se satura
+        flujo.enviada(500)
+        self.assertFalse(flujo.saturado())
+        flujo.confirmar(1)
+        flujo.enviada(60)
+        flujo.enviada(60)
+        self.assertTrue(flujo.saturado())
+        flujo.confirmar(2)
+        self.assertFalse(flujo.saturado())
+        self.assertEqual(flujo.bytes, 60)
+
+    def test_estancado_tras_la_espera_maxima(self):
+        flujo = ControlFlujo(max_bytes=10, espera_max=30)
+        flujo.confirmar(0)
+        flujo.enviada(20)
+        self.assertFalse(flujo.estancado())
+        with mock.patch('editor.flujo.time.monotonic', return_value=time.monotonic() + 31):
+            self.assertTrue(flujo.estancado())
+
+
+class LectoresTest(SimpleTestCase):
+
+    async def test_estado_solo_con_revision_nueva(self):
+        sala = salas.Sala('1', EstadoDocumento('hola', revision=1))
+        capa = mock.Mock(group_send=mock.AsyncMock())
+        with mock.patch.object(salas, 'get_channel_layer', return_value=capa):
+            await salas._difundir_lectura(sala)
+            await salas._difundir_lectura(sala)
+            sala.estado.recibir(1, [{'pos': 0, 'insertar': 'x'}])
+            await salas._difundir_lectura(sala)
+        self.assertEqual([llamada.args[1]['revision'] for llamada in capa.group_send.await_args_list], [1, 2])
+        self.assertEqual(capa.group_send.await_args.args[0], nombre_grupo_lectores('1'))
+
+    async def test_sin_revision_nueva_no_se_programa(self):
+        sala = salas.Sala('1', EstadoDocumento('hola', revision=1))
+        sala.revision_lectores = 1
+        salas._programar_lectura(sala)
+        self.assertIsNone(sala.lectura_programada)
+
+
+class MetricasTest(SimpleTestCase):
+
+    def test_exponer(self):
+        texto = metricas.exponer()
+        self.assertIn('editor_sockets_abiertos', texto)
+        self.assertIn('# TYPE editor_bd_segundos histogram', texto)
+
+    def test_token(self):
+        with mock.patch.object(metricas, 'TOKEN', 'secreto'):
+            self.assertTrue(metricas._autorizado({'headers': [(b'authorization', b'Bearer secreto')]}))
+            self.assertFalse(metricas._autorizado({'headers': [(b'authorization', b'Bearer otro')]}))
+        with mock.patch.object(metricas, 'TOKEN', ''):
+            aplicacion = object()
+            # Sin token no hay ruta de métricas
+            self.assertIs(metricas.con_metricas(aplicacion), aplicacion)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class DashboardTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('usuario', password='x')
+        for i in range(5):
+            Documento.objects.create(titulo=f'Doc {i}', contenido='hola ' * 200, propietario=cls.usuario)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def test_paginas_por_cursor(self):
+        vistos = []
+        pagina = reverse('dashboard')
+        with mock.patch.object(views, 'DOCUMENTOS_POR_PAGINA', 2):
+            while pagina:
+                respuesta = self.client.get(pagina)
+                vistos += [doc.titulo for doc in respuesta.context['documentos_propios']]
+                siguiente = respuesta.context['siguiente_propios']
+                pagina = siguiente and reverse('dashboard') + siguiente
+        self.assertEqual(vistos, [f'Doc {i}' for i in reversed(range(5))])
+
+    def test_tarjetas_sin_contenido(self):
+        doc = self.client.get(reverse('dashboard')).context['documentos_propios'][0]
+        self.assertIn('contenido', doc.get_deferred_fields())
+        self.assertEqual(doc.tamano, len('hola ' * 200))
+        self.assertTrue(doc.vista_previa.startswith('hola hola'))
+
+    def test_paginas_conservan_la_otra_lista(self):
+        with mock.patch.object(views, 'DOCUMENTOS_POR_PAGINA', 2):
+            respuesta = self.client.get(reverse('dashboard'), {'compartidos': 'x'})
+        self.assertTrue(respuesta.context['siguiente_propios'].startswith('?compartidos=x&propios='))
+
+
+class BusquedaTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('usuario', password='x')
+        cls.receta = Documento.objects.create(titulo='Receta', contenido='pan con tomate', propietario=cls.usuario)
+        Documento.objects.create(titulo='Notas', contenido='nada que ver', propietario=cls.usuario)
+
+    def test_buscar_en_el_contenido(self):
+        if not busqueda.disponible():
+            self.skipTest('SQLite sin FTS5')
+        self.assertEqual([doc.id for doc in busqueda.buscar(self.usuario, 'tomate')], [self.receta.id])
+        self.assertEqual(list(busqueda.filtrar(Documento.objects.all(), 'tomate')), [self.receta])
+
+    def test_guardado_diferido_reindexa(self):
+        if not busqueda.disponible():
+            self.skipTest('SQLite sin FTS5')
+        persistencia.escribir_contenido(self.receta.id, 'sopa de ajo', 1, '')
+        self.assertEqual([doc.id for doc in busqueda.buscar(self.usuario, 'ajo')], [self.receta.id])
+        self.assertEqual(busqueda.buscar(self.usuario, 'tomate'), [])
+
+    def test_sin_fts5(self):
+        with mock.patch.object(busqueda, 'disponible', return_value=False):
+            # filtrar no sabe buscar sin el índice: quien lo llama usa icontains
+            self.assertIsNone(busqueda.filtrar(Documento.objects.all(), 'tomate'))
+            self.assertEqual([doc.id for doc in busqueda.buscar(self.usuario, 'receta')], [self.receta.id])
+
+    def test_consulta_vacia(self):
+        self.assertIsNone(busqueda.filtrar(Documento.objects.all(), ' "*" '))
+        self.assertEqual(busqueda.buscar(self.usuario, ''), [])
+
+
+class FragmentosTest(SimpleTestCase):
+
+    def test_tramas_del_estado_completo(self):
+        with mock.patch.object(salas, 'TAMANO_FRAGMENTO', 4):
+            sala = salas.Sala('1', EstadoDocumento('abcdefghij', revision=7, epoca='e'))
+            self.assertTrue(sala.fragmentado())
+            mensajes = [json.loads(trama) for trama in sala.tramas_fragmentos()]
+            # Serializadas una vez por revisión
+            self.assertIs(sala.tramas_fragmentos(), sala.tramas_fragmentos())
+        self.assertEqual(mensajes[0], {'tipo': 'fragmentos', 'revision': 7, 'epoca': 'e', 'total': 3})
+        self.assertEqual(''.join(mensaje['contenido'] for mensaje in mensajes[1:-1]), 'abcdefghij')
+        self.assertEqual(mensajes[-1], {'tipo': 'fin_fragmentos', 'revision': 7})
+
+
+class TextoComprimidoTest(SimpleTestCase):
+
+    def setUp(self):
+        self.campo = Documento._meta.get_field('contenido')
+
+    def test_ida_y_vuelta_comprimido(self):
+        texto = 'ñandú ' * 500
+        with mock.patch.object(campos, 'COMPRIMIR', True):
+            guardado = self.campo.get_prep_value(texto)
+        self.assertEqual(guardado[0], campos.ZLIB)
+        self.assertLess(len(guardado), len(texto))
+        self.assertEqual(self.campo.from_db_value(guardado, None, None), texto)
+
+    def test_corto_sin_comprimir(self):
+        with mock.patch.object(campos, 'COMPRIMIR', True):
+            guardado = self.campo.get_prep_value('hola')
+        self.assertEqual(guardado, bytes([campos.SIN_COMPRIMIR]) + b'hola')
+        self.assertEqual(self.campo.to_python(guardado), 'hola')
+
+    def test_desactivado_es_texto(self):
+        with mock.patch.object(campos, 'COMPRIMIR', False):
+            self.assertEqual(self.campo.get_prep_value('hola ' * 500), 'hola ' * 500)
+            self.assertEqual(self.campo.get_internal_type(), 'TextField')
+        # Lo comprimido antes se sigue leyendo
+        self.assertEqual(self.campo.from_db_value(bytes([campos.ZLIB]) + zlib.compress(b'hola'), None, None), 'hola')
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class HistorialTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('usuario', password='x')
+        cls.doc = Documento.objects.create(titulo='Doc', contenido='a', propietario=cls.usuario)
+
+    def test_versiones_con_diferencias(self):
+        contenido = 'a'
+        with mock.patch.object(historial, 'DISTANCIA', 3):
+            for revision in range(1, 6):
+                ops = [{'pos': len(contenido), 'insertar': str(revision)}]
+                contenido = aplicar(contenido, ops)
+                historial.registrar(self.doc.id, contenido, revision, 'e', revision - 1, ops)
+        versiones = list(VersionDocumento.objects.filter(documento=self.doc).order_by('id'))
+        self.assertEqual([version.distancia for version in versiones], [0, 1, 2, 0, 1, 2])
+        self.assertEqual(
+            [historial.contenido_version(version) for version in versiones],
+            ['a', 'a1', 'a12', 'a123', 'a1234', 'a12345'],
+        )
+
+    def test_restaurar(self):
+        version = VersionDocumento.objects.get(documento=self.doc)
+        Documento.objects.filter(pk=self.doc.pk).update(contenido='otro texto', revision=1)
+        self.client.force_login(self.usuario)
+        with escrituras_en_linea(), mock.patch.object(salas, 'MEMORIA_SALAS', 0):
+            respuesta = self.client.post(
+                reverse('restaurar_version', args=[self.doc.id, version.id]), HTTP_ACCEPT='application/json',
+            )
+        # La sala abierta para restaurar aplica, guarda y se libera
+        self.assertEqual(respuesta.json()['revision'], 2)
+        self.assertEqual(Documento.objects.get(pk=self.doc.pk).contenido, 'a')
+        self.assertEqual(VersionDocumento.objects.filter(documento=self.doc).count(), 2)
+        self.assertNotIn(str(self.doc.id), salas.salas_abiertas)
+
+
+class LimitesTest(SimpleTestCase):
+
+    def test_cubeta_de_fichas(self):
+        limitador = limites.Limitador(ritmo=10, rafaga=20)
+        limitador.consumir('u', 20, ahora=100.0)
+        self.assertAlmostEqual(limitador.espera('u', 5, ahora=100.0), 0.5)
+        # Medio segundo después se recargaron 5 fichas
+        self.assertEqual(limitador.espera('u', 5, ahora=100.5), 0.0)
+
+    def test_admitir_edicion(self):
+        with mock.patch.object(limites, 'por_usuario', limites.Limitador(1, 2)), \
+                mock.patch.object(limites, 'por_documento', limites.Limitador(100, 200)):
+            self.assertEqual(limites.admitir_edicion(1, '1', 10), 0.0)
+            self.assertEqual(limites.admitir_edicion(1, '1', 10), 0.0)
+            self.assertGreater(limites.admitir_edicion(1, '1', 10), 0.0)
+            # Otro usuario en el mismo documento no se ve afectado
+            self.assertEqual(limites.admitir_edicion(2, '1', 10), 0.0)
+
+    def test_costo_por_tamano(self):
+        self.assertEqual(limites.costo(0), 1)
+        self.assertEqual(limites.costo(limites.BYTES_POR_FICHA * 3), 4)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ConsultasVistasTest(TestCase):
+    """Consultas a la base de datos de cada vista; las dos primeras son la sesión y el usuario"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.propietario = User.objects.create_user('propietario', password='x')
+        cls.lector = User.objects.create_user('lector', password='x')
+        User.objects.create_user('Lucia', password='x')
+        cls.doc = Documento.objects.create(titulo='Propio', contenido='hola mundo', propietario=cls.propietario)
+        cls.ajeno = Documento.objects.create(titulo='Ajeno', contenido='otro', propietario=cls.lector)
+        cls.permiso = PermisoDocumento.objects.create(
+            documento=cls.doc, usuario=cls.lector, compartido_por=cls.propietario,
+        )
+        PermisoDocumento.objects.create(documento=cls.ajeno, usuario=cls.propietario, compartido_por=cls.lector)
+
+    def setUp(self):
+        self.client.force_login(self.propietario)
+
+    def test_dashboard(self):
+        with self.assertNumQueries(5):
+            respuesta = self.client.get(reverse('dashboard'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.context['total_propios'], 1)
+        self.assertEqual(respuesta.context['total_compartidos'], 1)
+
+    def test_dashboard_sin_cambios_no_carga_las_listas(self):
+        etag = self.client.get(reverse('dashboard'))['ETag']
+        with self.assertNumQueries(3):
+            respuesta = self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+
+    def test_dashboard_cambia_etag_con_el_permiso(self):
+        etag = self.client.get(reverse('dashboard'))['ETag']
+        PermisoDocumento.objects.filter(documento=self.ajeno).update(puede_editar=True)
+        respuesta = self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+
+    def test_documento_sin_cambios(self):
+        etag = self.client.get(reverse('documento', args=[self.doc.id]))['ETag']
+        respuesta = self.client.get(reverse('documento', args=[self.doc.id]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+
+    def test_dashboard_paginas_conservan_busqueda(self):
+        for i in range(3):
+            Documento.objects.create(titulo=f'Extra {i}', contenido='', propietario=self.propietario)
+        with mock.patch.object(views, 'DOCUMENTOS_POR_PAGINA', 2):
+            respuesta = self.client.get(reverse('dashboard'), {'q': 'hola'})
+        self.assertTrue(respuesta.context['siguiente_propios'].startswith('?q=hola&propios='))
+
+    def test_documento(self):
+        with self.assertNumQueries(4):
+            respuesta = self.client.get(reverse('documento', args=[self.doc.id]))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.context['es_propietario'])
+
+    def test_compartir_get(self):
+        with self.assertNumQueries(4):
+            respuesta = self.client.get(reverse('compartir_documento', args=[self.doc.id]))
+        self.assertEqual(respuesta.status_code, 200)
+
+    def test_compartir_post(self):
+        with self.assertNumQueries(9):
+            respuesta = self.client.post(
+                reverse('compartir_documento', args=[self.doc.id]),
+                {'usernames': ['lector', 'Lucia', 'nadie'], 'puede_editar': 'on'},
+            )
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertEqual(
+            set(PermisoDocumento.objects.filter(documento=self.doc, puede_editar=True).values_list('usuario__username', flat=True)),
+            {'lector', 'Lucia'},
+        )
+
+    def test_buscar_usuarios(self):
+        with self.assertNumQueries(3):
+            respuesta = self.client.get(reverse('buscar_usuarios'), {'q': 'LU'})
+        self.assertEqual(respuesta.json(), {'usuarios': ['Lucia'], 'siguiente': None})
+
+    def test_buscar_usuarios_por_paginas(self):
+        User.objects.create_user('lucia', password='x')
+        User.objects.create_user('LUCAS', password='x')
+        vistos, despues = [], ''
+        with mock.patch.object(views, 'USUARIOS_POR_PAGINA', 1):
+            while despues is not None:
+                pagina = self.client.get(reverse('buscar_usuarios'), {'q': 'luc', 'despues': despues}).json()
+                vistos += pagina['usuarios']
+                despues = pagina['siguiente']
+        # Los nombres que solo difieren en mayúsculas ni se saltan ni se repiten
+        self.assertEqual(vistos, ['LUCAS', 'Lucia', 'lucia'])
+
+    def test_eliminar_permiso(self):
+        with self.assertNumQueries(5):
+            respuesta = self.client.post(reverse('eliminar_permiso', args=[self.doc.id, self.permiso.id]))
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertFalse(PermisoDocumento.objects.filter(pk=self.permiso.pk).exists())
+
+    def test_eliminar_documento(self):
+        historial.registrar(self.doc.id, 'hola mundo', 1, 'e')
+        with self.assertNumQueries(7):
+            respuesta = self.client.post(reverse('eliminar_documento', args=[self.doc.id]))
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertFalse(Documento.objects.filter(pk=self.doc.pk).exists())
+
+    def test_historial(self):
+        historial.registrar(self.doc.id, 'hola mundo', 1, 'e')
+        version = VersionDocumento.objects.filter(documento=self.doc).latest('id')
+        with self.assertNumQueries(5):
+            respuesta = self.client.get(reverse('historial_documento', args=[self.doc.id]), {'version': version.id})
+        self.assertEqual(respuesta.context['contenido'], 'hola mundo')
+
+    def test_restaurar_sin_sala_abierta(self):
+        historial.registrar(self.doc.id, 'hola', 1, 'e')
+        version = VersionDocumento.objects.filter(documento=self.doc).latest('id')
+        versiones = VersionDocumento.objects.filter(documento=self.doc).count()
+        with escrituras_en_linea(), mock.patch.object(salas, 'MEMORIA_SALAS', 0):
+            self.client.post(reverse('restaurar_version', args=[self.doc.id, version.id]))
+        # Una sola versión nueva y la revisión siguiente en el documento
+        self.assertEqual(VersionDocumento.objects.filter(documento=self.doc).count(), versiones + 1)
+        self.assertEqual(Documento.objects.get(pk=self.doc.pk).revision, self.doc.revision + 1)
+
+
+class EscritorTest(TransactionTestCase):
+    """El hilo del escritor tiene su propia conexión: sin la transacción de TestCase que lo bloquee"""
+
+    def test_un_error_no_arrastra_al_lote(self):
+        escritor_prueba = Escritor(lote=8)
+
+        def fallar():
+            raise ValueError('falla')
+
+        futuros = [escritor_prueba.enviar(lambda i=i: i) for i in range(3)]
+        futuros.insert(1, escritor_prueba.enviar(fallar))
+        self.assertEqual([futuros[i].result(timeout=5) for i in (0, 2, 3)], [0, 1, 2])
+        with self.assertRaises(ValueError):
+            futuros[1].result(timeout=5)
+        self.assertEqual(escritor_prueba.errores, 1)
+
+
+class SalasInactivasTest(SimpleTestCase):
+
+    def tearDown(self):
+        salas.salas_abiertas.clear()
+        salas.salas_inactivas.clear()
+
+    async def test_desaloja_las_usadas_hace_mas_tiempo(self):
+        for doc_id in ('1', '2', '3'):
+            sala = salas.salas_abiertas[doc_id] = salas.Sala(doc_id, EstadoDocumento('x' * 100))
+            await salas._conservar(sala)
+        # La sala 1 se reactiva y vuelve a quedar inactiva: pasa a ser la más reciente
+        await salas._reactivar(salas.salas_abiertas['1'])
+        await salas._conservar(salas.salas_abiertas['1'])
+        with mock.patch.object(salas, 'MEMORIA_SALAS', 250):
+            await salas._ajustar_memoria()
+        self.assertEqual(list(salas.salas_inactivas), ['3', '1'])
+        self.assertNotIn('2', salas.salas_abiertas)
+
+
+class SinCambiosTest(SimpleTestCase):
+
+    async def test_ediciones_que_se_anulan_solo_guardan_la_revision(self):
+        guardado = GuardadoDiferido(intervalo=60, max_bytes=1024)
+        estado = EstadoDocumento('hola', revision=1)
+        estado.recibir(1, [{'pos': 4, 'insertar': '!'}])
+        estado.recibir(2, [{'pos': 4, 'borrar': 1}])
+        self.assertEqual(huella(estado.contenido), estado.huella_guardada)
+        contenido = mock.AsyncMock(return_value=True)
+        revision = mock.AsyncMock(return_value=True)
+        with mock.patch.object(persistencia, 'save_documento_contenido', contenido), \
+                mock.patch.object(persistencia, 'save_documento_revision', revision):
+            guardado.marcar('1', estado)
+            await guardado.guardar('1')
+        contenido.assert_not_awaited()
+        revision.assert_awaited_once_with('1', 3, estado.epoca)
+        self.assertEqual(guardado.sin_cambios, 1)
+
+
+class RegistroTest(SimpleTestCase):
+
+    def _manejador(self, capacidad):
+        # Sin el hilo de escritura: lo encolado se queda en la cola
+        manejador = registro.ManejadorEnCola(capacidad=capacidad)
+        manejador.escucha.stop()
+        manejador.escucha = None
+        self.addCleanup(manejador.close)
+        return manejador
+
+    def test_encola_el_mensaje_resuelto(self):
+        manejador = self._manejador(10)
+        lista = ['a']
+        try:
+            raise ValueError('falla')
+        except ValueError:
+            manejador.handle(logging.LogRecord('editor', logging.ERROR, __file__, 1, 'lista %s', (lista,), sys.exc_info()))
+        lista.append('b')
+        encolado = manejador.queue.get_nowait()
+        # Lo que se escribe es lo que había al registrar, sin el traceback vivo
+        self.assertEqual(encolado.getMessage(), "lista ['a']")
+        self.assertIsNone(encolado.exc_info)
+        self.assertIn('ValueError: falla', encolado.exc_text)
+        self.assertIn('ValueError: falla', json.loads(registro.FormatoJSON().format(encolado))['excepcion'])
+
+    def test_cola_llena_descarta(self):
+        manejador = self._manejador(1)
+        descartados = registro.descartados['cola']
+        for _ in range(3):
+            manejador.handle(logging.LogRecord('editor', logging.INFO, __file__, 1, 'x', None, None))
+        self.assertEqual(registro.descartados['cola'] - descartados, 2)
+
+    def test_muestreo_por_evento(self):
+        muestreo = registro.Muestreo(por_segundo=2)
+        registros = [logging.LogRecord('editor', logging.INFO, __file__, 1, 'x', None, None) for _ in range(4)]
+        for record in registros:
+            record.created, record.evento = 100.0, 'edicion'
+        self.assertEqual([muestreo.filter(record) for record in registros], [True, True, False, False])
+
+
+class TicketsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.usuario = tickets.UsuarioTicket(1, 'ana')
+
+    def test_ticket_valido(self):
+        datos = tickets.verificar(tickets.emitir(self.usuario, 5, True))
+        self.assertEqual((datos['u'], datos['n'], datos['d']), (1, 'ana', '5'))
+        self.assertEqual(tickets.permisos(datos, '5'), (True, True))
+        # Es de otro documento
+        self.assertIsNone(tickets.permisos(datos, '6'))
+
+    def test_ticket_alterado(self):
+        cuerpo, firma = tickets.emitir(self.usuario, 5, False).rsplit(':', 1)
+        self.assertIsNone(tickets.verificar(f'{cuerpo}:{firma[::-1]}'))
+        self.assertIsNone(tickets.verificar(signing.dumps({'u': 1, 'd': '5', 'e': True}, salt='otra')))
+        self.assertIsNone(tickets.verificar(''))
+
+    def test_ticket_caducado(self):
+        ticket = tickets.emitir(self.usuario, 5, True)
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + tickets.SEGUNDOS + 1):
+            self.assertIsNone(tickets.verificar(ticket))
+
+    def test_cambio_de_permisos_invalida_los_anteriores(self):
+        datos = tickets.verificar(tickets.emitir(self.usuario, 7, True))
+        with mock.patch('editor.tickets.time.time', return_value=datos['t'] + 1):
+            tickets.permisos_cambiados(7)
+        self.assertIsNone(tickets.permisos(datos, '7'))
@@ -0,0 +1,98 @@
+"""
+Tickets firmados para conectar el socket de un documento sin leer la sesión.
+
+La vista ``documento`` emite un ticket con el usuario, el documento y si
+puede editar, firmado con ``SECRET_KEY`` y válido ``EDITOR_TICKET_SEGUNDOS``.
+El cliente lo pasa en ``?ticket=`` y ``MiddlewareTicket`` lo comprueba en
+memoria: con un ticket válido el socket no carga la sesión ni el ``User``.
+Sin ticket, o caducado, se sigue por ``AuthMiddlewareStack`` como siempre.
+
+El consumer envía un ticket nuevo al conectar y cada media vigencia, así una
+reconexión tras un corte de red no vuelve a la base de datos. Un cambio de
+permisos del documento invalida en el proceso los tickets emitidos antes; en
+los demás procesos el ticket vale hasta caducar.
+"""
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+from channels.auth import AuthMiddlewareStack
+from django.conf import settings
+from django.core import signing
+
+SEGUNDOS = getattr(settings, 'EDITOR_TICKET_SEGUNDOS', 300)
+SAL = 'editor.ticket'
+
+# Conexiones por método de autenticación: ticket o sesion
+autenticaciones = Counter()
+
+# doc_id -> instante del último cambio de permisos conocido en este proceso
+_permisos_cambiados = {}
+
+
+class UsuarioTicket:
+    """Usuario autenticado por ticket: lo que usa el consumer, sin cargar ``User``"""
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, username):
+        self.id = self.pk = id
+        self.username = username
+
+    def __str__(self):
+        return self.username
+
+
+def emitir(usuario, doc_id, puede_editar):
+    return signing.dumps(
+        {'u': usuario.id, 'n': usuario.username, 'd': str(doc_id), 'e': bool(puede_editar), 't': time.time()},
+        salt=SAL,
+    )
+
+
+def verificar(ticket):
+    """Datos del ticket si la firma es válida y no caducó; None si no"""
+    if not ticket:
+        return None
+    try:
+        return signing.loads(ticket, salt=SAL, max_age=SEGUNDOS)
+    except signing.BadSignature:
+        return None
+
+
+def permisos(datos, doc_id):
+    """(puede_ver, puede_editar) del ticket para ``doc_id``; None si hay que consultarlos"""
+    if datos is None or datos['d'] != str(doc_id):
+        return None
+    if datos['t'] <= _permisos_cambiados.get(str(doc_id), 0):
+        return None
+    return True, datos['e']
+
+
+def permisos_cambiados(doc_id):
+    """Los tickets del documento emitidos hasta ahora ya no sirven para sus permisos"""
+    ahora = time.time()
+    if len(_permisos_cambiados) >= 1024:
+        # Pasada la vigencia los tickets anteriores ya caducaron solos
+        for clave, instante in list(_permisos_cambiados.items()):
+            if instante < ahora - SEGUNDOS:
+                del _permisos_cambiados[clave]
+    _permisos_cambiados[str(doc_id)] = ahora
+
+
+class MiddlewareTicket:
+    """Autentica el socket con ``?ticket=``; sin ticket válido usa la sesión"""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.con_sesion = AuthMiddlewareStack(inner)
+
+    async def __call__(self, scope, receive, send):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        datos = verificar(query.get('ticket', [''])[0])
+        if datos is None:
+            autenticaciones['sesion'] += 1
+            return await self.con_sesion(scope, receive, send)
+        autenticaciones['ticket'] += 1
+        scope = dict(scope, user=UsuarioTicket(datos['u'], datos['n']), ticket=datos)
+        return await self.inner(scope, receive, send)
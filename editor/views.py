@@ -1,10 +1,70 @@
+from asgiref.sync import async_to_sync
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+import os
+from hashlib import blake2b
 from django.contrib import messages
-from django.db.models import Q
-from .models import Documento, PermisoDocumento
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Lower
+from django.http import JsonResponse
+from django.template.loader import get_template
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_POST
+from . import busqueda, historial, salas, tickets
+from .permisos import resolver
+from .models import Documento, PermisoDocumento, VersionDocumento
+from .notificaciones import notificar_documento_eliminado, notificar_permisos
+
+DOCUMENTOS_POR_PAGINA = getattr(settings, 'EDITOR_DOCUMENTOS_POR_PAGINA', 24)
+VERSIONES_POR_PAGINA = 50
+USUARIOS_POR_PAGINA = 20
+# Usuarios por envío del formulario de compartir
+COMPARTIR_MAX = 500
+
+# Lo que muestra cada tarjeta del dashboard; nunca el contenido
+CAMPOS_TARJETA = ('id', 'titulo', 'actualizado', 'vista_previa', 'tamano')
+
+def _version_plantilla(nombre):
+    """Fecha del archivo de la plantilla: al desplegar otra cambian los ETag de sus páginas"""
+    origen = get_template(nombre).origin.name
+    return os.stat(origen).st_mtime_ns if os.path.exists(origen) else 0
+
+def _respuesta_condicional(request, plantilla, contexto, partes, modificado):
+    """
+    Renderiza la página con ETag y Last-Modified, o responde 304 sin
+    renderizar si el navegador ya tiene esta misma versión. ``partes`` son
+    los datos que cambian la página; ``modificado``, su fecha más reciente.
+    ``contexto`` puede ser una función: solo se llama si hay que renderizar.
+    """
+    def renderizar():
+        return render(request, plantilla, contexto() if callable(contexto) else contexto)
+
+    if len(messages.get_messages(request)):
+        # Los avisos se muestran una sola vez: esta página no se revalida
+        respuesta = renderizar()
+        patch_cache_control(respuesta, private=True, no_store=True)
+        return respuesta
+    
+    etag = quote_etag(blake2b(
+        repr((_version_plantilla(plantilla), request.user.id, partes)).encode(),
+        digest_size=16,
+    ).hexdigest())
+    modificado = int(modificado.timestamp()) if modificado else None
+    respuesta = get_conditional_response(request, etag=etag, last_modified=modificado)
+    if respuesta is None:
+        respuesta = renderizar()
+    respuesta.headers['ETag'] = etag
+    if modificado:
+        respuesta.headers['Last-Modified'] = http_date(modificado)
+    # Páginas de cada usuario: el navegador las guarda pero las revalida siempre
+    patch_cache_control(respuesta, private=True, no_cache=True)
+    return respuesta
 
 def login_view(request):
     """Vista de login"""
@@ -60,21 +120,121 @@ def logout_view(request):
     messages.success(request, 'Sesión cerrada exitosamente')
     return redirect('login')
 
+def _leer_cursor(cursor):
+    """Convierte ``<actualizado ISO>_<id>`` en (fecha, id); None si no es válido"""
+    fecha, _, doc_id = (cursor or '').rpartition('_')
+    try:
+        fecha = parse_datetime(fecha)
+        doc_id = int(doc_id)
+    except ValueError:
+        return None
+    return (fecha, doc_id) if fecha else None
+
+
+def _pagina(documentos, cursor):
+    """Página por cursor sobre (-actualizado, -id) y el cursor de la siguiente"""
+    posicion = _leer_cursor(cursor)
+    if posicion:
+        fecha, doc_id = posicion
+        documentos = documentos.filter(
+            Q(actualizado__lt=fecha) | Q(actualizado=fecha, id__lt=doc_id)
+        )
+    pagina = list(documentos.order_by('-actualizado', '-id')[:DOCUMENTOS_POR_PAGINA + 1])
+    siguiente = None
+    if len(pagina) > DOCUMENTOS_POR_PAGINA:
+        pagina = pagina[:DOCUMENTOS_POR_PAGINA]
+        siguiente = f"{pagina[-1].actualizado.isoformat()}_{pagina[-1].id}"
+    return pagina, siguiente
+
+def _validador_dashboard(usuario):
+    """
+    Lo que cambia las listas del dashboard en una sola consulta sobre índices:
+    fecha más reciente y conteos de los documentos y de sus permisos. Cambiar
+    el contenido o el título mueve ``actualizado``; compartir, quitar o
+    cambiar un permiso mueve los conteos o el último id.
+    """
+    def agregar(consulta, grupo, agregado):
+        # Subconsulta agrupada por el usuario de la consulta externa
+        return Subquery(consulta.order_by().values(grupo).annotate(valor=agregado).values('valor'))
+
+    propios = Documento.objects.filter(propietario=OuterRef('pk'))
+    permisos_propios = PermisoDocumento.objects.filter(documento__propietario=OuterRef('pk'))
+    compartidos = PermisoDocumento.objects.filter(usuario=OuterRef('pk'))
+    return User.objects.filter(pk=usuario.pk).values(
+        propios_fecha=agregar(propios, 'propietario', Max('actualizado')),
+        propios_total=agregar(propios, 'propietario', Count('id')),
+        permisos_total=agregar(permisos_propios, 'documento__propietario', Count('id')),
+        permisos_ultimo=agregar(permisos_propios, 'documento__propietario', Max('id')),
+        compartidos_fecha=agregar(compartidos, 'usuario', Max('documento__actualizado')),
+        compartidos_total=agregar(compartidos, 'usuario', Count('id')),
+        compartidos_edicion=agregar(compartidos, 'usuario', Count('id', filter=Q(puede_editar=True))),
+        compartidos_ultimo=agregar(compartidos, 'usuario', Max('id')),
+    ).get()
+
+def _enlace(request, **cambios):
+    """Query string de esta página con ``cambios``; None quita el parámetro"""
+    parametros = request.GET.copy()
+    for clave, valor in cambios.items():
+        if valor is None:
+            parametros.pop(clave, None)
+        else:
+            parametros[clave] = valor
+    return f'?{parametros.urlencode()}'
+
 @login_required
 def dashboard(request):
     """Dashboard con documentos del usuario"""
-    # Documentos propios
-    documentos_propios = Documento.objects.filter(propietario=request.user)
+    # Si nada cambió desde la última visita el navegador reutiliza la página
+    # sin cargar las listas
+    validador = _validador_dashboard(request.user)
+    partes = (request.GET.urlencode(), sorted(validador.items()))
+    modificado = max(
+        (fecha for fecha in (validador['propios_fecha'], validador['compartidos_fecha']) if fecha),
+        default=None,
+    )
+    return _respuesta_condicional(
+        request, 'editor/dashboard.html', lambda: _contexto_dashboard(request, validador), partes, modificado,
+    )
+
+def _contexto_dashboard(request, validador):
+    # Documentos propios, con cuántos usuarios los comparten
+    propios = Documento.objects.filter(propietario=request.user)
+    cursor_propios = request.GET.get('propios')
+    documentos_propios, siguiente_propios = _pagina(
+        propios.only(*CAMPOS_TARJETA).annotate(compartido_con=Count('permisos')),
+        cursor_propios,
+    )
     
-    # Documentos compartidos conmigo
-    documentos_compartidos = Documento.objects.filter(
-        permisos__usuario=request.user
-    ).distinct()
+    # Documentos compartidos conmigo: el permiso y el propietario en la misma consulta
+    compartidos = Documento.objects.filter(permisos__usuario=request.user)
+    cursor_compartidos = request.GET.get('compartidos')
+    documentos_compartidos, siguiente_compartidos = _pagina(
+        compartidos.only(*CAMPOS_TARJETA).annotate(
+            permiso_edicion=F('permisos__puede_editar'),
+            propietario_nombre=F('propietario__username'),
+        ),
+        cursor_compartidos,
+    )
     
-    return render(request, 'editor/dashboard.html', {
+    # Búsqueda en propios y compartidos
+    consulta = request.GET.get('q', '').strip()
+    resultados = busqueda.buscar(request.user, consulta) if consulta else None
+    
+    # Los enlaces de página conservan la búsqueda y la página de la otra lista
+    return {
+        'consulta': consulta,
+        'resultados': resultados,
         'documentos_propios': documentos_propios,
         'documentos_compartidos': documentos_compartidos,
-    })
+        'total_propios': validador['propios_total'] or 0,
+        'total_compartidos': validador['compartidos_total'] or 0,
+        'recientes_propios': _enlace(request, propios=None) if cursor_propios else None,
+        'siguiente_propios': _enlace(request, propios=siguiente_propios) if siguiente_propios else None,
+        'recientes_compartidos': _enlace(request, compartidos=None) if cursor_compartidos else None,
+        'siguiente_compartidos': (
+            _enlace(request, compartidos=siguiente_compartidos) if siguiente_compartidos else None
+        ),
+    }
 
 @login_required
 def crear_documento(request):
@@ -96,7 +256,8 @@ def crear_documento(request):
 @login_required
 def documento(request, doc_id):
     """Vista del editor de documento"""
-    doc = get_object_or_404(Documento, id=doc_id)
+    # El contenido llega por el socket: la página no lo carga ni lo incluye
+    doc = resolver(request, doc_id)
     
     # Verificar permisos
     if not doc.puede_ver(request.user):
@@ -106,97 +267,273 @@ def documento(request, doc_id):
     # Verificar si puede editar
     puede_editar = doc.puede_editar(request.user)
     
-    # Obtener usuarios con permisos
-    permisos = PermisoDocumento.objects.filter(documento=doc).select_related('usuario')
+    # Cuántos usuarios tienen permisos
+    total_permisos = PermisoDocumento.objects.filter(documento=doc).count()
+    es_propietario = doc.es_propietario(request.user)
     
-    return render(request, 'editor/documento.html', {
+    # La página no incluye el contenido: solo cambia con el título, el acceso
+    # y los permisos, así el navegador la reutiliza aunque se edite el texto
+    partes = (doc.id, doc.titulo, doc.propietario.username, puede_editar, es_propietario, total_permisos)
+    return _respuesta_condicional(request, 'editor/documento.html', {
         'documento': doc,
         'puede_editar': puede_editar,
-        'es_propietario': doc.propietario == request.user,
-        'permisos': permisos,
-    })
+        'es_propietario': es_propietario,
+        'total_permisos': total_permisos,
+        # Fuera del ETag: con una página de la caché el ticket puede haber
+        # caducado y el socket usa la sesión hasta recibir uno nuevo
+        'ticket': tickets.emitir(request.user, doc.id, puede_editar),
+    }, partes, doc.actualizado)
+
+def _nombres_compartir(request):
+    """Usuarios elegidos en el formulario: ``usernames`` repetido o separados por comas en ``username``"""
+    nombres = request.POST.getlist('usernames')
+    nombres += request.POST.get('username', '').replace(',', ' ').split()
+    return list(dict.fromkeys(nombre.strip() for nombre in nombres if nombre.strip()))
+
+def compartir_con(doc, propietario, nombres, puede_editar):
+    """
+    Comparte el documento con varios usuarios a la vez: crea los permisos que
+    faltan y actualiza los que cambian, con una escritura de cada tipo, y
+    avisa a los sockets de todos ellos con un solo mensaje.
+    Devuelve (creados, actualizados, inexistentes) como listas de nombres.
+    """
+    usuarios = dict(
+        User.objects.filter(username__in=nombres).exclude(id=propietario.id).values_list('id', 'username')
+    )
+    inexistentes = [
+        nombre for nombre in nombres
+        if nombre not in usuarios.values() and nombre != propietario.username
+    ]
+    
+    existentes = {
+        permiso.usuario_id: permiso
+        for permiso in PermisoDocumento.objects.filter(documento=doc, usuario_id__in=usuarios)
+    }
+    nuevos = [
+        PermisoDocumento(documento=doc, usuario_id=usuario_id, puede_editar=puede_editar, compartido_por=propietario)
+        for usuario_id in usuarios if usuario_id not in existentes
+    ]
+    cambiados = [permiso for permiso in existentes.values() if permiso.puede_editar != puede_editar]
+    for permiso in cambiados:
+        permiso.puede_editar = puede_editar
+    
+    with transaction.atomic():
+        PermisoDocumento.objects.bulk_create(nuevos, ignore_conflicts=True)
+        PermisoDocumento.objects.bulk_update(cambiados, ['puede_editar'])
+    
+    # Avisar a los sockets abiertos de los usuarios afectados
+    afectados = [permiso.usuario_id for permiso in (*nuevos, *cambiados)]
+    if afectados:
+        notificar_permisos(doc.id, afectados)
+    
+    return (
+        [usuarios[permiso.usuario_id] for permiso in nuevos],
+        [usuarios[permiso.usuario_id] for permiso in cambiados],
+        inexistentes,
+    )
 
 @login_required
 def compartir_documento(request, doc_id):
-    """Compartir documento con otro usuario"""
-    doc = get_object_or_404(Documento, id=doc_id)
+    """Compartir documento con uno o varios usuarios"""
+    doc = resolver(request, doc_id)
     
     # Solo el propietario puede compartir
-    if doc.propietario != request.user:
+    if not doc.es_propietario(request.user):
         messages.error(request, 'Solo el propietario puede compartir este documento')
         return redirect('documento', doc_id=doc_id)
     
     if request.method == 'POST':
-        username = request.POST.get('username')
+        nombres = _nombres_compartir(request)
         puede_editar = request.POST.get('puede_editar') == 'on'
         
-        try:
-            usuario = User.objects.get(username=username)
-            
-            # No compartir consigo mismo
-            if usuario == request.user:
-                messages.error(request, 'No puedes compartir el documento contigo mismo')
-            else:
-                # Crear o actualizar permiso
-                permiso, created = PermisoDocumento.objects.get_or_create(
-                    documento=doc,
-                    usuario=usuario,
-                    defaults={
-                        'puede_editar': puede_editar,
-                        'compartido_por': request.user
-                    }
-                )
-                
-                if not created:
-                    permiso.puede_editar = puede_editar
-                    permiso.save()
-                    messages.success(request, f'Permisos actualizados para {username}')
-                else:
-                    messages.success(request, f'Documento compartido con {username}')
+        if not nombres:
+            messages.error(request, 'Indica al menos un nombre de usuario')
+            return redirect('compartir_documento', doc_id=doc_id)
+        if request.user.username in nombres:
+            messages.error(request, 'No puedes compartir el documento contigo mismo')
+        if len(nombres) > COMPARTIR_MAX:
+            messages.error(request, f'Puedes compartir con {COMPARTIR_MAX} usuarios a la vez como máximo')
+            return redirect('compartir_documento', doc_id=doc_id)
         
-        except User.DoesNotExist:
-            messages.error(request, f'El usuario "{username}" no existe')
+        creados, actualizados, inexistentes = compartir_con(doc, request.user, nombres, puede_editar)
+        if creados:
+            messages.success(request, f'Documento compartido con {", ".join(creados)}')
+        if actualizados:
+            messages.success(request, f'Permisos actualizados para {", ".join(actualizados)}')
+        if inexistentes:
+            messages.error(request, f'No existen los usuarios: {", ".join(inexistentes)}')
         
         return redirect('documento', doc_id=doc_id)
     
-    # GET: Listar todos los usuarios disponibles
-    usuarios_disponibles = User.objects.exclude(id=request.user.id)
+    # GET: los usuarios se buscan por prefijo desde la página (buscar_usuarios)
+    permisos = PermisoDocumento.objects.filter(documento=doc).select_related('usuario')
     
     return render(request, 'editor/compartir.html', {
         'documento': doc,
-        'usuarios_disponibles': usuarios_disponibles,
+        'permisos': permisos,
     })
 
+@login_required
+def buscar_usuarios(request):
+    """Usuarios cuyo nombre empieza por ``q``, en JSON y por páginas de ``USUARIOS_POR_PAGINA``"""
+    prefijo = request.GET.get('q', '').strip()
+    despues = request.GET.get('despues', '')
+    
+    # Rango sobre el índice de LOWER(username) (migración 0007) en lugar de
+    # LIKE, que recorre la tabla; la base de datos pasa a minúsculas los dos
+    # lados, así no distingue mayúsculas igual que antes icontains
+    usuarios = User.objects.exclude(id=request.user.id).alias(nombre=Lower('username'))
+    usuarios = usuarios.filter(nombre__gte=Lower(Value(prefijo)))
+    if prefijo:
+        usuarios = usuarios.filter(nombre__lt=Lower(Value(prefijo + '\U0010ffff')))
+    if despues:
+        # Después de (nombre en minúsculas, username) del último de la página
+        usuarios = usuarios.filter(
+            Q(nombre__gt=Lower(Value(despues))) | Q(nombre=Lower(Value(despues)), username__gt=despues)
+        )
+    nombres = list(
+        usuarios.order_by('nombre', 'username').values_list('username', flat=True)[:USUARIOS_POR_PAGINA + 1]
+    )
+    
+    siguiente = None
+    if len(nombres) > USUARIOS_POR_PAGINA:
+        nombres = nombres[:USUARIOS_POR_PAGINA]
+        siguiente = nombres[-1]
+    return JsonResponse({'usuarios': nombres, 'siguiente': siguiente})
+
 @login_required
 def eliminar_permiso(request, doc_id, permiso_id):
     """Eliminar permiso de un usuario"""
-    doc = get_object_or_404(Documento, id=doc_id)
+    doc = resolver(request, doc_id)
     
     # Solo el propietario puede eliminar permisos
-    if doc.propietario != request.user:
+    if not doc.es_propietario(request.user):
         messages.error(request, 'No tienes permiso para realizar esta acción')
         return redirect('documento', doc_id=doc_id)
     
-    permiso = get_object_or_404(PermisoDocumento, id=permiso_id, documento=doc)
+    permiso = get_object_or_404(PermisoDocumento.objects.select_related('usuario'), id=permiso_id, documento=doc)
     username = permiso.usuario.username
+    usuario_id = permiso.usuario_id
     permiso.delete()
     
+    # Cerrar de inmediato los sockets abiertos del usuario
+    notificar_permisos(doc.id, [usuario_id])
+    
     messages.success(request, f'Permiso revocado para {username}')
     return redirect('documento', doc_id=doc_id)
 
 @login_required
 def eliminar_documento(request, doc_id):
     """Eliminar documento (solo propietario)"""
-    doc = get_object_or_404(Documento, id=doc_id)
+    doc = resolver(request, doc_id)
     
-    if doc.propietario != request.user:
+    if not doc.es_propietario(request.user):
         messages.error(request, 'Solo el propietario puede eliminar este documento')
         return redirect('dashboard')
     
     if request.method == 'POST':
         titulo = doc.titulo
         doc.delete()
+        notificar_documento_eliminado(doc_id)
         messages.success(request, f'Documento "{titulo}" eliminado exitosamente')
         return redirect('dashboard')
     
-    return render(request, 'editor/eliminar_documento.html', {'documento': doc})
\ No newline at end of file
+    return render(request, 'editor/eliminar_documento.html', {'documento': doc})
+
+def _pagina_versiones(doc, antes):
+    """Versiones más recientes que ``antes`` (id) y el cursor de la siguiente página"""
+    versiones = doc.versiones.only('id', 'documento', 'revision', 'creado', 'tamano', 'distancia')
+    if antes and antes.isdigit():
+        versiones = versiones.filter(id__lt=int(antes))
+    versiones = list(versiones[:VERSIONES_POR_PAGINA + 1])
+    siguiente = None
+    if len(versiones) > VERSIONES_POR_PAGINA:
+        versiones = versiones[:VERSIONES_POR_PAGINA]
+        siguiente = versiones[-1].id
+    return versiones, siguiente
+
+@login_required
+def historial_documento(request, doc_id):
+    """Versiones guardadas del documento y vista previa de una de ellas"""
+    doc = resolver(request, doc_id)
+    
+    if not doc.puede_ver(request.user):
+        messages.error(request, 'No tienes permiso para ver este documento')
+        return redirect('dashboard')
+    
+    versiones, siguiente = _pagina_versiones(doc, request.GET.get('antes'))
+    
+    seleccionada = None
+    contenido = None
+    if request.GET.get('version', '').isdigit():
+        seleccionada = get_object_or_404(VersionDocumento, id=request.GET['version'], documento=doc)
+        contenido = historial.contenido_version(seleccionada)
+    
+    return render(request, 'editor/historial.html', {
+        'documento': doc,
+        'versiones': versiones,
+        'siguiente': siguiente,
+        'seleccionada': seleccionada,
+        'contenido': contenido,
+        'puede_editar': doc.puede_editar(request.user),
+    })
+
+@login_required
+def versiones_api(request, doc_id):
+    """Versiones del documento en JSON, las más recientes primero"""
+    doc = resolver(request, doc_id)
+    if not doc.puede_ver(request.user):
+        return JsonResponse({'error': 'No tienes permiso para ver este documento'}, status=403)
+    
+    versiones, siguiente = _pagina_versiones(doc, request.GET.get('antes'))
+    return JsonResponse({
+        'versiones': [
+            {
+                'id': version.id,
+                'revision': version.revision,
+                'creado': version.creado.isoformat(),
+                'tamano': version.tamano,
+                'instantanea': version.distancia == 0,
+            }
+            for version in versiones
+        ],
+        'siguiente': siguiente,
+    })
+
+@login_required
+def version_api(request, doc_id, version_id):
+    """Contenido del documento en una versión, en JSON"""
+    doc = resolver(request, doc_id)
+    if not doc.puede_ver(request.user):
+        return JsonResponse({'error': 'No tienes permiso para ver este documento'}, status=403)
+    
+    version = get_object_or_404(VersionDocumento, id=version_id, documento=doc)
+    return JsonResponse({
+        'id': version.id,
+        'revision': version.revision,
+        'creado': version.creado.isoformat(),
+        'contenido': historial.contenido_version(version),
+    })
+
+@login_required
+@require_POST
+def restaurar_version(request, doc_id, version_id):
+    """Restaurar el documento a una versión anterior (quien puede editar)"""
+    doc = resolver(request, doc_id)
+    
+    if not doc.puede_editar(request.user):
+        messages.error(request, 'No tienes permiso para editar este documento')
+        return redirect('documento', doc_id=doc_id)
+    
+    version = get_object_or_404(VersionDocumento, id=version_id, documento=doc)
+    contenido = historial.contenido_version(version)
+    
+    # La sala del documento (abierta para la ocasión si no lo estaba) aplica
+    # la restauración como una edición más y la guarda con su revisión.
+    # Revisión y época son None si la aplicó la sala de otro proceso
+    revision, epoca = async_to_sync(salas.restaurar)(doc.id, contenido) or (None, None)
+    
+    messages.success(request, f'Documento restaurado a la revisión {version.revision}')
+    if request.accepts('text/html'):
+        return redirect('documento', doc_id=doc_id)
+    return JsonResponse({'revision': revision, 'epoca': epoca})
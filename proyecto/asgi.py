@@ -7,14 +7,17 @@ django_asgi_app = get_asgi_application()
 
 # Ahora sí, importar channels
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
+from editor.metricas import con_metricas
 from editor.routing import websocket_urlpatterns
+from editor.tickets import MiddlewareTicket
 
 application = ProtocolTypeRouter({
-    "http": django_asgi_app,
+    # Las métricas se atienden sin pasar por el middleware de Django
+    "http": con_metricas(django_asgi_app),
+    # Con ?ticket= válido el socket no lee la sesión; sin él, AuthMiddlewareStack
     "websocket": AllowedHostsOriginValidator(
-        AuthMiddlewareStack(
+        MiddlewareTicket(
             URLRouter(
                 websocket_urlpatterns
             )
@@ -78,19 +78,119 @@ TEMPLATES = [
 ASGI_APPLICATION = 'proyecto.asgi.application'
 
 # Database
+# SQLite con perfil de producción (editor/motor_sqlite): WAL para que las
+# lecturas no esperen a las escrituras, synchronous=NORMAL (seguro con WAL),
+# mmap y caché de páginas, transacciones con BEGIN IMMEDIATE y espera de
+# cerrojo. Sin conexiones persistentes por defecto: con ASGI cada petición
+# corre en un hilo nuevo y su conexión no se volvería a usar
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'editor.motor_sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.environ.get('EDITOR_SQLITE_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': float(os.environ.get('EDITOR_SQLITE_TIMEOUT', '20')),
+            'pragmas': {
+                # DELETE si la base de datos está en un sistema de archivos de
+                # red, donde WAL no funciona
+                'journal_mode': os.environ.get('EDITOR_SQLITE_JOURNAL', 'WAL'),
+                'synchronous': 'NORMAL',
+                'mmap_size': int(os.environ.get('EDITOR_SQLITE_MMAP', str(256 * 1024 * 1024))),
+                # Negativo: en KiB
+                'cache_size': -int(os.environ.get('EDITOR_SQLITE_CACHE_KB', str(64 * 1024))),
+                'temp_store': 'MEMORY',
+            },
+        },
     }
 }
 
+# Escrituras de documentos agrupadas por transacción en el escritor único.
+# Hay uno por proceso: con varios workers se turnan en el cerrojo de SQLite
+# (EDITOR_SQLITE_TIMEOUT), igual que las escrituras de las vistas
+EDITOR_ESCRITOR_LOTE = int(os.environ.get('EDITOR_ESCRITOR_LOTE', '64'))
+
 # Channel Layers - Sin Redis para Azure for Students
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+# Con varios workers de Daphne (manage.py servir) se comparte un broker local
+# por socket Unix; con uno solo basta la capa en memoria
+EDITOR_WORKERS = int(os.environ.get('EDITOR_WORKERS', '1'))
+EDITOR_BROKER_SOCKET = os.environ.get('EDITOR_BROKER_SOCKET', '/tmp/editor-canales.sock')
+
+if EDITOR_WORKERS > 1:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "editor.capa_canales.UnixSocketChannelLayer",
+            "CONFIG": {
+                "socket_path": EDITOR_BROKER_SOCKET,
+            },
+        }
     }
-}
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer"
+        }
+    }
+
+# Guardado diferido de documentos: intervalo en segundos y bytes modificados
+# que fuerzan una escritura antes de que venza el intervalo
+EDITOR_GUARDADO_INTERVALO = float(os.environ.get('EDITOR_GUARDADO_INTERVALO', '2'))
+EDITOR_GUARDADO_MAX_BYTES = int(os.environ.get('EDITOR_GUARDADO_MAX_BYTES', str(64 * 1024)))
+
+# Contenido de los documentos comprimido con zlib en la base de datos a partir
+# de este tamaño en bytes. Desactivado (por defecto) la columna es de texto y
+# admite icontains; lo ya comprimido se sigue leyendo
+EDITOR_COMPRIMIR_CONTENIDO = os.environ.get('EDITOR_COMPRIMIR_CONTENIDO', 'False') == 'True'
+EDITOR_CONTENIDO_UMBRAL = int(os.environ.get('EDITOR_CONTENIDO_UMBRAL', '512'))
+
+# Tramas binarias del editor (msgpack) a partir de este tamaño van comprimidas
+EDITOR_UMBRAL_COMPRESION = int(os.environ.get('EDITOR_UMBRAL_COMPRESION', '1024'))
+
+# Control de flujo por conexión: bytes enviados sin confirmar antes de agrupar
+# las operaciones, y segundos sin leer antes de desconectar al cliente
+EDITOR_VENTANA_BYTES = int(os.environ.get('EDITOR_VENTANA_BYTES', str(512 * 1024)))
+EDITOR_ESPERA_MAX = float(os.environ.get('EDITOR_ESPERA_MAX', '30'))
+
+# Los sockets de solo lectura reciben el estado completo como mucho una vez
+# por este intervalo (segundos), en lugar de cada operación
+EDITOR_INTERVALO_LECTORES = float(os.environ.get('EDITOR_INTERVALO_LECTORES', '1'))
+
+# Los documentos con más caracteres que esto se envían al conectar en varias
+# tramas de este tamaño, al ritmo que el cliente confirma
+EDITOR_TAMANO_FRAGMENTO = int(os.environ.get('EDITOR_TAMANO_FRAGMENTO', str(64 * 1024)))
+
+# Vigencia de los tickets firmados con que el socket conecta sin leer la
+# sesión; el consumer envía uno nuevo a media vigencia
+EDITOR_TICKET_SEGUNDOS = int(os.environ.get('EDITOR_TICKET_SEGUNDOS', '300'))
+
+# Las salas sin conexiones se conservan en memoria (reconectar no lee la base
+# de datos) hasta que todas juntas ocupan estos bytes; 0 las libera al momento
+EDITOR_SALAS_MEMORIA_BYTES = int(os.environ.get('EDITOR_SALAS_MEMORIA_BYTES', str(64 * 1024 * 1024)))
+
+# Límites por proceso: ediciones por segundo (y ráfaga) de cada usuario y de
+# cada documento, tamaño máximo de una trama y sockets abiertos (0 = sin límite)
+EDITOR_LIMITE_USUARIO_RITMO = float(os.environ.get('EDITOR_LIMITE_USUARIO_RITMO', '20'))
+EDITOR_LIMITE_USUARIO_RAFAGA = int(os.environ.get('EDITOR_LIMITE_USUARIO_RAFAGA', '40'))
+EDITOR_LIMITE_DOCUMENTO_RITMO = float(os.environ.get('EDITOR_LIMITE_DOCUMENTO_RITMO', '100'))
+EDITOR_LIMITE_DOCUMENTO_RAFAGA = int(os.environ.get('EDITOR_LIMITE_DOCUMENTO_RAFAGA', '200'))
+EDITOR_MENSAJE_MAX_BYTES = int(os.environ.get('EDITOR_MENSAJE_MAX_BYTES', str(4 * 1024 * 1024)))
+EDITOR_SOCKETS_MAX = int(os.environ.get('EDITOR_SOCKETS_MAX', '2000'))
+
+# Métricas en formato Prometheus, servidas antes del middleware de Django;
+# la consulta debe enviar 'Authorization: Bearer <token>'. Sin token la
+# ruta no se sirve
+EDITOR_METRICAS_RUTA = os.environ.get('EDITOR_METRICAS_RUTA', '/metrics')
+EDITOR_METRICAS_TOKEN = os.environ.get('EDITOR_METRICAS_TOKEN', '')
+
+# Documentos por página en cada lista del dashboard
+EDITOR_DOCUMENTOS_POR_PAGINA = int(os.environ.get('EDITOR_DOCUMENTOS_POR_PAGINA', '24'))
+
+# Resultados como máximo de la búsqueda de texto completo
+EDITOR_BUSQUEDA_RESULTADOS = int(os.environ.get('EDITOR_BUSQUEDA_RESULTADOS', '20'))
+
+# Historial de versiones: una de cada tantas guarda el contenido completo y
+# las demás solo las operaciones desde la anterior
+EDITOR_VERSIONES_DISTANCIA = int(os.environ.get('EDITOR_VERSIONES_DISTANCIA', '50'))
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -149,6 +249,13 @@ if not DEBUG:
     SECURE_HSTS_PRELOAD = True
 
 # Configuración de logging para Azure
+# Los logs se encolan y los escribe un hilo aparte (el event loop no espera
+# a la consola); formato 'json' o 'texto', registros en cola antes de
+# descartar y mensajes por segundo de cada evento frecuente (cada edición)
+EDITOR_LOG_FORMATO = os.environ.get('EDITOR_LOG_FORMATO', 'json')
+EDITOR_LOG_COLA = int(os.environ.get('EDITOR_LOG_COLA', '10000'))
+EDITOR_LOG_EVENTOS_POR_SEGUNDO = int(os.environ.get('EDITOR_LOG_EVENTOS_POR_SEGUNDO', '10'))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -157,11 +264,23 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'editor.registro.FormatoJSON',
+        },
+    },
+    'filters': {
+        'muestreo': {
+            '()': 'editor.registro.Muestreo',
+            'por_segundo': EDITOR_LOG_EVENTOS_POR_SEGUNDO,
+        },
     },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
+            'class': 'editor.registro.ManejadorEnCola',
+            'formatter': 'json' if EDITOR_LOG_FORMATO == 'json' else 'verbose',
+            'filters': ['muestreo'],
+            'stream': 'ext://sys.stderr',
+            'capacidad': EDITOR_LOG_COLA,
         },
     },
     'root': {
@@ -18,4 +18,11 @@ urlpatterns = [
     path('documento/<int:doc_id>/compartir/', views.compartir_documento, name='compartir_documento'),
     path('documento/<int:doc_id>/permiso/<int:permiso_id>/eliminar/', views.eliminar_permiso, name='eliminar_permiso'),
     path('documento/<int:doc_id>/eliminar/', views.eliminar_documento, name='eliminar_documento'),
+    path('documento/<int:doc_id>/historial/', views.historial_documento, name='historial_documento'),
+    path('documento/<int:doc_id>/versiones/', views.versiones_api, name='versiones_api'),
+    path('documento/<int:doc_id>/versiones/<int:version_id>/', views.version_api, name='version_api'),
+    path('documento/<int:doc_id>/versiones/<int:version_id>/restaurar/', views.restaurar_version, name='restaurar_version'),
+    
+    # Usuarios (selector de compartir)
+    path('usuarios/buscar/', views.buscar_usuarios, name='buscar_usuarios'),
 ]
\ No newline at end of file
@@ -27,7 +27,8 @@ echo "✅ Verificando tablas de base de datos..."
 python manage.py showmigrations
 
 echo "✅ Configuración completada exitosamente"
-echo "🌐 Iniciando servidor Daphne en puerto 8000..."
+echo "🌐 Iniciando servidor Daphne en puerto 8000 con ${DAPHNE_WORKERS:-$(nproc)} worker(s)..."
 
-# Iniciar Daphne en el puerto 8000
-exec daphne -b 0.0.0.0 -p 8000 proyecto.asgi:application
\ No newline at end of file
+# Iniciar Daphne en el puerto 8000: un worker por núcleo (DAPHNE_WORKERS para
+# cambiarlo) que comparten el broker de canales local, sin Redis
+exec python manage.py servir --workers "${DAPHNE_WORKERS:-$(nproc)}" --puerto 8000
\ No newline at end of file